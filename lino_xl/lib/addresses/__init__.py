@@ -14,6 +14,7 @@ per partner.
     mixins
     models
     fixtures.demo2
+    management.commands.check_addresses
 
 Some unit test cases are :mod:`lino.projects.min2.tests.test_addresses`.
 
@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: check_addresses
+
+Run the :class:`AddressOwnerChecker
+<lino_xl.lib.addresses.mixins.AddressOwnerChecker>` on all address
+owners at once.  This is much faster than :manage:`checkdata` because
+it doesn't check every owner separately.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.addresses.mixins import AddressOwnerChecker
+
+
+class Command(BaseCommand):
+    help = "Check the address records of all address owners."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            dest='fix', default=False,
+                            help='Fix the problems which can be fixed.')
+
+    def handle(self, *args, **options):
+        chk = AddressOwnerChecker.self
+        todo, done = chk.check_all(options['fix'])
+        dblogger.info("Found %d and fixed %d address problems.", todo, done)
@@ -9,7 +9,10 @@ Model mixins for `lino_xl.lib.addresses`.
 
 from __future__ import unicode_literals
 from __future__ import print_function
+from builtins import str
 
+from django.db import transaction
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
 from lino.api import rt, dd
@@ -17,6 +20,8 @@ from lino.utils.xmlgen.html import E
 from lino.core.diff import ChangeWatcher
 from lino.modlib.plausibility.choicelists import Checker
 
+from lino_xl.lib.xl.utils import make_problem, replace_problems
+
 from .choicelists import AddressTypes
 
 
@@ -90,6 +95,9 @@ class AddressOwnerChecker(Checker):
       address record from these, using `AddressTypes.official` as
       type.
 
+    Use :meth:`check_all` (or the :manage:`check_addresses` command)
+    to check all owners at once.
+
     """
     verbose_name = _("Check for missing or non-primary address records")
     model = AddressOwner
@@ -100,64 +108,167 @@ class AddressOwnerChecker(Checker):
         multiple_primary=_("Multiple primary addresses."),
         primary_differs=_("Primary address differs from owner address ({0})."),
     )
-    
-    def get_plausibility_problems(self, obj, fix=False):
+    chunk_size = 500
+
+    def get_address_fields(self):
+        """Return a list of the names and attnames of the address
+        fields."""
+        Address = rt.modules.addresses.Address
+        return [(k, Address._meta.get_field(k).attname)
+                for k in sorted(Address.ADDRESS_FIELDS)]
+
+    def format_value(self, name, value):
         Address = rt.modules.addresses.Address
-        qs = Address.objects.filter(partner=obj)
-        num = qs.count()
-        if num == 0:
-            kw = dict()
-            for fldname in Address.ADDRESS_FIELDS:
-                value = getattr(obj, fldname)
-                if value:
-                    kw[fldname] = value
-            if kw:
-                yield (True, self.messages['no_address'])
-                if fix:
-                    kw.update(partner=obj, primary=True)
-                    kw.update(address_type=AddressTypes.official)
-                    addr = Address(**kw)
-                    addr.full_clean()
-                    addr.save()
+        fld = Address._meta.get_field(name)
+        if value and fld.rel is not None:
+            return fld.rel.model.objects.get(pk=value)
+        return value
+
+    def get_address_problems(self, owner, addresses):
+        """Yield a `(fixable, message, fix)` tuple for every problem of an
+        owner having the given address values and the given addresses.
+
+        `owner` is a dict mapping the attnames of the address fields
+        to their values.  `addresses` is a list of dicts with these
+        keys plus `id` and `primary`.  `fix` is either `None`,
+        ``'create'`` (create a primary address from the owner's
+        fields) or the id of an address to mark as primary.
+
+        """
+        fields = self.get_address_fields()
+        if len(addresses) == 0:
+            if [a for k, a in fields if owner[a]]:
+                yield (True, self.messages['no_address'], 'create')
             return
-    
-        def getdiffs(obj, addr):
-            diffs = {}
-            for k in Address.ADDRESS_FIELDS:
-                my = getattr(addr, k)
-                other = getattr(obj, k)
-                if my != other:
-                    diffs[k] = (my, other)
-            return diffs
-
-        if num == 1:
-            addr = qs[0]
-            # check whether it is the same address than the one
-            # specified on AddressOwner
-            diffs = getdiffs(obj, addr)
+
+        def getdiffs(addr):
+            return [(k, addr[a], owner[a]) for k, a in fields
+                    if addr[a] != owner[a]]
+
+        addr = None
+        if len(addresses) == 1:
+            addr = addresses[0]
+            diffs = getdiffs(addr)
             if not diffs:
-                if not addr.primary:
-                    yield (True, self.messages['unique_not_primary'])
-                    if fix:
-                        addr.primary = True
-                        addr.full_clean()
-                        addr.save()
+                if not addr['primary']:
+                    yield (True, self.messages['unique_not_primary'],
+                           addr['id'])
                 return
         else:
-            addr = None
-            qs = qs.filter(primary=True)
-            num = qs.count()
-            if num == 0:
-                yield (False, self.messages['no_primary'])
-            elif num == 1:
-                addr = qs[0]
-                diffs = getdiffs(obj, addr)
+            primary = [a for a in addresses if a['primary']]
+            if len(primary) == 0:
+                yield (False, self.messages['no_primary'], None)
+            elif len(primary) == 1:
+                addr = primary[0]
+                diffs = getdiffs(addr)
             else:
-                yield (False, self.messages['multiple_primary'])
+                yield (False, self.messages['multiple_primary'], None)
         if addr and diffs:
             diffstext = [
-                _("{0}:{1}->{2}").format(k, *v) for k, v in diffs.items()]
+                _("{0}:{1}->{2}").format(
+                    k, self.format_value(k, my), self.format_value(k, other))
+                for k, my, other in diffs]
             msg = self.messages['primary_differs'].format(', '.join(diffstext))
-            yield (False, msg)
+            yield (False, msg, None)
+
+    def get_plausibility_problems(self, obj, fix=False):
+        Address = rt.modules.addresses.Address
+        fields = self.get_address_fields()
+        owner = dict([(a, getattr(obj, a)) for k, a in fields])
+        addresses = list(Address.objects.filter(partner=obj).values(
+            'id', 'primary', *[a for k, a in fields]))
+        for fixable, msg, todo in self.get_address_problems(
+                owner, addresses):
+            yield (fixable, msg)
+            if not fix or todo is None:
+                continue
+            if todo == 'create':
+                kw = dict([(k, getattr(obj, k)) for k, a in fields
+                           if owner[a]])
+                kw.update(partner=obj, primary=True)
+                kw.update(address_type=AddressTypes.official)
+                addr = Address(**kw)
+            else:
+                addr = Address.objects.get(pk=todo)
+                addr.primary = True
+            addr.full_clean()
+            addr.save()
+
+    def check_all(self, fix=False):
+        """Check all address owners at once and replace the plausibility
+        problems reported by this checker.  Return a tuple `(todo,
+        done)` with the number of problems found and fixed.
+
+        Unlike the :manage:`checkdata` command, this reads the owners
+        and their addresses as two ordered streams, and writes
+        problems and fixes using bulk operations.
+
+        """
+        todo = done = 0
+        for m in self.get_checkable_models():
+            a, b = self.check_model(m, fix)
+            todo += a
+            done += b
+        return (todo, done)
+
+    def check_model(self, model, fix=False):
+        Address = rt.modules.addresses.Address
+        ContentType = rt.modules.contenttypes.ContentType
+        fields = self.get_address_fields()
+        attnames = [a for k, a in fields]
+        ct = ContentType.objects.get_for_model(model)
+        user = self.get_responsible_user(None)
+        if user is None:
+            lang = dd.get_default_language()
+        else:
+            lang = user.language
+
+        addresses = Address.objects.order_by('partner_id', 'id').values(
+            'id', 'partner_id', 'primary', *attnames).iterator()
+        next_addr = next(addresses, None)
+
+        problems = []
+        num_todo = 0
+        to_create = []
+        to_mark = []
+        num_done = 0
+        with translation.override(lang):
+            for row in model.objects.order_by('pk').values(
+                    'pk', *attnames).iterator():
+                pk = row['pk']
+                mine = []
+                while next_addr is not None \
+                        and next_addr['partner_id'] <= pk:
+                    if next_addr['partner_id'] == pk:
+                        mine.append(next_addr)
+                    next_addr = next(addresses, None)
+                todo = []
+                for fixable, msg, action in self.get_address_problems(
+                        row, mine):
+                    if fixable and fix and action is not None:
+                        num_done += 1
+                        if action == 'create':
+                            kw = dict([(a, row[a]) for a in attnames
+                                       if row[a]])
+                            to_create.append(Address(
+                                partner_id=pk, primary=True,
+                                address_type=AddressTypes.official, **kw))
+                        else:
+                            to_mark.append(action)
+                        continue
+                    # messages may be formatted and thus translated here
+                    todo.append((fixable, str(msg)))
+                if todo:
+                    num_todo += len(todo)
+                    problems.append(make_problem(self, ct, pk, user, todo))
+
+        with transaction.atomic():
+            replace_problems(self, ct, problems, self.chunk_size)
+            Address.objects.bulk_create(to_create, self.chunk_size)
+            for i in range(0, len(to_mark), self.chunk_size):
+                Address.objects.filter(
+                    pk__in=to_mark[i:i + self.chunk_size]).update(
+                    primary=True)
+        return (num_todo, num_done)
 
 AddressOwnerChecker.activate()
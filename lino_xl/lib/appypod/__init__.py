@@ -39,7 +39,8 @@ See also :ref:`lino.admin.appypod`.
 
 .. xfile:: appypod/Labels.odt
 
-    Template used to print address labels.
+    Template used to print address labels when :attr:`direct_labels
+    <Plugin.direct_labels>` is `False`.
 
 .. rubric:: Glossary
 
@@ -69,6 +70,7 @@ See also :ref:`lino.admin.appypod`.
    :toctree:
 
     choicelists
+    labels
     mixins
     models
 
@@ -81,3 +83,32 @@ class Plugin(ad.Plugin):
     "See :class:`lino.core.Plugin`."
     verbose_name = _("Appy POD")
 
+    # settings:
+
+    direct_labels = False
+    """Whether :class:`PrintLabelsAction
+    <lino_xl.lib.appypod.mixins.PrintLabelsAction>` should write the
+    labels directly into a PDF file (see
+    :mod:`lino_xl.lib.appypod.labels`) instead of using the
+    :xfile:`appypod/Labels.odt` template.  This is faster and uses
+    less memory, but ignores any customized template.
+
+    """
+
+    label_font = 'DejaVuSans.ttf'
+    """The TrueType font file to use for direct labels.  See
+    :func:`lino_xl.lib.appypod.labels.register_font`."""
+
+    label_columns = 3
+    """The number of labels per row on a sheet of labels."""
+
+    label_rows = 8
+    """The number of labels per column on a sheet of labels."""
+
+    label_font_size = 10
+    """The font size (in points) of the text on a label."""
+
+    label_chunk_size = 1000
+    """The number of recipients to fetch from the database at once
+    when printing labels."""
+
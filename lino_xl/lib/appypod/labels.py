@@ -0,0 +1,171 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Printing address labels directly into a PDF file, used by
+:class:`PrintLabelsAction
+<lino_xl.lib.appypod.mixins.PrintLabelsAction>` when
+:attr:`direct_labels <lino_xl.lib.appypod.Plugin.direct_labels>` is
+`True`.
+
+Usage example::
+
+    from lino_xl.lib.appypod.labels import LabelSheet
+    sheet = LabelSheet(columns=3, rows=8)
+    with open('labels.pdf', 'wb') as f:
+        sheet.write(f, [["Mr Foo", "Bar street 5", "4700 Eupen"]])
+
+This uses `reportlab <https://www.reportlab.com>`_ and does not need
+LibreOffice.  The text is written using a TrueType font which gets
+embedded into the PDF file, so that names in any script supported by
+that font are printed correctly.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+from builtins import object
+
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+A4 = (595.28, 841.89)
+"""The size of an A4 page in points."""
+
+DEFAULT_FONT = 'DejaVuSans.ttf'
+"""The default font file.  Unlike :data:`FALLBACK_FONT`, this covers
+most European scripts, but it is not always installed."""
+
+FALLBACK_FONT = 'Vera.ttf'
+"""The font to use when the requested font cannot be found.  This is
+shipped with reportlab but covers only Latin-1."""
+
+
+def iter_chunked(qs, chunk_size=1000):
+    """Iterate over the given queryset without holding all rows in
+    memory.
+
+    This first fetches the primary keys of all rows (in the order of
+    the queryset) and then the rows themselves in chunks of
+    `chunk_size` primary keys.  Unlike slicing the queryset, this
+    neither skips nor repeats rows when the ordering is not unique.
+
+    """
+    pks = list(qs.values_list('pk', flat=True))
+    for i in range(0, len(pks), chunk_size):
+        chunk = pks[i:i + chunk_size]
+        rows = qs.in_bulk(chunk)
+        for pk in chunk:
+            obj = rows.get(pk)
+            if obj is not None:  # deleted in the meantime
+                yield obj
+
+
+def address_related(model):
+    """Return the names of the relations to follow when fetching
+    instances of the given model for printing their address.
+
+    """
+    names = set([f.name for f in model._meta.get_fields()])
+    rv = []
+    if 'city' in names:
+        rv.append('city__parent')
+    if 'country' in names:
+        rv.append('country')
+    if 'region' in names:
+        rv.append('region')
+    return rv
+
+
+def register_font(filename):
+    """Register the TrueType font in the given file with reportlab and
+    return its name.  `filename` may be an absolute path or the name
+    of a file in reportlab's `TTFSearchPath`.  Use
+    :data:`FALLBACK_FONT` if the file cannot be loaded.
+
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if name in pdfmetrics.getRegisteredFontNames():
+        return name
+    try:
+        pdfmetrics.registerFont(TTFont(name, filename))
+    except Exception as e:
+        if filename == FALLBACK_FONT:
+            raise
+        logger.warning("Cannot load font %s (%s), using %s instead.",
+                       filename, e, FALLBACK_FONT)
+        return register_font(FALLBACK_FONT)
+    return name
+
+
+class LabelSheet(object):
+    """The layout of a sheet of address labels: `columns` times `rows`
+    labels of equal size on every page, filled row by row.
+
+    All dimensions are in points (1/72 inch).  `margin` is the empty
+    space around the labels on the page, `padding` the empty space
+    inside every label.  Text which doesn't fit into a label is cut
+    off.  `font_file` is the TrueType font to use (see
+    :func:`register_font`).
+
+    """
+
+    def __init__(self, columns=3, rows=8, page_size=A4, margin=0,
+                 padding=14, font_size=10, leading=None,
+                 font_file=DEFAULT_FONT):
+        self.columns = columns
+        self.rows = rows
+        self.page_size = page_size
+        self.margin = margin
+        self.padding = padding
+        self.font_size = font_size
+        self.leading = leading or font_size * 1.2
+        self.font_file = font_file
+        self.label_width = (page_size[0] - 2 * margin) / columns
+        self.label_height = (page_size[1] - 2 * margin) / rows
+
+    def render_label(self, canvas, i, lines):
+        """Draw the given lines of text into the label at position `i` of
+        the current page.
+
+        """
+        row, col = divmod(i, self.columns)
+        x = self.margin + col * self.label_width
+        y = self.page_size[1] - self.margin - (row + 1) * self.label_height
+        canvas.saveState()
+        path = canvas.beginPath()
+        path.rect(x, y, self.label_width, self.label_height)
+        canvas.clipPath(path, stroke=0, fill=0)
+        text = canvas.beginText(
+            x + self.padding,
+            y + self.label_height - self.padding - self.font_size)
+        text.setFont(self.font_name, self.font_size, self.leading)
+        for ln in lines:
+            text.textLine(ln)
+        canvas.drawText(text)
+        canvas.restoreState()
+
+    def write(self, stream, labels):
+        """Write a PDF document with the given labels to the given binary
+        stream.  `labels` is an iterable of lists of text lines.
+        Return the number of labels.
+
+        """
+        self.font_name = register_font(self.font_file)
+        canvas = Canvas(stream, pagesize=self.page_size, pageCompression=1)
+        per_page = self.columns * self.rows
+        count = 0
+        for lines in labels:
+            i = count % per_page
+            if count and i == 0:
+                canvas.showPage()
+            self.render_label(canvas, i, lines)
+            count += 1
+        canvas.showPage()
+        canvas.save()
+        return count
@@ -10,12 +10,14 @@ Defines :class:`PrintTableAction` and
 import os
 
 from django.conf import settings
+from django.db import models
 from lino.utils import format_date
 from lino.utils.media import TmpMediaFile
 from lino.core import actions
 from lino.api import dd, rt, _
 
 from .appy_renderer import AppyRenderer
+from .labels import LabelSheet, iter_chunked, address_related
 
 
 class PrintTableAction(actions.Action):
@@ -100,12 +102,43 @@ class PrintLabelsAction(PrintTableAction):
     model which implements
     :class:`Addressable <lino.utils.addressable.Addressable>`.
 
+    When :attr:`direct_labels
+    <lino_xl.lib.appypod.Plugin.direct_labels>` is `True`, the labels
+    are written directly into a PDF file by a :class:`LabelSheet
+    <lino_xl.lib.appypod.labels.LabelSheet>`, without using the
+    :xfile:`appypod/Labels.odt` template.
+
     """
     label = _("Labels")
     help_text = _('Generate mailing labels for these recipients')
     template_name = "appypod/Labels.odt"
     sort_index = -8
 
+    def run_from_ui(self, ar, **kw):
+        if not dd.plugins.appypod.direct_labels:
+            return super(PrintLabelsAction, self).run_from_ui(ar, **kw)
+        mf = TmpMediaFile(ar, 'pdf')
+        settings.SITE.makedirs_if_missing(os.path.dirname(mf.name))
+        self.write_labels(ar, mf.name)
+        ar.set_response(success=True)
+        ar.set_response(open_url=mf.url)
+
+    def get_label_sheet(self, ar):
+        """Return the :class:`LabelSheet
+        <lino_xl.lib.appypod.labels.LabelSheet>` to use."""
+        p = dd.plugins.appypod
+        return LabelSheet(
+            columns=p.label_columns, rows=p.label_rows,
+            font_size=p.label_font_size, font_file=p.label_font)
+
+    def write_labels(self, ar, target_file):
+        sheet = self.get_label_sheet(ar)
+        labels = (list(obj.get_address_lines())
+                  for obj in self.get_recipients(ar))
+        with open(target_file, 'wb') as f:
+            n = sheet.write(f, labels)
+        dd.logger.debug("Wrote %d labels to %s", n, target_file)
+
     def get_context(self, ar):
         context = super(PrintLabelsAction, self).get_context(ar)
         context.update(recipients=self.get_recipients(ar))
@@ -132,5 +165,14 @@ class PrintLabelsAction(PrintTableAction):
                         _("only valid recipients"),default=False
                     )
 
+        The default implementation yields all rows of the table, fetching
+        them in chunks of :attr:`label_chunk_size
+        <lino_xl.lib.appypod.Plugin.label_chunk_size>` together with
+        their city, country and region.
+
         """
-        return iter(ar)
+        qs = ar.data_iterator
+        if not isinstance(qs, models.QuerySet):
+            return iter(qs)
+        qs = qs.select_related(*address_related(qs.model))
+        return iter_chunked(qs, dd.plugins.appypod.label_chunk_size)
@@ -27,6 +27,7 @@ the same except that it uses `eidjslib` instead of :ref:`eidreader`.
     choicelists
     mixins
     models
+    management.commands.audit_ssins
 
 """
 
@@ -53,12 +54,27 @@ class Plugin(ad.Plugin):  # was: use_eidreader
 
         Whether to just simulate.
 
+    .. attribute:: background_writes
+
+        Whether to write the photo and the raw data of a card (see
+        :attr:`data_collector_dir`) in a background thread instead
+        of letting the user wait until they have been written.
+
+    .. attribute:: lookup_cache_timeout
+
+        The number of seconds after which the countries and places
+        found when reading a card are looked up again.  `None` means
+        to keep them until a country or place is saved or deleted in
+        this process.
+
     """
 
     site_js_snippets = ['beid/eidreader.js']
     media_name = 'eidreader'
     data_collector_dir = None
     read_only_simulate = False
+    background_writes = True
+    lookup_cache_timeout = 60
 
     def on_site_startup(self, kernel):
         
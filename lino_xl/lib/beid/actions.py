@@ -14,9 +14,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 import os
+import copy
+import time
 import yaml
+import atexit
 import base64
+import threading
 
+from six.moves.queue import Queue
 from unipath import Path
 from django.conf import settings
 
@@ -47,6 +52,126 @@ def get_image_path(card_number):
     return Path(settings.STATIC_ROOT).child("contacts.Person.jpg")
 
 
+class FileWriter(object):
+    """Writes files in a background thread so that the user doesn't need
+    to wait for it.  Used for storing the photo and the raw data of a
+    card.
+
+    Every file is first written under a temporary name and then
+    renamed, so nobody can see a partly written file.  Pending files
+    are written before the process exits.  Errors are logged.
+
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, fn, data):
+        """Write the given binary data to the file named `fn`."""
+        if not dd.plugins.beid.background_writes:
+            self.do_write(fn, data)
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.join)
+        self.queue.put((fn, data))
+
+    def do_write(self, fn, data):
+        tmp = fn + '.tmp'
+        try:
+            with open(tmp, 'wb') as fp:
+                fp.write(data)
+            if os.path.exists(fn):
+                # os.rename() doesn't replace existing files on Windows
+                os.remove(fn)
+            os.rename(tmp, fn)
+        except Exception as e:
+            logger.warning("Failed to write file %s : %s", fn, e)
+
+    def run(self):
+        while True:
+            fn, data = self.queue.get()
+            try:
+                self.do_write(fn, data)
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """Wait until all pending files have been written."""
+        self.queue.join()
+
+
+file_writer = FileWriter()
+
+
+class LookupCache(object):
+    """A cache of database objects looked up by some key.
+
+    Every call returns a copy of the cached object, so that no model
+    instance is shared between requests.  The cache is cleared when a
+    country or a place is saved or deleted in this process, and
+    entries expire after :attr:`lookup_cache_timeout
+    <lino_xl.lib.beid.Plugin.lookup_cache_timeout>` seconds so that
+    changes made by other processes are seen.
+
+    """
+
+    def __init__(self):
+        self.entries = dict()
+
+    def get(self, key, lookup):
+        """Return a copy of the object for the given key, calling
+        `lookup()` if it is not (or no longer) in the cache."""
+        timeout = dd.plugins.beid.lookup_cache_timeout
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or (
+                timeout is not None and now - entry[0] >= timeout):
+            entry = (now, lookup())
+            self.entries[key] = entry
+        return copy.copy(entry[1])
+
+    def clear(self):
+        self.entries = dict()
+
+
+_countries = LookupCache()
+_places = LookupCache()
+
+
+def get_country(isocode):
+    """Return the :class:`Country
+    <lino_xl.lib.countries.models.Country>` having the given ISO
+    code."""
+    return _countries.get(
+        isocode,
+        lambda: rt.models.countries.Country.objects.get(isocode=isocode))
+
+
+def get_place(country, name):
+    """Return the :class:`Place <lino_xl.lib.countries.models.Place>`
+    having the given name in the given country, creating it if
+    necessary."""
+    return _places.get(
+        (country.pk, name.lower()),
+        lambda: rt.models.countries.Place.lookup_or_create(
+            'name', name, country=country))
+
+
+def forget_places():
+    """Forget the cached countries and places.  Called when a country or
+    a place gets saved or deleted.
+
+    """
+    _countries.clear()
+    _places.clear()
+
+
 def simulate_wrap(msg):
     if dd.plugins.beid.read_only_simulate:
         msg = "(%s:) %s" % (unicode(_("Simulation")), msg)
@@ -114,13 +239,8 @@ class BaseBeIdReadCardAction(dd.Action):
             fn = get_image_path(card_number)
             if fn.exists():
                 logger.warning("Overwriting existing image file %s.", fn)
-            try:
-                fp = file(fn, 'wb')
-                fp.write(base64.b64decode(data.photo))
-                fp.close()
-            except IOError as e:
-                logger.warning("Failed to store image file %s : %s", fn, e)
-                
+            file_writer.write(fn, base64.b64decode(data.photo))
+
             #~ print 20121117, repr(data['picture'])
             #~ kw.update(picture_data_encoded=data['picture'])
 
@@ -145,11 +265,10 @@ class BaseBeIdReadCardAction(dd.Action):
 
         msg1 = "BeIdReadCardToClientAction %s" % kw.get('national_id')
 
-        country = rt.models.countries.Country.objects.get(isocode=pk)
+        country = get_country(pk)
         kw.update(country=country)
         if data.municipality:
-            kw.update(city=rt.models.countries.Place.lookup_or_create(
-                'name', data.municipality, country=country))
+            kw.update(city=get_place(country, data.municipality))
 
         def sex2gender(sex):
             if sex == 'MALE':
@@ -167,12 +286,11 @@ class BaseBeIdReadCardAction(dd.Action):
         kw.update(card_type=doctype2cardtype(data.documentType))
 
         if dd.plugins.beid.data_collector_dir:
-            logger.info("Gonna write raw eid card data: %r", raw_data)
             fn = os.path.join(
                 dd.plugins.beid.data_collector_dir,
                 card_number + '.txt')
-            file(fn, "w").write(raw_data.encode('utf-8'))
-            logger.info("Wrote eid card data to file %s", fn)
+            file_writer.write(fn, raw_data.encode('utf-8'))
+            logger.info("Writing eid card data to file %s", fn)
 
         return kw
 
@@ -245,8 +363,10 @@ class FindByBeIdAction(BaseBeIdReadCardAction):
     def run_from_ui(self, ar, **kw):
         attrs = self.card2client(ar.request.POST)
         holder_model = dd.plugins.beid.holder_model
-        qs = holder_model.objects.filter(national_id=attrs['national_id'])
-        if qs.count() > 1:
+        # national_id is unique, so this uses its index
+        rows = list(holder_model.objects.filter(
+            national_id=attrs['national_id'])[:2])
+        if len(rows) > 1:
             msg = self.sorry_msg % (
                 _("There is more than one client with national "
                   "id %(national_id)s in our database.") % attrs)
@@ -254,7 +374,7 @@ class FindByBeIdAction(BaseBeIdReadCardAction):
             raise Exception(msg)  # this is impossible because
                                   # national_id is unique
             return ar.error(msg)
-        if qs.count() == 0:
+        if len(rows) == 0:
             fkw = dict()
             for k in NAMES:
                 v = attrs[k]
@@ -274,8 +394,8 @@ class FindByBeIdAction(BaseBeIdReadCardAction):
 
             #~ fkw.update(national_id__isnull=True)
             Person = rt.models.contacts.Person
-            pqs = Person.objects.filter(**fkw)
-            if pqs.count() == 0:
+            pqs = list(Person.objects.filter(**fkw)[:2])
+            if len(pqs) == 0:
                 def yes(ar2):
                     obj = holder_model(**attrs)
                     msg = _("New client %s has been created") % obj
@@ -295,7 +415,7 @@ class FindByBeIdAction(BaseBeIdReadCardAction):
                 msg = _("Create new client %s : Are you sure?") % full_name
                 msg = simulate_wrap(msg)
                 return ar.confirm(yes, msg)
-            elif pqs.count() == 1:
+            elif len(pqs) == 1:
                 return ar.error(
                     self.sorry_msg % _(
                         "Cannot create new client because "
@@ -310,9 +430,7 @@ class FindByBeIdAction(BaseBeIdReadCardAction):
                         "%s in our database.")
                     % full_name, alert=_("Oops!"))
 
-        assert qs.count() == 1
-        row = qs[0]
-        return self.process_row(ar, row, attrs)
+        return self.process_row(ar, rows[0], attrs)
 
 
 class BeIdReadCardAction(BaseBeIdReadCardAction):
@@ -335,7 +453,7 @@ class BeIdReadCardAction(BaseBeIdReadCardAction):
         holder_model = dd.plugins.beid.holder_model
         qs = holder_model.objects.filter(
             national_id=attrs['national_id'])
-        if not row.national_id and qs.count() == 0:
+        if not row.national_id and not qs.exists():
             row.national_id = attrs['national_id']
             row.full_clean()
             row.save()
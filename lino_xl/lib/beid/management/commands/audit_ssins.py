@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: audit_ssins
+
+Check the national ids of all card holders at once.  This reports the
+same problems as :class:`BeIdCardHolderChecker
+<lino_xl.lib.beid.mixins.BeIdCardHolderChecker>` and also the card
+holders whose national ids differ only by their formatting.
+
+With ``--fix``, all malformed national ids which can be fixed are
+fixed in a single transaction.  A national id cannot be fixed when
+another card holder already has the correctly formatted value.  The
+"Malformed SSIN" problems of the fixed card holders are deleted.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When, Value
+
+from lino.api import dd, rt
+from lino.utils import dblogger
+from lino.utils import ssin
+
+from lino_xl.lib.beid.mixins import BeIdCardHolderChecker
+
+
+class SSINAudit(object):
+    """The result of checking the national ids of all card holders.
+
+    .. attribute:: invalid
+
+        A list of `(pk, national_id, message)` for the national ids
+        which cannot be parsed.
+
+    .. attribute:: malformed
+
+        A dict mapping the pk of every card holder whose national id
+        is not correctly formatted to a tuple `(got, expected)`.
+
+    .. attribute:: duplicates
+
+        A dict mapping every correctly formatted national id used by
+        more than one card holder to the list of their primary keys.
+
+    """
+    chunk_size = 500
+
+    def __init__(self, model):
+        self.model = model
+        self.invalid = []
+        self.malformed = dict()
+        self.duplicates = dict()
+
+    def run(self):
+        seen = dict()
+        qs = self.model.objects.exclude(national_id__isnull=True)
+        qs = qs.exclude(national_id='').order_by('pk')
+        for pk, got in qs.values_list('pk', 'national_id').iterator():
+            try:
+                expected = ssin.parse_ssin(got)
+            except ValidationError as e:
+                self.invalid.append((pk, got, '; '.join(e.messages)))
+                continue
+            if got != expected:
+                self.malformed[pk] = (got, expected)
+            pks = seen.setdefault(expected, [])
+            pks.append(pk)
+            if len(pks) > 1:
+                self.duplicates[expected] = pks
+        return self
+
+    def get_fixable(self):
+        """Return a dict mapping the pk of every fixable card holder to its
+        correctly formatted national id.
+
+        """
+        return dict([
+            (pk, expected)
+            for pk, (got, expected) in self.malformed.items()
+            if expected not in self.duplicates])
+
+    def fix(self):
+        """Fix all fixable national ids in a single transaction and delete
+        the plausibility problems reported by
+        :class:`BeIdCardHolderChecker
+        <lino_xl.lib.beid.mixins.BeIdCardHolderChecker>` for them.
+        Return the number of fixed card holders.
+
+        """
+        Problem = rt.models.plausibility.Problem
+        ContentType = rt.models.contenttypes.ContentType
+        ct = ContentType.objects.get_for_model(self.model)
+        chk = BeIdCardHolderChecker.self
+        fixable = self.get_fixable()
+        pks = sorted(fixable)
+        with transaction.atomic():
+            for i in range(0, len(pks), self.chunk_size):
+                chunk = pks[i:i + self.chunk_size]
+                self.model.objects.filter(pk__in=chunk).update(
+                    national_id=Case(*[
+                        When(pk=pk, then=Value(fixable[pk]))
+                        for pk in chunk]))
+                Problem.objects.filter(
+                    owner_type=ct, owner_id__in=chunk,
+                    checker=chk).delete()
+        return len(pks)
+
+    def write_report(self, stream):
+        for pk, got, msg in self.invalid:
+            stream.write("%s\t%s\tinvalid\t%s\n" % (pk, got, msg))
+        for pk in sorted(self.malformed):
+            got, expected = self.malformed[pk]
+            stream.write("%s\t%s\tmalformed\t%s\n" % (pk, got, expected))
+        for expected in sorted(self.duplicates):
+            pks = self.duplicates[expected]
+            stream.write("%s\t%s\tduplicate\t%s\n" % (
+                ','.join([str(pk) for pk in pks]), expected,
+                len(pks)))
+
+
+class Command(BaseCommand):
+    help = "Check the national ids of all eID card holders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            dest='fix', default=False,
+                            help='Fix malformed national ids.')
+
+    def handle(self, *args, **options):
+        audit = SSINAudit(dd.plugins.beid.holder_model).run()
+        audit.write_report(self.stdout)
+        dblogger.info(
+            "%d invalid, %d malformed and %d duplicate national ids.",
+            len(audit.invalid), len(audit.malformed),
+            len(audit.duplicates))
+        if options['fix']:
+            n = audit.fix()
+            dblogger.info("Fixed %d malformed national ids.", n)
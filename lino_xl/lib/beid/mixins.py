@@ -270,6 +270,8 @@ class BeIdCardHolderChecker(Checker):
     Belgian NISSes are stored including the formatting characters (see
     :mod:`lino.utils.ssin`) in order to guarantee uniqueness.
 
+    For checking all card holders at once, use :manage:`audit_ssins`.
+
     """
     model = BeIdCardHolder
     verbose_name = _("Check for invalid SSINs")
@@ -12,3 +12,20 @@ The :xfile:`models.py` file for this plugin.
 
 from .choicelists import BeIdCardTypes, ResidenceTypes, CivilStates
 from .mixins import BeIdCardHolder
+
+from django.db.models.signals import post_save, post_delete
+from lino.api import dd, rt
+from .actions import forget_places
+
+
+def forget_cached_places(sender, **kwargs):
+    forget_places()
+
+
+@dd.receiver(dd.post_analyze)
+def connect_cached_places(sender, **kwargs):
+    if not sender.is_installed('countries'):
+        return
+    for m in (rt.models.countries.Country, rt.models.countries.Place):
+        post_save.connect(forget_cached_places, sender=m)
+        post_delete.connect(forget_cached_places, sender=m)
@@ -17,6 +17,9 @@ given user during a given period.
     desktop
     fixtures
     utils
+    intervals
+    management.commands.check_coachings
+    management.commands.rebuild_coaching_intervals
 
 """
 
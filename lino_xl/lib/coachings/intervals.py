@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Maintaining the :class:`CoachingInterval
+<lino_xl.lib.coachings.models.CoachingInterval>` table.
+
+The intervals of a client are rebuilt whenever one of their coachings
+is saved or deleted.  Use :manage:`rebuild_coaching_intervals` to
+rebuild them for all clients.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import transaction
+
+from lino.api import rt
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def merge_periods(periods):
+    """Merge the given list of `(start_date, end_date)` tuples into the
+    smallest list of non-overlapping periods which cover the same
+    days.  An empty `start_date` or `end_date` means that the period
+    is not limited on that side.
+
+    >>> from datetime import date as d
+    >>> merge_periods([(d(2017, 3, 1), None), (None, d(2016, 1, 1))])
+    [(None, datetime.date(2016, 1, 1)), (datetime.date(2017, 3, 1), None)]
+    >>> merge_periods([(d(2017, 1, 1), d(2017, 1, 31)),
+    ...                (d(2017, 2, 1), d(2017, 3, 31))])
+    [(datetime.date(2017, 1, 1), datetime.date(2017, 3, 31))]
+
+    """
+    items = sorted([(a or datetime.date.min, b or datetime.date.max)
+                    for a, b in periods])
+    result = []
+    for a, b in items:
+        if result:
+            prev_a, prev_b = result[-1]
+            if prev_b == datetime.date.max or a <= prev_b + ONE_DAY:
+                result[-1] = (prev_a, max(prev_b, b))
+                continue
+        result.append((a, b))
+    return [(None if a == datetime.date.min else a,
+             None if b == datetime.date.max else b)
+            for a, b in result]
+
+
+def update_intervals(client_ids):
+    """Rebuild the coaching intervals of the given clients (a list of
+    primary keys) in a single transaction.  Return the number of
+    intervals.
+
+    """
+    Coaching = rt.models.coachings.Coaching
+    CoachingInterval = rt.models.coachings.CoachingInterval
+    groups = dict()  # (client, user, primary) -> list of periods
+    for client, user, primary, a, b in Coaching.objects.filter(
+            client_id__in=client_ids).values_list(
+            'client_id', 'user_id', 'primary', 'start_date', 'end_date'):
+        groups.setdefault((client, user, primary), []).append((a, b))
+    rows = []
+    for (client, user, primary), periods in groups.items():
+        for a, b in merge_periods(periods):
+            rows.append(CoachingInterval(
+                client_id=client, user_id=user, primary=primary,
+                start_date=a, end_date=b))
+    with transaction.atomic():
+        CoachingInterval.objects.filter(client_id__in=client_ids).delete()
+        CoachingInterval.objects.bulk_create(rows)
+    return len(rows)
+
+
+def rebuild_intervals(chunk_size=1000):
+    """Rebuild the coaching intervals of all clients, processing
+    `chunk_size` clients per transaction.  Return the number of
+    intervals.
+
+    The intervals of a client are replaced within the same
+    transaction, so the table stays usable while this is running.
+    This includes the clients who have intervals but no coachings
+    anymore.
+
+    """
+    Coaching = rt.models.coachings.Coaching
+    CoachingInterval = rt.models.coachings.CoachingInterval
+    client_ids = set(Coaching.objects.values_list(
+        'client_id', flat=True).distinct())
+    client_ids |= set(CoachingInterval.objects.values_list(
+        'client_id', flat=True).distinct())
+    client_ids = sorted(client_ids)
+    n = 0
+    for i in range(0, len(client_ids), chunk_size):
+        n += update_intervals(client_ids[i:i + chunk_size])
+    return n
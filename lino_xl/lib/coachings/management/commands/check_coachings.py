@@ -0,0 +1,28 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: check_coachings
+
+Run the :class:`ClientCoachingsChecker
+<lino_xl.lib.coachings.models.ClientCoachingsChecker>` on all clients
+at once.  This is much faster than :manage:`checkdata` because it
+doesn't check every client separately.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lino.api import rt
+from lino.utils import dblogger
+
+
+class Command(BaseCommand):
+    help = "Check the coaching state of all clients."
+
+    def handle(self, *args, **options):
+        chk = rt.models.coachings.ClientCoachingsChecker.self
+        n = chk.check_all()
+        dblogger.info("Found %d coaching problems.", n)
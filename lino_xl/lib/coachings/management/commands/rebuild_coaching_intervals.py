@@ -0,0 +1,35 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: rebuild_coaching_intervals
+
+Rebuild the :class:`CoachingInterval
+<lino_xl.lib.coachings.models.CoachingInterval>` table from the
+coachings of all clients.  Run this once after upgrading a database
+which has coachings but no coaching intervals.  Such databases are
+reported by :class:`CoachingIntervalChecker
+<lino_xl.lib.coachings.models.CoachingIntervalChecker>`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.coachings.intervals import rebuild_intervals
+
+
+class Command(BaseCommand):
+    help = "Rebuild the coaching intervals of all clients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', action='store', type=int,
+                            dest='chunk_size', default=1000,
+                            help='Number of clients per transaction.')
+
+    def handle(self, *args, **options):
+        n = rebuild_intervals(options['chunk_size'])
+        dblogger.info("Rebuilt %d coaching intervals.", n)
@@ -10,10 +10,12 @@ from __future__ import unicode_literals
 from __future__ import print_function
 
 import logging
+import datetime
 logger = logging.getLogger(__name__)
 
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
@@ -27,6 +29,10 @@ from lino.modlib.plausibility.choicelists import Checker
 
 from .mixins import ClientContactBase
 from .choicelists import ClientEvents, ClientStates
+from .intervals import update_intervals
+from .utils import only_active_coachings_filter
+
+from lino_xl.lib.xl.utils import make_problem, replace_problems
 
 
 try:
@@ -234,6 +240,58 @@ dd.update_field(
     related_name="%(app_label)s_%(class)s_set_by_user")
 
 
+class CoachingInterval(dd.Model):
+    """A period during which a given client has been coached without
+    interruption by a given user.
+
+    This table is a denormalized index of the :class:`Coaching` table,
+    used by the filters of :mod:`lino_xl.lib.coachings.utils`.  It
+    contains one row for every set of uninterrupted coachings of a
+    client having the same `user` and `primary`.  The intervals of a
+    client are rebuilt automatically when one of their coachings is
+    saved or deleted (see :mod:`lino_xl.lib.coachings.intervals`).
+
+    """
+    class Meta:
+        app_label = 'coachings'
+        verbose_name = _("Coaching interval")
+        verbose_name_plural = _("Coaching intervals")
+        index_together = [('user', 'start_date', 'end_date'),
+                          ('start_date', 'end_date')]
+
+    allow_cascaded_delete = ['client', 'user']
+
+    client = dd.ForeignKey(client_model, related_name="coaching_intervals")
+    user = dd.ForeignKey(
+        settings.SITE.user_model, blank=True, null=True,
+        related_name="coaching_intervals")
+    primary = models.BooleanField(_("Primary"), default=False)
+    start_date = models.DateField(_("Coached from"), blank=True, null=True)
+    end_date = models.DateField(_("until"), blank=True, null=True)
+
+
+@dd.receiver(pre_save, sender=Coaching)
+def remember_coached_client(sender, instance=None, raw=False, **kwargs):
+    instance._old_client_id = None
+    if raw or settings.SITE.loading_from_dump or instance.pk is None:
+        return
+    qs = Coaching.objects.filter(pk=instance.pk).exclude(
+        client_id=instance.client_id)
+    for client_id in qs.values_list('client_id', flat=True):
+        instance._old_client_id = client_id
+
+
+@dd.receiver(post_save, sender=Coaching)
+@dd.receiver(post_delete, sender=Coaching)
+def update_coaching_intervals(sender, instance=None, raw=False, **kwargs):
+    if raw or settings.SITE.loading_from_dump:
+        return
+    client_ids = [instance.client_id]
+    old = getattr(instance, '_old_client_id', None)
+    if old is not None:
+        client_ids.append(old)
+    update_intervals(client_ids)
+
 
 class ClientChecker(Checker):
     model = client_model
@@ -242,13 +300,13 @@ class ClientChecker(Checker):
         return obj.get_primary_coach()
 
 
-
 class ClientCoachingsChecker(ClientChecker):
     """Coached clients should not be obsolete.  Only coached clients
     should have active coachings
 
     """
     verbose_name = _("Check coachings")
+    chunk_size = 1000
 
     def get_plausibility_problems(self, obj, fix=False):
         if obj.client_state == ClientStates.coached:
@@ -261,9 +319,103 @@ class ClientCoachingsChecker(ClientChecker):
             if qs.count():
                 yield (False, _("Not coached, but with active coachings."))
 
+    def get_candidates(self):
+        """Return the primary keys of the clients who need to be checked
+        by :meth:`check_all`.
+
+        When :meth:`get_plausibility_problems` is not overridden, these
+        are only the clients for whom it can report a problem: the
+        coached clients who are obsolete, and the other clients who
+        have active coachings.  This expects
+        :meth:`get_coachings` of the client to return the coachings
+        which are active in the given period.  Otherwise all clients
+        are checked.
+
+        """
+        qs = self.model.objects.order_by('pk')
+        meth = self.__class__.get_plausibility_problems
+        default = ClientCoachingsChecker.get_plausibility_problems
+        if getattr(meth, '__func__', meth) is not getattr(
+                default, '__func__', default):
+            return qs.values_list('pk', flat=True)
+        today = dd.today()
+        active = set(Coaching.objects.filter(
+            only_active_coachings_filter((today, today))).values_list(
+            'client_id', flat=True).distinct())
+        coached = ClientStates.coached.value
+        pks = []
+        for pk, state, obsolete in qs.values_list(
+                'pk', 'client_state', 'is_obsolete').iterator():
+            if getattr(state, 'value', state) == coached:
+                if obsolete:
+                    pks.append(pk)
+            elif pk in active:
+                pks.append(pk)
+        return pks
+
+    def check_all(self):
+        """Check all clients at once and replace the plausibility problems
+        reported by this checker.  Return the number of problems.
+
+        Unlike the :manage:`checkdata` command, this selects the
+        clients which might have a problem using two queries (see
+        :meth:`get_candidates`), checks only these, and writes the
+        problems in bulk.  The problems are computed by
+        :meth:`get_plausibility_problems` and assigned to
+        :meth:`get_responsible_user`, so overrides of these methods
+        (or of the client methods they call) are respected.
+
+        """
+        ContentType = rt.models.contenttypes.ContentType
+        ct = ContentType.objects.get_for_model(self.model)
+        pks = list(self.get_candidates())
+        problems = []
+        for i in range(0, len(pks), self.chunk_size):
+            chunk = pks[i:i + self.chunk_size]
+            for obj in self.model.objects.filter(
+                    pk__in=chunk).order_by('pk'):
+                msgs = list(self.get_plausibility_problems(obj))
+                if not msgs:
+                    continue
+                problems.append(make_problem(
+                    self, ct, obj.pk, self.get_responsible_user(obj), msgs))
+        replace_problems(self, ct, problems, self.chunk_size)
+        return len(problems)
+
 ClientCoachingsChecker.activate()
 
 
+class CoachingIntervalChecker(Checker):
+    """Checks whether every coaching is covered by a
+    :class:`CoachingInterval`.  This is not the case e.g. after
+    restoring a dump or upgrading a database which has coachings, but
+    no intervals yet (see :manage:`rebuild_coaching_intervals`).
+    Fixing it rebuilds the intervals of the client.
+
+    """
+    verbose_name = _("Check for missing coaching intervals")
+    model = Coaching
+
+    def get_responsible_user(self, obj):
+        return obj.user
+
+    def get_plausibility_problems(self, obj, fix=False):
+        a = obj.start_date or datetime.date.min
+        b = obj.end_date or datetime.date.max
+        qs = CoachingInterval.objects.filter(
+            client_id=obj.client_id, user_id=obj.user_id,
+            primary=obj.primary)
+        for start, end in qs.values_list('start_date', 'end_date'):
+            if (start or datetime.date.min) <= a and \
+               b <= (end or datetime.date.max):
+                return
+        yield (True, _("Coaching is not covered by a coaching interval."))
+        if fix:
+            update_intervals([obj.client_id])
+
+CoachingIntervalChecker.activate()
+
+
 class ClientContactType(mixins.BabelNamed):
     """A **client contact type** is the type or "role" which must be
     specified for a given :class:`ClientContact`.
@@ -11,11 +11,26 @@ from __future__ import print_function
 
 from django.db.models import Q
 
-from lino.api import dd
+from lino.api import dd, rt
+
+
+def coached_clients(flt, join=None):
+    """Return a dict of lookup arguments which leave only the clients
+    having at least one :class:`CoachingInterval
+    <lino_xl.lib.coachings.models.CoachingInterval>` which satisfies
+    the given filter.  This is a subquery and does not need a
+    `distinct()` on the queryset of clients.
+
+    """
+    CoachingInterval = rt.models.coachings.CoachingInterval
+    sq = CoachingInterval.objects.filter(flt).values('client_id')
+    if join:
+        return {join + '__in': sq}
+    return {'pk__in': sq}
 
 
 def only_coached_by(qs, user):
-    return qs.filter(coachings_by_client__user=user).distinct()
+    return qs.filter(**coached_clients(Q(user=user)))
 
 
 def only_coached_on(qs, period, join=None):
@@ -24,10 +39,8 @@ def only_coached_on(qs, period, join=None):
     which leaves only the clients that are (or were or will be) coached
     on the specified date.
     """
-    n = 'coachings_by_client__'
-    if join:
-        n = join + '__' + n
-    return qs.filter(only_active_coachings_filter(period, n)).distinct()
+    return qs.filter(**coached_clients(
+        only_active_coachings_filter(period), join))
 
 
 def only_active_coachings_filter(period, prefix=''):
@@ -50,12 +63,12 @@ def add_coachings_filter(qs, user, period, primary):
         return qs
     flt = Q()
     if period:
-        flt &= only_active_coachings_filter(period, 'coachings_by_client__')
+        flt &= only_active_coachings_filter(period)
     if user:
-        flt &= Q(coachings_by_client__user=user)
+        flt &= Q(user=user)
     if primary:
-        flt &= Q(coachings_by_client__primary=True)
-    return qs.filter(flt).distinct()
+        flt &= Q(primary=True)
+    return qs.filter(**coached_clients(flt))
 
 
 def daterange_text(a, b):
@@ -10,6 +10,7 @@
     choicelists
     models
     utils
+    ids
     mixins
     dummy
     fixtures.std
@@ -47,6 +48,14 @@ class Plugin(ad.Plugin):
     region_label = _('Region')
     """The `verbose_name` of the `region` field."""
 
+    partner_id_block_size = 1000
+    """The maximum number of partner ids to reserve at once when
+    :attr:`next_partner_id
+    <lino.modlib.system.models.SiteConfig.next_partner_id>` is set.
+    See :class:`lino_xl.lib.contacts.ids.PartnerIdAllocator`.
+
+    """
+
     def setup_main_menu(self, site, profile, m):
         m = m.add_menu(self.app_label, self.verbose_name)
         # We use the string representations and not the classes because
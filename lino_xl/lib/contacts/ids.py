@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Allocation of primary keys for new partners.
+
+.. data:: partner_ids
+
+    The process-wide :class:`PartnerIdAllocator` used by
+    :meth:`Partner.save <lino_xl.lib.contacts.models.Partner.save>`.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from lino.api import dd, rt
+
+
+class PartnerIdAllocator(object):
+    """Hands out the ids of new partners when :attr:`next_partner_id
+    <lino.modlib.system.models.SiteConfig.next_partner_id>` is set.
+
+    Instead of reading and writing the site configuration for every
+    new partner, the allocator reserves a block of ids at once by
+    incrementing `next_partner_id` with a single UPDATE statement,
+    and then hands out the ids of this block from memory.  Ids which
+    are already used by some partner are skipped.
+
+    The first block of a process has only one id, and every following
+    block is twice as big as the previous one, up to
+    :attr:`partner_id_block_size
+    <lino_xl.lib.contacts.Plugin.partner_id_block_size>`.  So a
+    process which creates only a few partners leaves `next_partner_id`
+    at the next free id, while an import of many partners needs only
+    a few UPDATE statements.  Ids of a block which are not used before
+    the process ends are lost, i.e. there may be gaps in the numbering
+    after a process has created many partners.
+
+    Several processes can create partners at the same time, each of
+    them using its own block.  When somebody changes
+    `next_partner_id`, the current block of this process is
+    forgotten.
+
+    A partner created within a transaction (:func:`atomic
+    <django.db.transaction.atomic>` block) gets its id from a block of
+    one id which is reserved within that transaction and not kept in
+    memory.  Otherwise a rollback would undo the reservation but leave
+    the block in memory, and another process could reserve the same
+    ids.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = []
+        self.end = None
+        self.size = 1
+
+    def reserve(self, size):
+        """Reserve a block of `size` ids and return them as a list, or
+        return `None` if :attr:`next_partner_id` is empty.
+
+        """
+        SiteConfig = rt.models.system.SiteConfig
+        sc = settings.SITE.site_config
+        qs = SiteConfig.objects.filter(pk=sc.pk)
+        with transaction.atomic():
+            qs.update(next_partner_id=F('next_partner_id') + size)
+            end = qs.values_list('next_partner_id', flat=True)[0]
+        # keep the cached instance in sync so that saving it won't
+        # rewind the counter
+        sc.next_partner_id = end
+        if end is None:
+            return None
+        start = end - size
+        Partner = rt.models.contacts.Partner
+        used = set(Partner.objects.filter(
+            id__gte=start, id__lt=end).values_list('id', flat=True))
+        if used:
+            logger.warning(
+                "Skipping %d existing partner ids between %d and %d. "
+                "Check your next_partner_id in SiteConfig!",
+                len(used), start, end)
+        return [i for i in range(start, end) if i not in used]
+
+    def get_next_id(self):
+        """Return the id to use for a new partner, or `None` if the
+        database should choose it.
+
+        """
+        nid = settings.SITE.site_config.next_partner_id
+        if nid is None:
+            return None
+        if transaction.get_connection().in_atomic_block:
+            ids = []
+            while not ids:
+                ids = self.reserve(1)
+                if ids is None:
+                    return None
+            return ids[0]
+        with self.lock:
+            if nid != self.end:
+                # next_partner_id has been changed by somebody else
+                self.ids = []
+                self.size = 1
+            while not self.ids:
+                ids = self.reserve(self.size)
+                if ids is None:
+                    return None
+                self.end = settings.SITE.site_config.next_partner_id
+                self.size = min(
+                    self.size * 2, dd.plugins.contacts.partner_id_block_size)
+                self.ids = ids[::-1]
+            return self.ids.pop()
+
+
+partner_ids = PartnerIdAllocator()
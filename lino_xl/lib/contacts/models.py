@@ -30,7 +30,6 @@ logger = logging.getLogger(__name__)
 
 
 from django.db import models
-from django.core.exceptions import ValidationError
 from django.conf import settings
 
 from lino.api import dd, _, pgettext
@@ -50,6 +49,7 @@ from .mixins import ContactRelated, PartnerDocument, OldCompanyContact
 from lino.mixins import Contactable, Phonable
 from .roles import SimpleContactsUser, ContactsStaff
 from .choicelists import PartnerEvents
+from .ids import partner_ids
 
 from lino.mixins.human import name2kw, Human, Born
 
@@ -126,18 +126,7 @@ class Partner(Contactable, Phonable, mixins.Polymorphic,
 
     def save(self, *args, **kw):
         if self.id is None:
-            sc = settings.SITE.site_config
-            if sc.next_partner_id is not None:
-                try:
-                    self.__class__.objects.get(id=sc.next_partner_id)
-                    raise ValidationError(
-                        "Cannot create partner with id={0}. "
-                        "Check your next_partner_id in SiteConfig!".format(
-                            sc.next_partner_id))
-                except self.__class__.DoesNotExist:
-                    self.id = sc.next_partner_id
-                    sc.next_partner_id += 1
-                    sc.save()
+            self.id = partner_ids.get_next_id()
         #~ logger.info("20120327 Partner.save(%s,%s)",args,kw)
         super(Partner, self).save(*args, **kw)
 
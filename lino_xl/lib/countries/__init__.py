@@ -8,6 +8,7 @@
    :toctree:
 
     choicelists
+    gazetteer
     mixins
     models
     utils
@@ -42,6 +43,20 @@ class Plugin(ad.Plugin):
     region_label = _("County")
     """The verbose_name of the region field."""
 
+    use_gazetteer = True
+    """Whether to use an in-memory index for looking up places by name
+    or zip code.  See :mod:`lino_xl.lib.countries.gazetteer`.
+
+    """
+
+    gazetteer_timeout = 300
+    """The number of seconds after which the gazetteer of a country is
+    rebuilt from the database, so that places created or modified by
+    another process are found.  Set this to `None` if places are never
+    modified by another process.
+
+    """
+
     country_code = 'BE'
     """The 2-letter ISO code of the country where the site owner is
     located.  This may not be empty, and there must be a country with
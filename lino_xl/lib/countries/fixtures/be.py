@@ -21,6 +21,7 @@ Original sources:
 from lino.core.utils import resolve_model
 from lino.utils.instantiator import Instantiator
 from lino.api import dd, rt
+from lino_xl.lib.countries.utils import PlaceLoader
 
 
 # german names are my spontaneous guessings...
@@ -2882,16 +2883,18 @@ fr = u"""
 
 def objects():
     countries = dd.resolve_app('countries')
+    BE = countries.Country.objects.get(isocode='BE')
     city = Instantiator(countries.Place, "zip_code name",
-                        country='BE',
+                        country=BE,
                         type=countries.PlaceTypes.city).build
+    loader = PlaceLoader()
     for ln in belgian_cities.splitlines():
         ln = ln.strip()
         if ln and ln[0] != '#':
             args = ln.split(None, 1)
             o = city(*args)
             # print "%r %r" % (o.zip_code, o.name)
-            yield o
+            loader.add(o)
             #~ print __name__, "20121114"
             #~ return
     for ln in belgian_cities_nl_fr.splitlines():
@@ -2903,4 +2906,6 @@ def objects():
             args = [x.strip() for x in args]
             o = city(zip_code=args[0], **dd.babel_values('name',
                      nl=args[1], fr=args[2], de=args[3], en=args[3]))
-            yield o
+            loader.add(o)
+    loader.flush()
+    return []
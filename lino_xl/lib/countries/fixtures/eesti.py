@@ -16,6 +16,7 @@ from commondata.ee.places import (Village, SmallBorough, Borough,
                                   Township, Town, Municipality, County)
 
 from lino.api import dd
+from lino_xl.lib.countries.utils import PlaceLoader
 
 countries = dd.resolve_app('countries')
 
@@ -37,7 +38,7 @@ def cd2type(p):
         return countries.PlaceTypes.village
 
 
-def place2objects(country, place, parent=None):
+def place2objects(loader, country, place, parent=None):
     t = cd2type(place)
     if t is None:
         logger.info("20140612 ignoring place %s", place)
@@ -47,23 +48,22 @@ def place2objects(country, place, parent=None):
         parent=parent,
         zip_code=place.zip_code)
 
-    # We must save the parent before we can generate children.
-    try:
-        obj.full_clean()
-    except Exception as e:
-        raise Exception("Could not save %s : %r" % (
-            dd.obj2str(obj), e))
-    obj.save()
-    yield obj
+    # The loader gives a primary key to the parent before we generate
+    # children.
+    if loader.add(obj) is None:
+        # a duplicate: its children go to the existing place
+        obj.id = loader.get_duplicate_id(obj)
 
     for cp in place.children:
-        yield place2objects(country, cp, obj)
+        place2objects(loader, country, cp, obj)
 
 
 def objects():
 
     eesti = root()
     EE = countries.Country.objects.get(isocode="EE")
+    loader = PlaceLoader()
     for p in eesti.children:
-        yield place2objects(EE, p)
-        
+        place2objects(loader, EE, p)
+    loader.flush()
+    return []
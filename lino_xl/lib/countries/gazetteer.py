@@ -0,0 +1,262 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""A process-local in-memory index of geographic places.
+
+Usage example::
+
+    from lino_xl.lib.countries.gazetteer import get_gazetteer
+    gz = get_gazetteer('BE')
+    for pk in gz.suggest("lie", limit=10):
+        print(gz.get_name(pk))
+
+A :class:`Gazetteer` is built lazily the first time it is needed and
+forgotten as soon as a :class:`Place
+<lino_xl.lib.countries.models.Place>` of its country gets saved or
+deleted in this process.  Changes made by other processes are seen
+after :attr:`gazetteer_timeout
+<lino_xl.lib.countries.Plugin.gazetteer_timeout>` seconds.  Callers
+which find nothing in the gazetteer should nevertheless ask the
+database.
+
+The gazetteer also knows the hierarchy of the places and is used by
+the address formatters (:mod:`lino_xl.lib.countries.utils`) for
+walking up from a city to its region without database queries.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+import time
+import unicodedata
+from collections import deque
+
+from django.conf import settings
+from django.utils.encoding import python_2_unicode_compatible
+
+from lino.api import dd, rt
+
+from .choicelists import PlaceTypes
+
+_gazetteers = dict()
+
+WORD_SEPARATORS = " -'/("
+"""The characters after which a new word of a place name starts."""
+
+
+def type_values(types):
+    return set([getattr(t, 'value', t) or None for t in types])
+
+
+def normalize(s):
+    """Return the given name in lower case and without diacritics, as
+    used as key by :class:`Gazetteer`.
+
+    """
+    s = unicodedata.normalize('NFKD', s.lower())
+    return ''.join([c for c in s if not unicodedata.combining(c)])
+
+
+def word_starts(s):
+    """Yield the substrings of `s` which start at the beginning of a
+    word.  "sankt vith" yields "sankt vith" and "vith".
+
+    """
+    yield s
+    for i, c in enumerate(s):
+        if c in WORD_SEPARATORS and i + 1 < len(s):
+            yield s[i + 1:]
+
+
+@python_2_unicode_compatible
+class CachedPlace(object):
+    """A lightweight read-only stand-in for a :class:`Place
+    <lino_xl.lib.countries.models.Place>` as returned by
+    :meth:`Gazetteer.get_place`.  It has the attributes used when
+    formatting an address (`type`, `zip_code`, `parent` and the
+    babel fields of `name`) and renders like a place.
+
+    """
+
+    def __init__(self, gazetteer, pk, type, zip_code, parent_id, names):
+        self.gazetteer = gazetteer
+        self.pk = self.id = pk
+        if type and not hasattr(type, 'value'):
+            type = PlaceTypes.get_by_value(type)
+        self.type = type or None
+        self.zip_code = zip_code
+        self.parent_id = parent_id
+        self.name = names[0]
+        for i, lng in enumerate(settings.SITE.BABEL_LANGS):
+            setattr(self, 'name' + lng.suffix, names[i + 1])
+
+    @property
+    def parent(self):
+        if self.parent_id is None:
+            return None
+        p = self.gazetteer.get_place(self.parent_id)
+        if p is None:
+            # parent is in another country
+            p = rt.models.countries.Place.objects.get(pk=self.parent_id)
+        return p
+
+    def __str__(self):
+        return settings.SITE.babelattr(self, 'name')
+
+
+class Gazetteer(object):
+    """An index of the places of a given country (or of all countries if
+    `country_id` is `None`).
+
+    The index consists of a prefix trie over the names of the places
+    in all languages (where every word of a name is also a possible
+    prefix), a map from zip codes to places and a
+    :class:`CachedPlace` for every place.
+
+    .. attribute:: city_lines
+
+        A dict used by :meth:`AddressFormatter.get_city_lines
+        <lino_xl.lib.countries.utils.AddressFormatter.get_city_lines>`
+        for caching the formatted city lines of addresses in this
+        country.
+
+    """
+
+    def __init__(self, country_id=None):
+        self.country_id = country_id
+        self.trie = dict()
+        self.places = dict()
+        self.types = dict()
+        self.by_zip = dict()
+        self.city_lines = dict()
+        self.loaded = None
+
+    def load(self):
+        """Fill this index from the database using a single query."""
+        self.loaded = time.time()
+        Place = rt.models.countries.Place
+        name_fields = ['name' + lng.suffix
+                       for lng in settings.SITE.BABEL_LANGS]
+        qs = Place.objects.all()
+        if self.country_id is not None:
+            qs = qs.filter(country_id=self.country_id)
+        for row in qs.values_list(
+                'pk', 'type', 'zip_code', 'parent_id', 'name',
+                *name_fields).order_by('pk'):
+            pk, type, zip_code, parent_id = row[:4]
+            self.add(pk, type, zip_code, row[4:], parent_id)
+        return self
+
+    def add(self, pk, type, zip_code, names, parent_id=None):
+        self.places[pk] = CachedPlace(
+            self, pk, type, zip_code, parent_id, names)
+        self.types[pk] = getattr(type, 'value', type) or None
+        if zip_code:
+            self.by_zip.setdefault(zip_code, []).append(pk)
+        for name in set([normalize(n) for n in names if n]):
+            for key in word_starts(name):
+                node = self.trie
+                for c in key:
+                    node = node.setdefault(c, dict())
+                pks = node.setdefault('', [])
+                if pk not in pks:
+                    pks.append(pk)
+
+    def get_name(self, pk):
+        p = self.places.get(pk)
+        if p is not None:
+            return p.name
+
+    def get_place(self, pk):
+        """Return the :class:`CachedPlace` having the given primary key, or
+        `None` if there is no such place in this country.
+
+        """
+        return self.places.get(pk)
+
+    def get_ancestors(self, pk):
+        """Return a list of the primary keys of the places of which the
+        given place is a part, starting with its direct parent.
+
+        """
+        result = []
+        p = self.places.get(pk)
+        while p is not None and p.parent_id is not None:
+            if p.parent_id in result:  # avoid endless loop
+                break
+            result.append(p.parent_id)
+            p = self.places.get(p.parent_id)
+        return result
+
+    def suggest(self, text, types=None, limit=None):
+        """Return a list of the primary keys of the places whose name in
+        any language (or any word of it) starts with `text`.
+
+        Places whose name matches `text` exactly come first, followed
+        by the other places in order of increasing name length.  If
+        `types` is given, return only places of these types.
+
+        """
+        node = self.trie
+        for c in normalize(text):
+            node = node.get(c)
+            if node is None:
+                return []
+        if types is not None:
+            types = type_values(types)
+        result = []
+        seen = set()
+        queue = deque([node])
+        while queue:
+            node = queue.popleft()
+            for pk in node.get('', ()):
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                if types is None or self.types[pk] in types:
+                    result.append(pk)
+                    if limit is not None and len(result) >= limit:
+                        return result
+            for c in sorted(node):
+                if c:
+                    queue.append(node[c])
+        return result
+
+    def find_by_zip(self, zip_code, types=None):
+        """Return a list of the primary keys of the places having the given
+        zip code.
+
+        """
+        pks = self.by_zip.get(zip_code, [])
+        if types is None:
+            return pks
+        types = type_values(types)
+        return [pk for pk in pks if self.types[pk] in types]
+
+
+def get_gazetteer(country_id=None):
+    """Return the :class:`Gazetteer` for the given country (or for all
+    countries), building it if needed or if it is older than
+    :attr:`gazetteer_timeout
+    <lino_xl.lib.countries.Plugin.gazetteer_timeout>`.
+
+    """
+    gz = _gazetteers.get(country_id)
+    timeout = dd.plugins.countries.gazetteer_timeout
+    if gz is not None and timeout is not None \
+       and time.time() - gz.loaded >= timeout:
+        gz = None
+    if gz is None:
+        gz = _gazetteers[country_id] = Gazetteer(country_id).load()
+    return gz
+
+
+def forget_gazetteer(country_id=None):
+    """Forget the :class:`Gazetteer` of the given country and the one of
+    all countries.
+
+    """
+    _gazetteers.pop(country_id, None)
+    _gazetteers.pop(None, None)
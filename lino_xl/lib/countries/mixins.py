@@ -25,6 +25,7 @@ from lino.utils.addressable import Addressable
 
 from .choicelists import CountryDrivers, PlaceTypes
 from .utils import get_address_formatter
+from .gazetteer import get_gazetteer
 
 
 class CountryCity(dd.Model):
@@ -85,6 +86,16 @@ class CountryCity(dd.Model):
 
     def zip_code_changed(self, ar):
         if self.country and self.zip_code:
+            if dd.plugins.countries.use_gazetteer:
+                pks = get_gazetteer(self.country.pk).find_by_zip(
+                    self.zip_code)
+                if len(pks) > 0:
+                    city = rt.models.countries.Place.objects.filter(
+                        pk=pks[0]).first()
+                    if city is not None:
+                        self.city = city
+                        return
+                # not (or no longer) in the gazetteer, ask the database
             qs = rt.modules.countries.Place.objects.filter(
                 country=self.country, zip_code=self.zip_code)
             if qs.count() > 0:
@@ -214,7 +225,7 @@ class AddressLocation(CountryRegionCity, Addressable):
     def address_location_lines(self):
         #~ lines = []
         #~ lines = [self.name]
-        af = get_address_formatter(self.country)
+        af = get_address_formatter(self.country_id)
 
         if self.addr1:
             yield self.addr1
@@ -226,9 +237,8 @@ class AddressLocation(CountryRegionCity, Addressable):
         for ln in af.get_city_lines(self):
             yield ln
 
-        if self.country is not None:
-            kodu = dd.plugins.countries.get_my_country()
-            if kodu is None or self.country != kodu:
+        if self.country_id is not None:
+            if self.country_id != dd.plugins.countries.country_code:
                 # (if self.country != sender's country)
                 yield str(self.country)
 
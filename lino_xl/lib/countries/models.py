@@ -15,6 +15,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
 
 from lino.api import dd
@@ -24,6 +25,7 @@ from lino.modlib.plausibility.choicelists import Checker
 from lino_xl.lib.contacts.roles import ContactsUser, ContactsStaff
 
 from .choicelists import PlaceTypes, CountryDrivers
+from .gazetteer import get_gazetteer, forget_gazetteer, WORD_SEPARATORS
 
 
 FREQUENT_COUNTRIES = ['BE', 'NL', 'DE', 'FR', 'LU']
@@ -150,6 +152,52 @@ class Place(Hierarchical, mixins.BabelNamed):
             s += " (%s)" % str(self.type)
         return s
 
+    quick_search_limit = 500
+
+    @classmethod
+    def quick_search_filter(cls, search_text, prefix=''):
+        """Overrides the default quick search (which does an `icontains`
+        lookup on every name field) by a lookup in the
+        :class:`Gazetteer
+        <lino_xl.lib.countries.gazetteer.Gazetteer>`.  Note that this
+        finds only places whose name (or a word of it) *starts* with
+        the search text.  Set :attr:`use_gazetteer
+        <lino_xl.lib.countries.Plugin.use_gazetteer>` to `False` if
+        you prefer the default behaviour.
+
+        This filter is combined with the country and type restrictions
+        of the chooser, so it must return *all* matching places.  If
+        there are more than :attr:`quick_search_limit` of them, or if
+        the gazetteer finds none (e.g. because the place has just been
+        created by another process), we let the database find them
+        using :meth:`word_start_filter`.
+
+        """
+        if prefix or not dd.plugins.countries.use_gazetteer \
+           or search_text.startswith('#'):
+            return super(Place, cls).quick_search_filter(
+                search_text, prefix)
+        pks = get_gazetteer().suggest(
+            search_text, limit=cls.quick_search_limit + 1)
+        if len(pks) == 0 or len(pks) > cls.quick_search_limit:
+            return cls.word_start_filter(search_text)
+        return models.Q(pk__in=pks)
+
+    @classmethod
+    def word_start_filter(cls, search_text):
+        """Return a filter for the places whose name in any language (or
+        a word of it) starts with the given text.  Unlike the
+        gazetteer, this is sensitive to diacritics.
+
+        """
+        q = models.Q()
+        for fn in ['name'] + ['name' + lng.suffix
+                              for lng in settings.SITE.BABEL_LANGS]:
+            q |= models.Q(**{fn + '__istartswith': search_text})
+            for c in WORD_SEPARATORS:
+                q |= models.Q(**{fn + '__icontains': c + search_text})
+        return q
+
     @classmethod
     def get_cities(cls, country):
         if country is None:
@@ -180,6 +228,13 @@ class Place(Hierarchical, mixins.BabelNamed):
             #~ return country.place_set.order_by('name')
         #~ return cls.city.field.rel.model.objects.order_by('name')
 
+
+@dd.receiver(post_save, sender=Place)
+@dd.receiver(post_delete, sender=Place)
+def forget_place(sender, instance=None, **kwargs):
+    forget_gazetteer(instance.country_id)
+
+
 dd.update_field(
     Place, 'parent', verbose_name=_("Part of"),
     help_text=_("The superordinate geographic place "
@@ -18,14 +18,18 @@ from builtins import object
 import logging
 logger = logging.getLogger(__name__)
 
-from django.core.exceptions import ValidationError
+from django.conf import settings
+from django.utils import translation
+from django.core.management.color import no_style
+from django.db import models, connection, transaction
 
-from lino.api import rt
+from lino.api import dd, rt
 from lino.utils import join_words
 from lino.utils.instantiator import InstanceGenerator
 
 from .choicelists import PlaceTypes
 from .choicelists import CountryDrivers
+from .gazetteer import get_gazetteer, forget_gazetteer
 
 
 class AddressFormatter(object):
@@ -33,10 +37,44 @@ class AddressFormatter(object):
 
     """
     def get_city_lines(me, self):
-        if self.city is not None:
-            s = join_words(self.zip_code or self.city.zip_code, self.city)
+        """Return a list of the lines of the postal address of `self`
+        which come after the street lines.
+
+        When :attr:`use_gazetteer
+        <lino_xl.lib.countries.Plugin.use_gazetteer>` is set, the
+        places are taken from the :class:`Gazetteer
+        <lino_xl.lib.countries.gazetteer.Gazetteer>` of the country
+        and the result is cached there per city, zip code, region and
+        language.
+
+        """
+        region_id = getattr(self, 'region_id', None)
+        if self.city_id is None and region_id is None:
+            return me.format_city_lines(None, self.zip_code, None)
+        if not dd.plugins.countries.use_gazetteer or not self.country_id:
+            return me.format_city_lines(
+                self.city, self.zip_code, getattr(self, 'region', None))
+        gz = get_gazetteer(self.country_id)
+        key = (me.__class__, self.city_id, self.zip_code, region_id,
+               translation.get_language())
+        lines = gz.city_lines.get(key)
+        if lines is None:
+            city = region = None
+            if self.city_id is not None:
+                city = gz.get_place(self.city_id) or self.city
+            if region_id is not None:
+                region = gz.get_place(region_id) or self.region
+            lines = tuple(me.format_city_lines(city, self.zip_code, region))
+            gz.city_lines[key] = lines
+        return list(lines)
+
+    def format_city_lines(me, city, zip_code, region):
+        lines = []
+        if city is not None:
+            s = join_words(zip_code or city.zip_code, city)
             if s:
-                yield s
+                lines.append(s)
+        return lines
 
     def get_street_lines(me, self):
         if self.street:
@@ -66,11 +104,10 @@ class EstonianAddressFormatter(AddressFormatter):
             return "%s maakond" % p
         return str(p)
 
-    def get_city_lines(me, self):
+    def format_city_lines(me, city, zip_code, region):
         lines = []
-        if self.city:
-            city = self.city
-            zip_code = self.zip_code or self.city.zip_code
+        if city:
+            zip_code = zip_code or city.zip_code
             # Tallinna linnaosade asemel kirjutakse "Tallinn"
             if city.type == PlaceTypes.township and city.parent:
                 city = city.parent
@@ -83,8 +120,8 @@ class EstonianAddressFormatter(AddressFormatter):
                 while p and not CountryDrivers.EE.is_region(p):
                     lines.append(me.format_place(p))
                     p = p.parent
-                if self.region:
-                    s = join_words(zip_code, self.region)
+                if region:
+                    s = join_words(zip_code, region)
                 elif p:
                     s = join_words(zip_code, me.format_place(p))
                 elif len(lines) and zip_code:
@@ -93,7 +130,7 @@ class EstonianAddressFormatter(AddressFormatter):
                 else:
                     s = zip_code
         else:
-            s = join_words(self.zip_code, self.region)
+            s = join_words(zip_code, region)
         if s:
             lines.append(s)
         return lines
@@ -106,18 +143,137 @@ ADDRESS_FORMATTERS['EE'] = EstonianAddressFormatter()
 
 def get_address_formatter(country):
     """Return the address formatter (an :class:`AddressFormatter`
-instance) for the given country."""
-    if country and country.isocode:
-        af = ADDRESS_FORMATTERS.get(country.isocode, None)
+instance) for the given country (a :class:`Country
+<lino_xl.lib.countries.models.Country>` or its ISO code)."""
+    isocode = getattr(country, 'isocode', country)
+    if isocode:
+        af = ADDRESS_FORMATTERS.get(isocode, None)
         if af is not None:
             return af
     return ADDRESS_FORMATTERS.get(None)
 
 
+class PlaceLoader(object):
+    """Collects new :class:`Place <lino_xl.lib.countries.models.Place>`
+    instances in memory and inserts them into the database using
+    `bulk_create`, one level of the hierarchy after the other.
+
+    Every place gets its primary key when it is added, so that it can
+    be used as parent of subsequently added places before anything has
+    been saved.  Places are not validated using `full_clean`, but
+    duplicates (which would violate the `unique_together` constraint)
+    of other added places or of places in the database are ignored.
+
+    Usage::
+
+        loader = PlaceLoader()
+        be = loader.add(Place(name="Belgium", country=BE, ...))
+        loader.add(Place(name="Eupen", parent=be, ...))
+        loader.flush()
+
+    """
+    chunk_size = 500
+
+    def __init__(self):
+        self.model = rt.models.countries.Place
+        max_id = self.model.objects.aggregate(
+            models.Max('id'))['id__max']
+        self.next_id = (max_id or 0) + 1
+        self.levels = []
+        self.depths = dict()
+        self.keys = dict()  # key -> primary key
+        self.loaded_countries = set()
+
+    def load_keys(self, country_id):
+        """Remember the places of the given country which exist already in
+        the database so that :meth:`add` doesn't add them again.
+
+        """
+        self.loaded_countries.add(country_id)
+        qs = self.model.objects.filter(country_id=country_id)
+        for row in qs.values_list(
+                'id', 'country_id', 'parent_id', 'name', 'type', 'zip_code'):
+            self.keys[self.get_key(*row[1:])] = row[0]
+
+    def get_obj_key(self, obj):
+        return self.get_key(obj.country_id, obj.parent_id, obj.name,
+                            obj.type, obj.zip_code)
+
+    def get_duplicate_id(self, obj):
+        """Return the primary key of the place which has been added before
+        or exists in the database and of which the given place is a
+        duplicate, or `None`.
+
+        """
+        if obj.country_id not in self.loaded_countries:
+            self.load_keys(obj.country_id)
+        return self.keys.get(self.get_obj_key(obj))
+
+    @staticmethod
+    def get_key(country_id, parent_id, name, type, zip_code):
+        return (country_id, parent_id, name,
+                getattr(type, 'value', type) or None, zip_code)
+
+    def add(self, obj):
+        """Add the given unsaved place and return it.  Return `None` if
+        it is a duplicate of a place which has been added before or
+        exists in the database (see :meth:`get_duplicate_id`).
+
+        """
+        if not settings.SITE.allow_duplicate_cities:
+            if self.get_duplicate_id(obj) is not None:
+                logger.debug("Ignoring duplicate place %s", obj)
+                return None
+            self.keys[self.get_obj_key(obj)] = self.next_id
+        obj.id = self.next_id
+        self.next_id += 1
+        if obj.parent_id is None:
+            depth = 0
+        else:
+            depth = self.depths.get(obj.parent_id, -1) + 1
+        self.depths[obj.id] = depth
+        while len(self.levels) <= depth:
+            self.levels.append([])
+        self.levels[depth].append(obj)
+        return obj
+
+    def flush(self):
+        """Insert all collected places into the database."""
+        countries = set()
+        count = 0
+        with transaction.atomic():
+            for level in self.levels:
+                for i in range(0, len(level), self.chunk_size):
+                    self.model.objects.bulk_create(
+                        level[i:i + self.chunk_size])
+                for obj in level:
+                    countries.add(obj.country_id)
+                count += len(level)
+            # we specified the primary keys ourselves, so the sequence
+            # needs to get updated (needed at least on PostgreSQL)
+            sql = connection.ops.sequence_reset_sql(
+                no_style(), [self.model])
+            if sql:
+                with connection.cursor() as cursor:
+                    for stmt in sql:
+                        cursor.execute(stmt)
+        for cid in countries:
+            forget_gazetteer(cid)
+        logger.info("Inserted %d places.", count)
+        self.levels = []
+        self.depths = dict()
+        return count
+
+
 class PlaceGenerator(InstanceGenerator):
+    """Generates places and inserts them using a :class:`PlaceLoader`.
+    Call :meth:`flush` when all places have been generated.
+
+    """
     def __init__(self):
         super(PlaceGenerator, self).__init__()
         self.prev_obj = None
+        self.loader = PlaceLoader()
         EE = rt.modules.countries.Country.objects.get(isocode="EE")
 
         for pt in PlaceTypes.objects():
@@ -145,17 +301,15 @@ class PlaceGenerator(InstanceGenerator):
                         "%s (%s) is no parent for %s (%s)",
                         prev, prev.type, obj, obj.type)
 
-        try:
-            obj.full_clean()
-            obj.save()
+        if self.loader.add(obj) is not None:
             self.prev_obj = obj
             return obj
-        except ValidationError as e:
-            logger.warning(
-                "Failed to load %s (%s) : %s",
-                obj, obj.type, e)
         # return super(PlaceGenerator, self).on_new(obj)
-    
+
+    def flush(self):
+        self.loader.flush()
+        return super(PlaceGenerator, self).flush()
+
     def can_be_parent(self, ptype, otype):
         """return True if a place of type pt can be parent for a place of type
         ot.
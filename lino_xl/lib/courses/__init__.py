@@ -25,6 +25,7 @@ historic reasons.
    choicelists
    workflows
    desktop
+   management.commands.update_used_places
 
 """
 
@@ -39,6 +40,16 @@ class Plugin(ad.Plugin):
     pupil_model = 'contacts.Person'
     pupil_name_fields = "pupil__name"
 
+    count_used_places = False
+    """Whether to store the number of used places of every activity in
+    a database field :attr:`used_places
+    <lino_xl.lib.courses.models.Course.used_places>`.  This field is
+    updated whenever an enrolment is saved or deleted, and every day
+    for the enrolments which started or ended.  Use
+    :manage:`update_used_places` after changing this setting.
+
+    """
+
     needs_plugins = ['lino_xl.lib.cal']
 
     def on_site_startup(self, site):
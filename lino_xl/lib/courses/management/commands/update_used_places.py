@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: update_used_places
+
+Update the :attr:`used_places
+<lino_xl.lib.courses.models.Course.used_places>` field of all
+activities.  Run this once after setting :attr:`count_used_places
+<lino_xl.lib.courses.Plugin.count_used_places>` to `True`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lino.api import dd
+from lino.utils import dblogger
+
+from lino_xl.lib.courses.models import update_used_places
+
+
+class Command(BaseCommand):
+    help = "Update the number of used places of all activities."
+
+    def handle(self, *args, **options):
+        if not dd.plugins.courses.count_used_places:
+            raise CommandError(
+                "This site does not count the used places.")
+        n = update_used_places()
+        dblogger.info("Updated the used places of %d activities.", n)
@@ -25,6 +25,7 @@ ONE = Decimal(1)
 
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
@@ -44,6 +45,7 @@ from lino.modlib.users.mixins import UserAuthored
 from lino.modlib.printing.mixins import Printable
 from lino_xl.lib.cal.mixins import Reservation
 from lino_xl.lib.cal.choicelists import Recurrencies
+from lino_xl.lib.xl.utils import get_page_ids
 
 from lino.utils.dates import DatePeriodValue
 
@@ -55,12 +57,14 @@ try:
     teacher_model = dd.plugins.courses.teacher_model
     pupil_model = dd.plugins.courses.pupil_model
     pupil_name_fields = dd.plugins.courses.pupil_name_fields
+    count_used_places = dd.plugins.courses.count_used_places
 except AttributeError:
     # Happens only when Sphinx autodoc imports it and this module is
     # not installed.
     teacher_model = 'foo.Bar'
     pupil_model = 'foo.Bar'
     pupil_name_fields = 'foo bar'
+    count_used_places = False
 
 FILL_EVENT_GUESTS = False
 
@@ -257,6 +261,12 @@ class Course(Reservation, Duplicable):
 
         Number of confirmed places.
 
+    .. attribute:: used_places
+
+        Number of places used by the active enrolments.  This database
+        field exists only when :attr:`count_used_places
+        <lino_xl.lib.courses.Plugin.count_used_places>` is `True`.
+
 
     """
 
@@ -461,23 +471,70 @@ class Course(Reservation, Duplicable):
         # logger.info("20140819 %s", res)
         return res['places__sum'] or 0
 
+    def get_campaign_partners(self):
+        """Return the pupils of this course whose enrolment is requested or
+        confirmed.  See :class:`lino_xl.lib.outbox.models.Campaign`.
+
+        """
+        Pupil = dd.plugins.courses.pupil_model
+        return Pupil.objects.filter(
+            enrolments_by_pupil__course=self,
+            enrolments_by_pupil__state__in=(
+                EnrolmentStates.requested,
+                EnrolmentStates.confirmed)).distinct()
+
+    def get_places_sums(self, ar=None):
+        """Return a dict which maps every enrolment state to the number of
+        places in the active enrolments of this course.
+
+        When called with an action request, the numbers are loaded
+        for all courses of the current page in a single query (see
+        :func:`load_places_sums`) and cached on the request.
+
+        """
+        if ar is None:
+            return load_places_sums([self.pk])[self.pk]
+        cache = getattr(ar, '_places_sums', None)
+        if cache is None:
+            cache = ar._places_sums = dict()
+        sums = cache.get(self.pk)
+        if sums is None:
+            ids = get_page_ids(ar, self, Course)
+            cache.update(load_places_sums(ids))
+            sums = cache[self.pk]
+        return sums
+
     def get_free_places(self, today=None):
         return self.max_places - self.get_used_places(today)
 
     def get_used_places(self, today=None):
-        states = EnrolmentStates.filter(uses_a_place=True)
-        return self.get_places_sum(today, state__in=states)
+        """Return the number of places used by the enrolments which are
+        active at the given date (default today).
+
+        This reads the :attr:`used_places` field when it exists and the
+        date is today, otherwise it uses :func:`load_places_sums`.
+
+        """
+        if count_used_places:
+            if today is None or today == dd.today():
+                return self.used_places
+        sums = load_places_sums([self.pk], today)[self.pk]
+        return sum([n for st, n in sums.items() if st.uses_a_place])
 
     # @dd.displayfield(_("Free places"), max_length=5)
     @dd.virtualfield(models.IntegerField(_("Free places")))
     def free_places(self, ar=None):
         if not self.max_places:
             return None  # _("Unlimited")
-        return self.get_free_places()
+        if ar is None or count_used_places:
+            return self.get_free_places()
+        sums = self.get_places_sums(ar)
+        used = sum([n for st, n in sums.items() if st.uses_a_place])
+        return self.max_places - used
 
     @dd.virtualfield(models.IntegerField(_("Requested")))
     def requested(self, ar):
-        return self.get_places_sum(state=EnrolmentStates.requested)
+        return self.get_places_sums(ar)[EnrolmentStates.requested]
         # pv = dict(start_date=dd.today())
         # pv.update(state=EnrolmentStates.requested)
         # return rt.actors.courses.EnrolmentsByCourse.request(
@@ -485,7 +542,7 @@ class Course(Reservation, Duplicable):
 
     @dd.virtualfield(models.IntegerField(_("Confirmed")))
     def confirmed(self, ar):
-        return self.get_places_sum(state=EnrolmentStates.confirmed)
+        return self.get_places_sums(ar)[EnrolmentStates.confirmed]
         # pv = dict(start_date=dd.today())
         # pv.update(state=EnrolmentStates.confirmed)
         # return rt.actors.courses.EnrolmentsByCourse.request(
@@ -514,6 +571,104 @@ class Course(Reservation, Duplicable):
 
 
 
+def load_places_sums(course_ids=None, today=None):
+    """Return a dict which maps the primary key of every given course
+    (or of every course having enrolments) to a dict `{state: places}`
+    as returned by :meth:`Course.get_places_sums`.
+
+    This runs a single query which sums up the places of the
+    enrolments which are active at the given date (default today),
+    one conditional sum per enrolment state.
+
+    """
+    Enrolment = rt.models.courses.Enrolment
+    PeriodEvents = rt.modules.system.PeriodEvents
+    states = EnrolmentStates.get_list_items()
+    qs = Enrolment.objects.all()
+    if course_ids is not None:
+        qs = qs.filter(course_id__in=course_ids)
+    rng = DatePeriodValue(today or dd.today(), None)
+    qs = PeriodEvents.active.add_filter(qs, rng)
+    sums = dict()
+    for i, st in enumerate(states):
+        sums['places_{0}'.format(i)] = models.Sum(models.Case(
+            models.When(state=st, then='places'),
+            default=models.Value(0),
+            output_field=models.IntegerField()))
+    qs = qs.order_by().values('course_id').annotate(**sums)
+    result = dict()
+    if course_ids is not None:
+        for pk in course_ids:
+            result[pk] = dict([(st, 0) for st in states])
+    for row in qs:
+        result[row['course_id']] = dict([
+            (st, row['places_{0}'.format(i)] or 0)
+            for i, st in enumerate(states)])
+    return result
+
+
+def update_used_places(course_ids=None):
+    """Update the :attr:`used_places <Course.used_places>` of the given
+    courses (or of all courses).  Return the number of courses whose
+    value has changed.
+
+    """
+    Course = rt.models.courses.Course
+    qs = Course.objects.all()
+    if course_ids is not None:
+        qs = qs.filter(pk__in=course_ids)
+    sums = load_places_sums(course_ids)
+    n = 0
+    for pk, old in qs.values_list('pk', 'used_places'):
+        used = sum([places for st, places in sums.get(pk, {}).items()
+                    if st.uses_a_place])
+        if used != old:
+            Course.objects.filter(pk=pk).update(used_places=used)
+            n += 1
+    return n
+
+
+if count_used_places:
+
+    dd.inject_field(
+        'courses.Course', 'used_places',
+        models.IntegerField(_("Used places"), default=0, editable=False))
+
+    @dd.receiver(dd.pre_analyze, dispatch_uid="count_used_places")
+    def setup_used_places_receivers(sender, **kw):
+        Enrolment = sender.models.courses.Enrolment
+        pre_save.connect(remember_enrolment_course, sender=Enrolment)
+        post_save.connect(update_course_places, sender=Enrolment)
+        post_delete.connect(update_course_places, sender=Enrolment)
+
+    def remember_enrolment_course(sender, instance=None, raw=False, **kw):
+        instance._old_course_id = None
+        if raw or settings.SITE.loading_from_dump or instance.pk is None:
+            return
+        qs = sender.objects.filter(pk=instance.pk).exclude(
+            course_id=instance.course_id)
+        for course_id in qs.values_list('course_id', flat=True):
+            instance._old_course_id = course_id
+
+    def update_course_places(sender, instance=None, raw=False, **kw):
+        if raw or settings.SITE.loading_from_dump:
+            return
+        course_ids = [instance.course_id]
+        old = getattr(instance, '_old_course_id', None)
+        if old is not None:
+            course_ids.append(old)
+        update_used_places(course_ids)
+
+    @dd.schedule_daily(at="00:01")
+    def update_all_used_places():
+        # enrolments start and end without being saved.  Run just
+        # after midnight so that the counts are right for the whole
+        # day (they depend on dd.today()).
+        n = update_used_places()
+        if n:
+            logger.info("Updated the used places of %d activities.", n)
+
+
 # customize fields coming from mixins to override their inherited
 # default verbose_names
 dd.update_field(Course, 'every_unit', default=models.NOT_PROVIDED)
@@ -7,6 +7,14 @@
 Manage information about the *career* or *curriculum vitae* of a
 person.
 
+.. autosummary::
+   :toctree:
+
+    models
+    mixins
+    matching
+    management.commands.benchmark_matching
+
 """
 
 from __future__ import unicode_literals
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: benchmark_matching
+
+Measure the speed of :class:`SkillsIndex
+<lino_xl.lib.cv.matching.SkillsIndex>` on randomly generated career
+data.  The data is generated in memory, the database is not used.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from lino_xl.lib.cv.matching import (
+    SkillsIndex, LANGUAGE, TRAINING, EDUCATION, SECTOR, FUNCTION,
+    knows_language, had_training, has_education_level,
+    worked_in_sector, worked_as)
+
+LANGUAGES = ['de', 'fr', 'en', 'nl', 'es', 'it', 'ar', 'tr', 'ru', 'pl']
+NUM_TRAININGS = 50
+NUM_LEVELS = 8
+NUM_SECTORS = 30
+NUM_FUNCTIONS = 100
+
+
+def make_features(num_persons, rnd):
+    """Yield the features of `num_persons` random persons."""
+    for pk in range(1, num_persons + 1):
+        for lng in rnd.sample(LANGUAGES, rnd.randint(1, 3)):
+            yield (pk, LANGUAGE, lng, rnd.randint(0, 5))
+        for i in range(rnd.randint(0, 2)):
+            yield (pk, TRAINING, rnd.randint(1, NUM_TRAININGS), 1)
+        if rnd.random() < 0.7:
+            yield (pk, EDUCATION, None, rnd.randint(1, NUM_LEVELS))
+        for i in range(rnd.randint(0, 4)):
+            days = rnd.randint(30, 3000)
+            yield (pk, SECTOR, rnd.randint(1, NUM_SECTORS), days)
+            yield (pk, FUNCTION, rnd.randint(1, NUM_FUNCTIONS), days)
+
+
+def make_query(rnd):
+    """Return a random list of three to five criteria."""
+    choices = [
+        lambda: knows_language(rnd.choice(LANGUAGES), rnd.randint(2, 4)),
+        lambda: had_training(rnd.randint(1, NUM_TRAININGS)),
+        lambda: has_education_level(rnd.randint(1, NUM_LEVELS)),
+        lambda: worked_in_sector(
+            rnd.randint(1, NUM_SECTORS), rnd.randint(0, 3)),
+        lambda: worked_as(
+            rnd.randint(1, NUM_FUNCTIONS), rnd.randint(0, 3),
+            required=False)]
+    return [f() for f in rnd.sample(choices, rnd.randint(3, 5))]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the career matching engine on synthetic data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--persons', action='store', type=int,
+                            dest='persons', default=100000,
+                            help='Number of persons to generate.')
+        parser.add_argument('--queries', action='store', type=int,
+                            dest='queries', default=100,
+                            help='Number of queries to run.')
+        parser.add_argument('--seed', action='store', type=int,
+                            dest='seed', default=1,
+                            help='Seed of the random generator.')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        t0 = time.time()
+        index = SkillsIndex().build(
+            make_features(options['persons'], rnd))
+        self.stdout.write("Built index of {0} persons in {1:.2f} s".format(
+            len(index.pks), time.time() - t0))
+        times = []
+        found = 0
+        for i in range(options['queries']):
+            criteria = make_query(rnd)
+            t0 = time.time()
+            found += len(index.search(criteria, limit=None))
+            times.append(time.time() - t0)
+        times.sort()
+        ms = [t * 1000 for t in times]
+        self.stdout.write(
+            "{0} queries: mean {1:.2f} ms, median {2:.2f} ms, "
+            "max {3:.2f} ms, {4:.1f} matches per query".format(
+                len(ms), sum(ms) / len(ms), ms[len(ms) // 2], ms[-1],
+                found / len(ms)))
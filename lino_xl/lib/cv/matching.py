@@ -0,0 +1,331 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""A search engine for finding persons whose career matches a series
+of criteria.
+
+Usage example::
+
+    from lino_xl.lib.cv.matching import (
+        skills_index, knows_language, had_training, worked_in_sector)
+    for score, pk in skills_index.search([
+            knows_language('fr', 3),
+            had_training(forklift),
+            worked_in_sector(logistics, years=2)]):
+        print(score, pk)
+
+See also :manage:`benchmark_matching`.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+from builtins import object
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from lino.api import dd, rt
+
+LANGUAGE = 'L'
+TRAINING = 'T'
+EDUCATION = 'E'
+SECTOR = 'S'
+FUNCTION = 'F'
+
+NATIVE_LEVEL = 5
+
+# the type code of the arrays (a native string also under Python 2)
+TYPECODE = str('l')
+
+CEF_LEVELS = {
+    'A1': 1, 'A2': 1, 'A2+': 2,
+    'B1': 2, 'B2': 3, 'B2+': 3,
+    'C1': 4, 'C2': 4, 'C2+': 4}
+
+
+Criterion = namedtuple(
+    'Criterion', 'kind key minimum weight required')
+"""A criterion of a search.  A person matches the criterion when they
+have the feature `(kind, key)` with a value of at least `minimum`.
+Every criterion adds `weight` to the score of a person (or less for
+persons with a smaller value).  Only persons who match all
+`required` criteria are returned.
+
+"""
+
+
+def knows_language(language, level=2, weight=1, required=True):
+    """The person knows the given language at least at the given level
+    (0 to 4 like :class:`HowWell <lino_xl.lib.cv.mixins.HowWell>`,
+    5 for mother tongue)."""
+    return Criterion(LANGUAGE, getattr(language, 'pk', language),
+                     level, weight, required)
+
+
+def had_training(study_type, weight=1, required=True):
+    """The person had a training of the given :class:`StudyType
+    <lino_xl.lib.cv.models.StudyType>`."""
+    return Criterion(TRAINING, getattr(study_type, 'pk', study_type),
+                     1, weight, required)
+
+
+def has_education_level(level, weight=1, required=True):
+    """The person has a study of the given :class:`EducationLevel
+    <lino_xl.lib.cv.models.EducationLevel>` (or sequence number) or of
+    a higher one."""
+    return Criterion(EDUCATION, None, getattr(level, 'seqno', level),
+                     weight, required)
+
+
+def worked_in_sector(sector, years=0, weight=1, required=True):
+    """The person has worked at least the given number of years in the
+    given :class:`Sector <lino_xl.lib.cv.models.Sector>`."""
+    return Criterion(SECTOR, getattr(sector, 'pk', sector),
+                     int(years * 365), weight, required)
+
+
+def worked_as(function, years=0, weight=1, required=True):
+    """The person has worked at least the given number of years in the
+    given :class:`Function <lino_xl.lib.cv.models.Function>`."""
+    return Criterion(FUNCTION, getattr(function, 'pk', function),
+                     int(years * 365), weight, required)
+
+
+def get_language_level(spoken, written, native, cef_level):
+    if native:
+        return NATIVE_LEVEL
+    level = 0
+    for v in (spoken, written):
+        v = getattr(v, 'value', v)
+        if v:
+            level = max(level, int(v))
+    cef_level = getattr(cef_level, 'value', cef_level)
+    return max(level, CEF_LEVELS.get(cef_level, 0))
+
+
+def iter_features(person_ids=None):
+    """Yield a tuple `(person, kind, key, value)` for every feature
+    stored in the cv tables about the given persons (or all persons).
+    The same `(person, kind, key)` can be yielded more than once.
+    """
+    cv = rt.models.cv
+
+    def rows(model, *fields):
+        qs = model.objects.all()
+        if person_ids is not None:
+            qs = qs.filter(person_id__in=person_ids)
+        return qs.values_list('person_id', *fields).iterator()
+
+    for pk, lng, spoken, written, native, cef in rows(
+            cv.LanguageKnowledge, 'language_id', 'spoken', 'written',
+            'native', 'cef_level'):
+        yield (pk, LANGUAGE, lng, get_language_level(
+            spoken, written, native, cef))
+    for pk, type_id in rows(cv.Training, 'type_id'):
+        yield (pk, TRAINING, type_id, 1)
+    for pk, seqno in rows(cv.Study, 'education_level__seqno'):
+        if seqno is not None:
+            yield (pk, EDUCATION, None, seqno)
+    today = dd.today()
+    for pk, sector, function, start, end in rows(
+            cv.Experience, 'sector_id', 'function_id', 'start_date',
+            'end_date'):
+        if start is None:
+            continue
+        days = max(0, ((end or today) - start).days)
+        if sector is not None:
+            yield (pk, SECTOR, sector, days)
+        if function is not None:
+            yield (pk, FUNCTION, function, days)
+
+
+# The value of a feature which is yielded more than once is the sum of
+# all values for durations, otherwise the maximum.
+ADDITIVE = frozenset([SECTOR, FUNCTION])
+
+
+def combine(kind, old, new):
+    if old is None:
+        return new
+    if kind in ADDITIVE:
+        return old + new
+    return max(old, new)
+
+
+class SkillsIndex(object):
+    """An in-memory inverted index of the features of all persons.
+
+    Every person gets a *position*.  For every feature `(kind, key)`
+    the index stores a pair of arrays: the sorted positions of the
+    persons having this feature, and their values.
+
+    The index is built from :func:`iter_features` when it is first
+    used.  Call :meth:`forget` when the cv data of a person has
+    changed: the features of these persons are then reloaded before
+    the next search.  This happens automatically when a language
+    knowledge, training, study or work experience is saved or
+    deleted.
+
+    The duration of an experience without end date depends on the
+    current date, so the whole index is rebuilt before the first
+    search of every day.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget everything.  The index will be rebuilt when used next
+        time."""
+        with self.lock:
+            self.pks = None
+            self.positions = None
+            self.postings = None
+            self.dirty = set()
+            self.today = None
+
+    def forget(self, *person_ids):
+        """Mark the given persons as changed."""
+        with self.lock:
+            if self.pks is not None:
+                self.dirty.update(person_ids)
+
+    def build(self, features):
+        """Build the index from the given iterable of `(person, kind, key,
+        value)` tuples."""
+        pks = array(TYPECODE)
+        positions = dict()
+        values = dict()  # (kind, key) -> {position: value}
+        for pk, kind, key, value in features:
+            pos = positions.get(pk)
+            if pos is None:
+                pos = positions[pk] = len(pks)
+                pks.append(pk)
+            d = values.setdefault((kind, key), dict())
+            d[pos] = combine(kind, d.get(pos), value)
+        postings = dict()
+        for k, d in values.items():
+            items = sorted(d.items())
+            postings[k] = (array(TYPECODE, [p for p, v in items]),
+                           array(TYPECODE, [v for p, v in items]))
+        self.pks = pks
+        self.positions = positions
+        self.postings = postings
+        self.dirty = set()
+        self.today = dd.today()
+        return self
+
+    def load(self):
+        self.build(iter_features())
+        logger.debug("Loaded skills of %d persons", len(self.pks))
+
+    def refresh(self):
+        """Reload the features of the persons who have changed.  The
+        caller must hold :attr:`lock`."""
+        if self.pks is None or self.today != dd.today():
+            self.load()
+            return
+        if not self.dirty:
+            return
+        pks = list(self.dirty)
+        self.dirty = set()
+        todo = set()
+        for pk in pks:
+            pos = self.positions.get(pk)
+            if pos is None:
+                pos = self.positions[pk] = len(self.pks)
+                self.pks.append(pk)
+            todo.add(pos)
+        # remove the old features of these persons
+        for positions, values in self.postings.values():
+            for pos in todo:
+                i = bisect_left(positions, pos)
+                if i < len(positions) and positions[i] == pos:
+                    del positions[i]
+                    del values[i]
+        # insert their new features
+        new = dict()
+        for pk, kind, key, value in iter_features(pks):
+            k = (kind, key, self.positions[pk])
+            new[k] = combine(kind, new.get(k), value)
+        for (kind, key, pos), value in new.items():
+            positions, values = self.postings.setdefault(
+                (kind, key), (array(TYPECODE), array(TYPECODE)))
+            i = bisect_left(positions, pos)
+            positions.insert(i, pos)
+            values.insert(i, value)
+
+    def get_value(self, c, pos):
+        """Return the value of the feature of the given criterion for the
+        person at the given position, or `None`."""
+        posting = self.postings.get((c.kind, c.key))
+        if posting is None:
+            return None
+        positions, values = posting
+        i = bisect_left(positions, pos)
+        if i < len(positions) and positions[i] == pos:
+            return values[i]
+        return None
+
+    def get_candidates(self, criteria):
+        required = [c for c in criteria if c.required]
+        if not required:
+            result = set()
+            for c in criteria:
+                posting = self.postings.get((c.kind, c.key))
+                if posting is not None:
+                    result.update(posting[0])
+            return result
+        empty = (array(TYPECODE), array(TYPECODE))
+        required.sort(
+            key=lambda c: len(self.postings.get((c.kind, c.key), empty)[0]))
+        positions, values = self.postings.get(
+            (required[0].kind, required[0].key), empty)
+        result = [p for p, v in zip(positions, values)
+                  if v >= required[0].minimum]
+        for c in required[1:]:
+            if not result:
+                break
+            result = [p for p in result if self.matches(c, p)]
+        return result
+
+    def matches(self, c, pos):
+        v = self.get_value(c, pos)
+        return v is not None and v >= c.minimum
+
+    def search(self, criteria, limit=50):
+        """Return a list of `(score, pk)` tuples for the persons who match
+        the given list of :class:`Criterion`, best matches first.
+
+        """
+        with self.lock:
+            self.refresh()
+            result = []
+            for pos in self.get_candidates(criteria):
+                score = 0
+                for c in criteria:
+                    v = self.get_value(c, pos)
+                    if v is None:
+                        continue
+                    if c.minimum <= 0 or v >= c.minimum:
+                        score += c.weight
+                    else:
+                        score += c.weight * v / c.minimum
+                result.append((score, self.pks[pos]))
+        result.sort(key=lambda x: (-x[0], x[1]))
+        if limit is not None:
+            result = result[:limit]
+        return result
+
+
+skills_index = SkillsIndex()
+"""The :class:`SkillsIndex` of this process."""
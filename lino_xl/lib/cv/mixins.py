@@ -105,7 +105,27 @@ class PersonHistoryEntry(DatePeriod):
     person = models.ForeignKey(dd.plugins.cv.person_model)
 
 
-class HistoryByPerson(dd.Table):
+class CareerTable(dd.Table):
+    """Base class for the tables of this plugin.
+
+    .. attribute:: select_related
+
+        The relations to load together with the rows of this table,
+        using :meth:`select_related
+        <django.db.models.query.QuerySet.select_related>`.
+
+    """
+    select_related = []
+
+    @classmethod
+    def get_queryset(self, ar, **filter):
+        qs = super(CareerTable, self).get_queryset(ar, **filter)
+        if self.select_related:
+            qs = qs.select_related(*self.select_related)
+        return qs
+
+
+class HistoryByPerson(CareerTable):
     """Abstract base class for :class:`StudiesByPerson` and
     :class:`ExperiencesByPerson`
 
@@ -29,7 +29,8 @@ from __future__ import unicode_literals
 
 from builtins import str
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import pgettext_lazy as pgettext
 
@@ -42,10 +43,11 @@ from lino.modlib.system.choicelists import PeriodEvents
 
 
 from .mixins import (SectorFunction, PersonHistoryEntry,
-                     HistoryByPerson, CefLevel, HowWell,
+                     CareerTable, HistoryByPerson, CefLevel, HowWell,
                      EducationEntryStates)
 
 from .roles import CareerUser, CareerStaff
+from .matching import skills_index
 
 config = dd.plugins.cv
 
@@ -96,9 +98,10 @@ class LanguageKnowledge(dd.Model):
             return unicode(self.language)
 
 
-class LanguageKnowledges(dd.Table):
+class LanguageKnowledges(CareerTable):
     model = 'cv.LanguageKnowledge'
     stay_in_grid = True
+    select_related = ['person', 'language']
 
 class AllLanguageKnowledges(LanguageKnowledges):
     required_roles = dd.required(CareerStaff)
@@ -107,6 +110,7 @@ class LanguageKnowledgesByPerson(LanguageKnowledges):
     """Shows the languages known by this person."""
     master_key = 'person'
     column_names = "language native spoken written cef_level"
+    select_related = ['language']
     required_roles = dd.required(CareerUser)
     auto_fit_column_widths = True
     slave_grid_format = "summary"
@@ -162,6 +166,7 @@ class LanguageKnowledgesByPerson(LanguageKnowledges):
 class KnowledgesByLanguage(LanguageKnowledges):
     master_key = 'language'
     column_names = "person native spoken written cef_level"
+    select_related = ['person']
     required_roles = dd.required(CareerUser)
 
 
@@ -276,7 +281,7 @@ class StudyTypesByLevel(StudyTypes):
     master_key = 'education_level'
 
 
-class PeriodTable(dd.Table):
+class PeriodTable(CareerTable):
     parameters = mixins.ObservedPeriod(
         observed_event=PeriodEvents.field(blank=True))
     params_layout = "start_date end_date observed_event"
@@ -337,6 +342,8 @@ class Trainings(PeriodTable):
 
     model = 'cv.Training'
     order_by = "country city type".split()
+    select_related = ['person', 'type', 'country', 'city',
+                      'sector', 'function']
     column_names = "person start_date end_date type state sector function *"
 
     detail_layout = """
@@ -378,6 +385,7 @@ class TrainingsByPerson(HistoryByPerson, Trainings):
     column_names = 'type sector function remarks start_date end_date \
     school country state certificates *'
     auto_fit_column_widths = True
+    select_related = ['type', 'country', 'city', 'sector', 'function']
 
 
 #
@@ -419,6 +427,8 @@ class Studies(PeriodTable):
     required_roles = dd.required(CareerStaff)
     model = 'cv.Study'
     order_by = "country city type content".split()
+    select_related = ['person', 'type', 'country', 'city',
+                      'education_level', 'language']
     column_names = "person start_date end_date type content education_level state *"
 
     detail_layout = """
@@ -462,6 +472,8 @@ class StudiesByPerson(HistoryByPerson, Studies):
     column_names = 'type content start_date end_date school country \
     state education_level *'
     auto_fit_column_widths = True
+    select_related = ['type', 'country', 'city', 'language',
+                      'education_level']
     
     insert_layout = """
     start_date end_date
@@ -632,6 +644,8 @@ class Experiences(PeriodTable):
     required_roles = dd.required(CareerStaff)
     model = 'cv.Experience'
     # stay_in_grid = True
+    select_related = ['person', 'country', 'city', 'sector', 'function',
+                      'status', 'duration', 'regime']
     column_names = "person start_date end_date sector function title company *"
     detail_layout = """
     person start_date end_date termination_reason
@@ -659,6 +673,8 @@ class ExperiencesByPerson(HistoryByPerson, Experiences):
     auto_fit_column_widths = True
     column_names = "company country start_date end_date function \
     status duration termination_reason remarks *"
+    select_related = ['country', 'city', 'sector', 'function', 'status',
+                      'duration', 'regime']
     insert_layout = """
     start_date end_date
     company function
@@ -691,5 +707,47 @@ def set_detail_layouts(sender=None, **kwargs):
     """)
 
 
+@dd.receiver(pre_save, sender=LanguageKnowledge)
+@dd.receiver(pre_save, sender=Training)
+@dd.receiver(pre_save, sender=Study)
+@dd.receiver(pre_save, sender=Experience)
+def remember_skilled_person(sender, instance=None, raw=False, **kwargs):
+    instance._old_person_id = None
+    if raw or instance.pk is None:
+        return
+    qs = sender.objects.filter(pk=instance.pk).exclude(
+        person_id=instance.person_id)
+    for person_id in qs.values_list('person_id', flat=True):
+        instance._old_person_id = person_id
+
+
+@dd.receiver(post_save, sender=LanguageKnowledge)
+@dd.receiver(post_delete, sender=LanguageKnowledge)
+@dd.receiver(post_save, sender=Training)
+@dd.receiver(post_delete, sender=Training)
+@dd.receiver(post_save, sender=Study)
+@dd.receiver(post_delete, sender=Study)
+@dd.receiver(post_save, sender=Experience)
+@dd.receiver(post_delete, sender=Experience)
+def forget_skills(sender, instance=None, **kwargs):
+    # when committed, so that the index won't reload the old data
+    # (Django before 1.9 has no on_commit)
+    person_ids = [instance.person_id]
+    old = getattr(instance, '_old_person_id', None)
+    if old is not None:
+        person_ids.append(old)
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is None:
+        skills_index.forget(*person_ids)
+    else:
+        on_commit(lambda: skills_index.forget(*person_ids))
+
+
+@dd.receiver(post_save, sender=EducationLevel)
+@dd.receiver(post_delete, sender=EducationLevel)
+def forget_all_skills(sender, **kwargs):
+    skills_index.clear()
+
+
 def properties_list(owner, *prop_ids):
     return []
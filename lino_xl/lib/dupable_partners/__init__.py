@@ -19,6 +19,12 @@ Defines a virtual slave table :class:`SimilarPartners`, which shows
 the partners that are "similar" to a given master instance (and
 therefore are potential duplicates).
 
+For finding all likely duplicates of the database at once, use the
+:manage:`find_duplicates` command (see
+:mod:`lino_xl.lib.dupable_partners.dedup`).  After importing many
+partners, use :manage:`rebuild_dupable_words` (see
+:mod:`lino_xl.lib.dupable_partners.utils`).
+
 See also :mod:`lino.mixins.dupable`.
 
 A usage example is :mod:`lino.projects.min2`.
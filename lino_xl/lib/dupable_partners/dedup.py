@@ -0,0 +1,299 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""A batch engine for finding all likely duplicate partners of the
+database at once.
+
+While :class:`SimilarPartners
+<lino_xl.lib.dupable_partners.models.SimilarPartners>` runs one query
+for a given partner, the :class:`DuplicatesFinder` loads the phonetic
+words of all partners into memory and compares them there.  Usage
+example::
+
+    from lino_xl.lib.dupable_partners.dedup import DuplicatesFinder
+    finder = DuplicatesFinder(processes=4)
+    for dup in finder.find_duplicates():
+        print(dup.score, dup.partner1, dup.partner2)
+
+See also :manage:`find_duplicates`.
+
+The engine uses the phonetic words stored in :class:`Word
+<lino_xl.lib.dupable_partners.models.Word>`, so these should be up to
+date (see :class:`lino.mixins.dupable.DupableChecker`).
+
+Two partners A and B are considered duplicates when
+:meth:`find_similar_instances
+<lino.mixins.dupable.Dupable.find_similar_instances>` of A would
+return B or vice versa: the number of phonetic words of B which are
+also words of A (counting repeated words of B) is at least
+:meth:`dupable_matches_required
+<lino.mixins.dupable.Dupable.dupable_matches_required>` of A.  This
+method is called on the partners themselves, so overrides by an
+application are respected.
+
+In order to avoid comparing every partner with every other partner,
+partners are grouped into *blocks*.  The key of a block is a phonetic
+word together with the birth year of a person (or with the zip code of
+the partner if there is no known birth year).  Only partners who share
+at least one block are compared.  Blocks with more than
+:attr:`DuplicatesFinder.max_block_size` members (e.g. a very common
+name in a big city) are skipped.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import division
+from builtins import str
+from builtins import object
+
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import namedtuple
+from multiprocessing import Pool
+
+from lino.api import rt
+
+from .utils import get_overriding_models
+
+
+Duplicate = namedtuple(
+    'Duplicate', 'score ratio partner1 partner2 name1 name2 words')
+"""A likely duplicate pair of partners as yielded by
+:meth:`DuplicatesFinder.find_duplicates`.  `score` is the number of
+shared phonetic `words`, `ratio` is `score` divided by the number of
+words of the partner having more words.
+
+"""
+
+
+def has_field(model, name):
+    return name in [f.name for f in model._meta.get_fields()]
+
+
+def birth_year(bd):
+    """Return the year of the given :class:`IncompleteDate
+    <lino.utils.IncompleteDate>` (or its string representation), or
+    `None` if it is unknown.
+
+    """
+    if not bd:
+        return None
+    year = getattr(bd, 'year', None)
+    if year is None:
+        try:
+            year = int(str(bd)[:4])
+        except ValueError:
+            return None
+    return year or None
+
+
+# the data of a worker process, set by _init_worker
+
+_words = None
+_required = None
+_blocks = None
+_keys = None
+_wordsets = None
+
+
+def _init_worker(words, required, blocks, keys):
+    global _words, _required, _blocks, _keys, _wordsets
+    _words, _required, _blocks, _keys = words, required, blocks, keys
+    if words is None:
+        _wordsets = None
+    else:
+        _wordsets = dict([(k, frozenset(v)) for k, v in words.items()])
+
+
+def count_matches(words, wordset):
+    """Return the number of the given `words` (a list which may contain
+    repeated words) which are in `wordset`.  This is how
+    :meth:`find_similar_instances
+    <lino.mixins.dupable.Dupable.find_similar_instances>` counts.
+
+    """
+    return len([w for w in words if w in wordset])
+
+
+def _score_chunk(pks):
+    """Return the candidate pairs having the given partners as first
+    partner.  This runs in a worker process.
+
+    """
+    result = []
+    for pk in pks:
+        words = _words[pk]
+        wordset = _wordsets[pk]
+        seen = set()
+        for key in _keys[pk]:
+            for other in _blocks.get(key, ()):
+                if other <= pk or other in seen:
+                    continue
+                seen.add(other)
+                n1 = count_matches(_words[other], wordset)
+                n2 = count_matches(words, _wordsets[other])
+                if n1 >= _required[pk] or n2 >= _required[other]:
+                    result.append((pk, other, max(n1, n2),
+                                   wordset & _wordsets[other]))
+    return result
+
+
+class DuplicatesFinder(object):
+    """Find all likely duplicate partners in the database.
+
+    `processes` is the number of worker processes used for comparing
+    the partners.  When `blocking` is `False`, partners are grouped by
+    phonetic word only (which finds more duplicates but takes more
+    time).
+
+    """
+
+    max_block_size = 1000
+    """Blocks with more members than this are ignored."""
+
+    chunk_size = 2000
+    """The number of partners handled by a worker process at once."""
+
+    def __init__(self, processes=1, blocking=True, max_block_size=None):
+        self.processes = processes
+        self.blocking = blocking
+        if max_block_size is not None:
+            self.max_block_size = max_block_size
+        self.words = dict()
+        self.names = dict()
+        self.required = dict()
+        self.blocks = dict()
+        self.keys = dict()
+
+    def load(self):
+        """Load the phonetic words and the blocking keys of all partners
+        using one query per table.
+
+        """
+        Word = rt.models.dupable_partners.Word
+        Partner = rt.models.contacts.Partner
+        Person = rt.models.contacts.Person
+
+        words = dict()
+        for owner_id, word in Word.objects.order_by(
+                'owner_id', 'id').values_list('owner_id', 'word'):
+            if word:
+                words.setdefault(owner_id, []).append(word)
+        self.words = dict([(k, tuple(v)) for k, v in words.items()])
+
+        extras = dict()
+        for pk, name, zip_code in Partner.objects.values_list(
+                'pk', 'name', 'zip_code'):
+            self.names[pk] = name
+            extras[pk] = zip_code or None
+
+        for pk, bd in Person.objects.values_list('pk', 'birth_date'):
+            year = birth_year(bd)
+            if year is not None:
+                extras[pk] = year
+
+        self.load_required()
+
+        for pk, ws in self.words.items():
+            if pk not in self.names:
+                continue
+            extra = extras.get(pk) if self.blocking else None
+            keys = self.keys[pk] = [(w, extra) for w in set(ws)]
+            for key in keys:
+                self.blocks.setdefault(key, []).append(pk)
+
+        too_big = [k for k, v in self.blocks.items()
+                   if len(v) > self.max_block_size]
+        for k in too_big:
+            logger.warning(
+                "Ignoring block %s with %d partners",
+                k, len(self.blocks[k]))
+            del self.blocks[k]
+        return self
+
+    def load_required(self):
+        """Fill :attr:`required` by calling :meth:`dupable_matches_required
+        <lino.mixins.dupable.Dupable.dupable_matches_required>` on
+        every partner.
+
+        This runs one query for every model which overrides that
+        method (starting with the partner model), each partner being
+        instantiated as the most specific of these models.  Only the
+        fields used by the default implementations are loaded, other
+        fields get loaded on demand.
+
+        """
+        Partner = rt.models.contacts.Partner
+        models = [Partner] + [
+            m for m in reversed(
+                get_overriding_models('dupable_matches_required'))
+            if m is not Partner]
+        for m in models:
+            fields = [f for f in ('name', 'first_name')
+                      if has_field(m, f)]
+            for obj in m.objects.only(*fields).iterator():
+                self.required[obj.pk] = obj.dupable_matches_required()
+
+    def iter_chunks(self):
+        pks = sorted(self.keys)
+        for i in range(0, len(pks), self.chunk_size):
+            yield pks[i:i + self.chunk_size]
+
+    def find_pairs(self):
+        """Yield a tuple `(pk1, pk2, score, words)` for every pair of
+        likely duplicate partners.
+
+        """
+        args = (self.words, self.required, self.blocks, self.keys)
+        if self.processes is None or self.processes <= 1:
+            _init_worker(*args)
+            try:
+                for chunk in self.iter_chunks():
+                    for pair in _score_chunk(chunk):
+                        yield pair
+            finally:
+                _init_worker(None, None, None, None)
+            return
+        pool = Pool(self.processes, _init_worker, args)
+        try:
+            for pairs in pool.imap_unordered(
+                    _score_chunk, self.iter_chunks()):
+                for pair in pairs:
+                    yield pair
+        finally:
+            pool.terminate()
+
+    def find_duplicates(self, limit=None):
+        """Return a list of :class:`Duplicate` tuples, the most likely
+        duplicates first.
+
+        """
+        if not self.keys:
+            self.load()
+        result = []
+        for pk1, pk2, score, common in self.find_pairs():
+            ratio = score / max(len(self.words[pk1]), len(self.words[pk2]))
+            result.append(Duplicate(
+                score, ratio, pk1, pk2, self.names[pk1], self.names[pk2],
+                sorted(common)))
+        result.sort(key=lambda d: (-d.score, -d.ratio, d.partner1,
+                                   d.partner2))
+        if limit is not None:
+            result = result[:limit]
+        return result
+
+    def write_report(self, stream, limit=None):
+        """Write a ranked list of the likely duplicate partners as tab
+        separated text to the given stream.  Return the number of
+        pairs.
+
+        """
+        dups = self.find_duplicates(limit)
+        stream.write("score\tratio\tid1\tname1\tid2\tname2\twords\n")
+        for d in dups:
+            stream.write("%d\t%.2f\t%d\t%s\t%d\t%s\t%s\n" % (
+                d.score, d.ratio, d.partner1, d.name1,
+                d.partner2, d.name2, ' '.join(d.words)))
+        return len(dups)
@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: find_duplicates
+
+Write a ranked list of the likely duplicate partners of the database.
+See :mod:`lino_xl.lib.dupable_partners.dedup`.
+
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.dupable_partners.dedup import DuplicatesFinder
+
+
+class Command(BaseCommand):
+    help = "Write a ranked list of the likely duplicate partners."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', action='store', type=int,
+                            dest='processes', default=1,
+                            help='Number of worker processes to use.')
+        parser.add_argument('--output', action='store',
+                            dest='output', default=None,
+                            help='Name of the file to write the report to '
+                            '(default is stdout).')
+        parser.add_argument('--limit', action='store', type=int,
+                            dest='limit', default=None,
+                            help='Maximum number of pairs to report.')
+        parser.add_argument('--max-block-size', action='store', type=int,
+                            dest='max_block_size', default=None,
+                            help='Ignore blocks having more partners.')
+        parser.add_argument('--no-blocking', action='store_false',
+                            dest='blocking', default=True,
+                            help='Compare all partners sharing a phonetic '
+                            'word, regardless of birth year or zip code.')
+
+    def handle(self, *args, **options):
+        finder = DuplicatesFinder(
+            processes=options['processes'],
+            blocking=options['blocking'],
+            max_block_size=options['max_block_size'])
+        finder.load()
+        dblogger.info("Comparing %d partners in %d blocks",
+                      len(finder.keys), len(finder.blocks))
+        fn = options['output']
+        if fn:
+            with codecs.open(fn, 'w', 'utf-8') as f:
+                n = finder.write_report(f, options['limit'])
+        else:
+            n = finder.write_report(self.stdout, options['limit'])
+        dblogger.info("Found %d likely duplicate pairs", n)
@@ -0,0 +1,46 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: rebuild_dupable_words
+
+Rebuild the phonetic words of all partners, e.g. after importing
+partners or after changing the phonetic algorithm.
+See :class:`lino_xl.lib.dupable_partners.utils.WordsBuilder`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.dupable_partners.utils import WordsBuilder
+
+
+class Command(BaseCommand):
+    help = "Rebuild the phonetic words of all partners."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', action='store', type=int,
+                            dest='processes', default=1,
+                            help='Number of worker processes to use.')
+        parser.add_argument('--chunk-size', action='store', type=int,
+                            dest='chunk_size', default=1000,
+                            help='Number of partners per transaction.')
+        parser.add_argument('--changed', action='store_true',
+                            dest='changed_only', default=False,
+                            help='Update only the partners who have no '
+                            'phonetic words, i.e. those whose name has '
+                            'changed since the last run.')
+
+    def handle(self, *args, **options):
+        builder = WordsBuilder(
+            processes=options['processes'],
+            chunk_size=options['chunk_size'],
+            changed_only=options['changed_only'])
+        n = builder.run()
+        dblogger.info(
+            "Replaced the phonetic words of %d out of %d partners.",
+            n, builder.count)
@@ -7,9 +7,12 @@
 Database models for `lino_xl.lib.dupable_partners`.
 """
 
-from lino.api import dd, _
+from django.conf import settings
+from django.db.models.signals import post_init, post_save
 
-from lino.mixins.dupable import PhoneticWordBase, SimilarObjects
+from lino.api import dd, rt, _
+
+from lino.mixins.dupable import Dupable, PhoneticWordBase, SimilarObjects
 
 
 class Word(PhoneticWordBase):
@@ -30,3 +33,39 @@ class Words(dd.Table):
 class SimilarPartners(SimilarObjects):
     label = _("Similar partners")
 
+
+
+UNKNOWN = object()
+
+
+def remember_dupable_name(sender, instance=None, **kwargs):
+    # don't load a deferred field
+    instance._dupable_name = instance.__dict__.get(
+        instance.dupable_words_field, UNKNOWN)
+
+
+def forget_stale_words(sender, instance=None, created=False, raw=False,
+                       **kwargs):
+    """Delete the phonetic words of a partner whose name has been
+    changed, so that they get rebuilt by :manage:`rebuild_dupable_words`
+    with ``--changed``.  A save through the web interface rebuilds them
+    right afterwards.
+
+    """
+    name = getattr(instance, instance.dupable_words_field)
+    old = getattr(instance, '_dupable_name', UNKNOWN)
+    instance._dupable_name = name
+    if created or raw or settings.SITE.loading_from_dump:
+        return
+    if old is not UNKNOWN and old != name:
+        rt.models.dupable_partners.Word.objects.filter(
+            owner_id=instance.pk).delete()
+
+
+@dd.receiver(dd.pre_analyze)
+def connect_dupable_signals(sender, **kwargs):
+    # in case Partner is overridden
+    for m in rt.models_by_base(sender.models.contacts.Partner):
+        if issubclass(m, Dupable):
+            post_init.connect(remember_dupable_name, sender=m)
+            post_save.connect(forget_stale_words, sender=m)
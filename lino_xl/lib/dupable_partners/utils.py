@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Utilities for maintaining the phonetic words of
+:mod:`lino_xl.lib.dupable_partners` in bulk.  See
+:manage:`rebuild_dupable_words`.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+import logging
+logger = logging.getLogger(__name__)
+
+from multiprocessing import Pool
+
+from django.db import transaction
+
+from lino.api import rt
+from lino.mixins.dupable import Dupable
+
+
+def get_function(meth):
+    """Return the function of the given method (bound or not, Python 2
+    or 3)."""
+    return getattr(meth, '__func__', meth)
+
+
+def get_overriding_models(name):
+    """Return the partner models which override the given method of
+    their nearest partner base model (or of :class:`Dupable
+    <lino.mixins.dupable.Dupable>` for the partner model itself), the
+    most specific models first.
+
+    """
+    Partner = rt.models.contacts.Partner
+    models = sorted(rt.models_by_base(Partner),
+                    key=lambda m: len(m.__mro__))
+    methods = dict()
+    result = []
+    for m in models:
+        meth = get_function(getattr(m, name))
+        methods[m] = meth
+        bases = [b for b in models if b is not m and issubclass(m, b)]
+        if bases:
+            base = max(bases, key=lambda b: len(b.__mro__))
+            default = methods[base]
+        else:
+            default = get_function(getattr(Dupable, name))
+        if meth is not default:
+            result.insert(0, m)
+    return result
+
+
+def split_words(s):
+    """Split the given text into the words to be reduced, like
+    :meth:`get_dupable_words
+    <lino.mixins.dupable.Dupable.get_dupable_words>` does.
+
+    """
+    for c in '-,/&+':
+        s = s.replace(c, ' ')
+    return s.split()
+
+
+def _reduce_word(s):
+    return rt.models.dupable_partners.Word.reduce_word(s)
+
+
+class WordsBuilder(object):
+    """Rebuilds the :class:`Word
+    <lino_xl.lib.dupable_partners.models.Word>` rows of all partners.
+
+    Partners are read in chunks of `chunk_size`, and the words of
+    every chunk are replaced in a single transaction.  Every distinct
+    word of the names is reduced only once, and the words which have
+    not been reduced before are reduced by a pool of `processes`
+    worker processes.
+
+    If `changed_only` is `True`, only the partners who have no
+    phonetic words are handled.  These are the partners who have been
+    created without updating their words (e.g. by an import) and those
+    whose name has been changed since the last run (see
+    :func:`forget_stale_words
+    <lino_xl.lib.dupable_partners.models.forget_stale_words>`).
+
+    For partners of a model which overrides :meth:`get_dupable_words
+    <lino.mixins.dupable.Dupable.get_dupable_words>`, the words are
+    computed by calling this method (running one more query per chunk
+    and model).
+
+    """
+
+    def __init__(self, processes=1, chunk_size=1000, changed_only=False):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.changed_only = changed_only
+        self.reduced = dict()
+        self.pool = None
+        self.count = 0
+        self.updated = 0
+        self.overrides = get_overriding_models('get_dupable_words')
+
+    def reduce_words(self, words):
+        """Make sure that the given words are in :attr:`reduced`."""
+        todo = list(set([w for w in words if w not in self.reduced]))
+        if not todo:
+            return
+        if self.pool is None:
+            results = [_reduce_word(w) for w in todo]
+        else:
+            results = self.pool.map(_reduce_word, todo)
+        self.reduced.update(zip(todo, results))
+
+    def iter_chunks(self):
+        """Yield the partners as lists of `(pk, name)` tuples.  Every chunk
+        is read using a separate query so that we can write to the
+        database between them.
+
+        """
+        Partner = rt.models.contacts.Partner
+        qs = Partner.objects.order_by('pk').values_list(
+            'pk', Partner.dupable_words_field)
+        if self.changed_only:
+            qs = qs.filter(dupable_words__isnull=True)
+        last = None
+        while True:
+            if last is None:
+                chunk = list(qs[:self.chunk_size])
+            else:
+                chunk = list(qs.filter(pk__gt=last)[:self.chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last = chunk[-1][0]
+
+    def run(self):
+        """Rebuild the words.  Return the number of partners whose words
+        have been replaced.
+
+        """
+        if self.processes and self.processes > 1:
+            self.pool = Pool(self.processes)
+        try:
+            for chunk in self.iter_chunks():
+                self.update_chunk(chunk)
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+        return self.updated
+
+    def update_chunk(self, chunk):
+        Word = rt.models.dupable_partners.Word
+        wanted = dict()
+        todo = set([pk for pk, name in chunk])
+        for m in self.overrides:
+            qs = m.objects.filter(pk__in=list(todo)).only(
+                m.dupable_words_field)
+            for obj in qs:
+                wanted[obj.pk] = obj.get_dupable_words(
+                    getattr(obj, obj.dupable_words_field) or '')
+                todo.discard(obj.pk)
+        names = dict()
+        for pk, name in chunk:
+            if pk in todo:
+                names[pk] = split_words(name or '')
+        self.reduce_words([w for words in names.values() for w in words])
+        for pk, words in names.items():
+            wanted[pk] = [self.reduced[w] for w in words]
+        self.count += len(chunk)
+        with transaction.atomic():
+            if not self.changed_only:
+                Word.objects.filter(owner_id__in=list(wanted)).delete()
+            Word.objects.bulk_create([
+                Word(owner_id=pk, word=w)
+                for pk in sorted(wanted) for w in wanted[pk]])
+        self.updated += len(wanted)
+        logger.debug("Replaced the words of %d partners (%d so far)",
+                     len(wanted), self.count)
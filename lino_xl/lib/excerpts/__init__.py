@@ -57,6 +57,14 @@ class Plugin(ad.Plugin):
     :mod:`lino_xl.lib.excerpts.fixtures.demo2`.
     """
 
+    shortcut_cache_timeout = 60
+    """The number of seconds after which the in-memory copy of the
+    excerpt types used by the :class:`Shortcuts
+    <lino_xl.lib.excerpts.choicelists.Shortcuts>` fields is reloaded
+    from the database.  Set this to `None` if excerpt types are never
+    modified by another process.
+    """
+
     def setup_main_menu(self, site, profile, m):
         mg = site.plugins.office
         m = m.add_menu(mg.app_label, mg.verbose_name)
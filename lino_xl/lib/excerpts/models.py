@@ -17,6 +17,8 @@ logger = logging.getLogger(__name__)
 from os.path import join, dirname
 
 import datetime
+import threading
+import time
 ONE_WEEK = datetime.timedelta(days=7)
 ONE_DAY = datetime.timedelta(days=1)
 
@@ -25,7 +27,7 @@ from django.utils import translation
 from django.conf import settings
 from django.db import models
 from django.db.utils import OperationalError, ProgrammingError
-from django.db.models.signals import post_init
+from django.db.models.signals import post_init, post_save, post_delete
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.humanize.templatetags.humanize import naturaltime
 from django.utils import timezone
@@ -55,6 +57,8 @@ from .mixins import Certifiable
 from .choicelists import Shortcuts
 from .roles import ExcerptsUser, ExcerptsStaff
 
+from lino_xl.lib.xl.utils import get_page_ids
+
 
 class ExcerptType(mixins.BabelNamed, PrintableType, MailableType):
     """The type of an excerpt. Every excerpt has a mandatory field
@@ -804,34 +808,61 @@ class ExcerptsByOwner(Excerpts):
 
     @classmethod
     def get_slave_summary(self, obj, ar):
-        items = []
+        """Displays the excerpts of this owner grouped into "not printed",
+        "Today", "Last week" and "Older".
 
-        def add(title, flt):
-            links = []
-            sar = self.request(master_instance=obj, filter=flt)
-            # logger.info("20141009 %s", sar.data_iterator.query)
-            n = sar.get_total_count()
-            if n:
-                for i, ex in enumerate(sar):
+        This runs one query for the number of excerpts in each group
+        and one query for the excerpts themselves, which are then
+        distributed to their group in Python.
+
+        """
+        sar = self.request(master_instance=obj)
+        qs = sar.data_iterator
+        Q = models.Q
+        today = datetime.datetime.combine(dd.today(), datetime.time())
+        t7 = today - ONE_WEEK
+        groups = [
+            (_("not printed"), Q(build_time__isnull=True),
+             lambda bt: bt is None),
+            (_("Today"), Q(build_time__gte=today - ONE_DAY),
+             lambda bt: bt is not None and bt >= today - ONE_DAY),
+            (_("Last week"), Q(build_time__lte=today, build_time__gte=t7),
+             lambda bt: bt is not None and t7 <= bt <= today),
+            (_("Older"), Q(build_time__lt=t7),
+             lambda bt: bt is not None and bt < t7)]
+
+        counts = qs.aggregate(**dict([
+            ("n%d" % i, models.Count(models.Case(
+                models.When(flt, then=models.Value(1)),
+                output_field=models.IntegerField())))
+            for i, (title, flt, test) in enumerate(groups)]))
+        links = [[] for g in groups]
+        todo = set([i for i in range(len(groups)) if counts["n%d" % i]])
+
+        for ex in qs.select_related('excerpt_type'):
+            if not todo:
+                break
+            bt = ex.build_time
+            if bt is not None and timezone.is_aware(bt):
+                bt = timezone.make_naive(bt)
+            for i, (title, flt, test) in enumerate(groups):
+                if i in todo and test(bt):
                     txt = self.format_excerpt(ex)
                     if ex.build_time is not None:
                         txt += " (%s)" % naturaltime(ex.build_time)
-                    links.append(ar.obj2html(ex, txt))
-                    if i >= self.MORE_LIMIT:
+                    links[i].append(ar.obj2html(ex, txt))
+                    if len(links[i]) > self.MORE_LIMIT:
                         # links.append(ar.href_to_request(sar, _("more")))
-                        links.append('...')
-                        break
-
-                items.append(E.li(title, " : ", *join_elems(links, sep=', ')))
+                        links[i].append('...')
+                        todo.discard(i)
+                    elif len(links[i]) == counts["n%d" % i]:
+                        todo.discard(i)
 
-        # qs = sar.data_iterator
-        Q = models.Q
-        add(_("not printed"), Q(build_time__isnull=True))
-        add(_("Today"), Q(build_time__gte=dd.today() - ONE_DAY))
-        t7 = dd.today() - ONE_WEEK
-        add(_("Last week"),
-            Q(build_time__lte=dd.today(), build_time__gte=t7))
-        add(_("Older"), Q(build_time__lt=t7))
+        items = []
+        for i, (title, flt, test) in enumerate(groups):
+            if links[i]:
+                items.append(E.li(title, " : ", *join_elems(
+                    links[i], sep=', ')))
         return E.ul(*items)
 
     @classmethod
@@ -864,7 +895,6 @@ def set_excerpts_actions(sender, **kw):
 
     # in case ExcerptType is overridden
     ExcerptType = sender.modules.excerpts.ExcerptType
-    Excerpt = sender.modules.excerpts.Excerpt
 
     try:
         etypes = [(obj, obj.content_type)
@@ -892,50 +922,153 @@ def set_excerpts_actions(sender, **kw):
     # :class:`lino.mixins.printable.BasePrintable` or some subclass
     # thereof.
 
+    post_save.connect(forget_shortcut_types, sender=ExcerptType)
+    post_delete.connect(forget_shortcut_types, sender=ExcerptType)
+
     for i in Shortcuts.items():
 
-        def f(obj, ar):
+        def f(obj, ar, i=i):
             if ar is None:
                 return ''
             if obj is None:
                 return E.div()
-            try:
-                et = ExcerptType.objects.get(shortcut=i)
-            except ExcerptType.DoesNotExist:
+            et = shortcut_types.get(i.value)
+            if et is None:
                 return E.div()
             items = []
-            if True:
+            n, ex = get_shortcut_excerpts(ar, obj, et)
+            if n > 0:
+                items.append(ar.obj2html(ex, _("Last")))
+
                 sar = ar.spawn(
                     ExcerptsByOwner,
                     master_instance=obj,
                     param_values=dict(excerpt_type=et))
-                n = sar.get_total_count()
-                if n > 0:
-                    ex = sar.sliced_data_iterator[0]
-                    items.append(ar.obj2html(ex, _("Last")))
-
-                    ba = sar.bound_action
-                    btn = sar.renderer.action_button(
-                        obj, sar, ba, "%s (%d)" % (_("All"), n),
-                        icon_name=None)
-                    items.append(btn)
-    
-                ia = getattr(obj, et.get_action_name())
-                btn = ar.instance_action_button(
-                    ia, _("Create"), icon_name=None)
+                ba = sar.bound_action
+                btn = sar.renderer.action_button(
+                    obj, sar, ba, "%s (%d)" % (_("All"), n),
+                    icon_name=None)
                 items.append(btn)
 
-            else:
-                ot = ContentType.objects.get_for_model(obj.__class__)
-                qs = Excerpt.objects.filter(
-                    owner_id=obj.pk, owner_type=ot, excerpt_type=et)
-                if qs.count() > 0:
-                    ex = qs[0]
-                    txt = ExcerptsByOwner.format_excerpt(ex)
-                    items.append(ar.obj2html(ex, txt))
+            ia = getattr(obj, et.get_action_name())
+            btn = ar.instance_action_button(
+                ia, _("Create"), icon_name=None)
+            items.append(btn)
+
             return E.div(*join_elems(items, ', '))
     
         vf = dd.VirtualField(dd.DisplayField(i.text), f)
         dd.inject_field(i.model_spec, i.name, vf)
 
 
+class ShortcutTypesCache(object):
+    """Maps the value of each :class:`Shortcuts
+    <lino_xl.lib.excerpts.choicelists.Shortcuts>` item to the
+    :class:`ExcerptType` which manages it.
+
+    The excerpt types are loaded using one query when first needed,
+    and forgotten whenever an :class:`ExcerptType` is saved or deleted
+    in this process.  Changes made by other processes are seen after
+    :attr:`shortcut_cache_timeout
+    <lino_xl.lib.excerpts.Plugin.shortcut_cache_timeout>` seconds.
+
+    The loaded data is replaced as a whole, so a thread reading it
+    never sees a partly loaded or partly cleared copy.  Data which was
+    loaded while another thread cleared the cache is not kept.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = 0
+
+    def clear(self):
+        with self.lock:
+            self.data = None
+            self.version += 1
+
+    def load(self):
+        """Return the dict of excerpt types, loading it if necessary."""
+        data = self.data
+        timeout = dd.plugins.excerpts.shortcut_cache_timeout
+        if data is not None:
+            if timeout is None or time.time() - data[0] < timeout:
+                return data[1]
+        with self.lock:
+            version = self.version
+        loaded = time.time()
+        types = dict()
+        for et in ExcerptType.objects.all():
+            if et.shortcut:
+                types[et.shortcut.value] = et
+        data = (loaded, types)
+        with self.lock:
+            if self.version == version:
+                self.data = data
+        return data[1]
+
+    def get(self, value):
+        """Return the :class:`ExcerptType` which manages the shortcut with
+        the given value, or `None` if there is no such excerpt type."""
+        return self.load().get(value, None)
+
+
+shortcut_types = ShortcutTypesCache()
+"""The :class:`ShortcutTypesCache` of this process."""
+
+
+def forget_shortcut_types(sender, **kwargs):
+    """Clear :data:`shortcut_types` when an excerpt type is saved or
+    deleted.  Connected by :func:`set_excerpts_actions`.
+
+    """
+    shortcut_types.clear()
+
+
+def get_shortcut_excerpts(ar, obj, et):
+    """Return a tuple `(count, latest)` with the number of excerpts of
+    type `et` owned by `obj` and the latest of them.
+
+    The first call for a given table request and excerpt type computes
+    these values for all rows of the current page at once and stores
+    them in the request, subsequent calls for other rows of the same
+    page just look them up.
+
+    """
+    model = obj.__class__
+    cache = getattr(ar, '_excerpt_shortcuts', None)
+    if cache is None:
+        cache = ar._excerpt_shortcuts = dict()
+    data = cache.get((et.pk, model), None)
+    if data is None or obj.pk not in data:
+        ids = get_page_ids(ar, obj, model)
+        data = cache[(et.pk, model)] = load_shortcut_excerpts(
+            model, et, ids)
+    return data[obj.pk]
+
+
+def load_shortcut_excerpts(model, et, ids):
+    """Return a dict which maps each primary key in `ids` to a tuple
+    `(count, latest)` as returned by :func:`get_shortcut_excerpts`.
+
+    This runs one query for the primary keys of these excerpts and one
+    query for the latest of them.  The latest excerpt is the first row
+    of :class:`ExcerptsByOwner`, i.e. using the same ordering.
+
+    """
+    Excerpt = rt.models.excerpts.Excerpt
+    ct = ContentType.objects.get_for_model(model)
+    qs = Excerpt.objects.filter(
+        owner_type=ct, owner_id__in=ids, excerpt_type=et)
+    qs = qs.order_by(*ExcerptsByOwner.order_by)
+    counts = dict()
+    latest = dict()
+    for owner_id, pk in qs.values_list('owner_id', 'id'):
+        counts[owner_id] = counts.get(owner_id, 0) + 1
+        latest.setdefault(owner_id, pk)
+    objects = Excerpt.objects.in_bulk(list(latest.values()))
+    data = dict([(pk, (0, None)) for pk in ids])
+    for owner_id, n in counts.items():
+        data[owner_id] = (n, objects.get(latest[owner_id]))
+    return data
@@ -13,8 +13,10 @@ Technical specification see :ref:`lino.specs.households`.
 
     models
     choicelists
+    populate
     fixtures.std
     fixtures.demo
+    management.commands.populate_households
 
 This plugin is being extended by :ref:`welfare` in
 :mod:`lino_welfare.modlib.households`.
@@ -0,0 +1,36 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: populate_households
+
+Run the :class:`PopulateMembers
+<lino_xl.lib.households.models.PopulateMembers>` action on all
+households of the database at once.  See
+:class:`lino_xl.lib.households.populate.MembersPopulator`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lino.api import dd
+from lino.utils import dblogger
+
+from lino_xl.lib.households.populate import MembersPopulator
+
+
+class Command(BaseCommand):
+    help = "Add the children of household parents as household members."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', action='store', type=int,
+                            dest='chunk_size', default=500,
+                            help='Number of households per transaction.')
+
+    def handle(self, *args, **options):
+        if not dd.is_installed('humanlinks'):
+            raise CommandError("This requires lino_xl.lib.humanlinks.")
+        n = MembersPopulator(options['chunk_size']).run()
+        dblogger.info("Added %d children.", n)
@@ -28,7 +28,7 @@ contacts = dd.resolve_app('contacts')
 
 config = dd.plugins.households
 
-from .choicelists import child_roles, parent_roles
+from .populate import MembersPopulator, schedule_missing_links
 
 class Type(mixins.BabelNamed):
     """
@@ -61,43 +61,7 @@ class PopulateMembers(dd.Action):
     def run_from_ui(self, ar, **kw):
         if not dd.is_installed('humanlinks'):
             return
-        today = dd.today()
-        n = 0
-        Member = rt.models.households.Member
-        for hh in ar.selected_rows:
-            known_children = set()
-            for mbr in hh.member_set.filter(role__in=child_roles):
-                if mbr.person:
-                    known_children.add(mbr.person.id)
-
-            new_children = dict()
-            for parent in hh.member_set.filter(role__in=parent_roles):
-                for childlnk in parent.person.humanlinks_children.all():
-                    child = childlnk.child
-                    if not child.id in known_children:
-                        age = child.get_age(today)
-                        if age is None or age <= dd.plugins.households.adult_age:
-                            childmbr = new_children.get(child.id, None)
-                            if childmbr is None:
-                                cr = MemberRoles.child
-                                # if parent.role == MemberRoles.head:
-                                #     cr = MemberRoles.child_of_head
-                                # else:
-                                #     cr = MemberRoles.child_of_partner
-                                childmbr = Member(
-                                    household=hh,
-                                    person=child,
-                                    dependency=MemberDependencies.full,
-                                    role=cr)
-                                new_children[child.id] = childmbr
-                                n += 1
-                            else:
-                                childmbr.role = MemberRoles.child
-                            # if parent.role == MemberRoles.head:
-                            #     childmbr.dependency = MemberDependencies.full
-                            childmbr.full_clean()
-                            childmbr.save()
-
+        n = MembersPopulator().run([hh.pk for hh in ar.selected_rows])
         ar.success(
             _("Added %d children.") % n, refresh_all=True)
 
@@ -320,23 +284,17 @@ class Member(mixins.DatePeriod, mixins.Human, mixins.Born):
     
         super(Member, self).full_clean()
 
+    def save(self, *args, **kwargs):
+        """Schedule the automatic creation of human links between this
+        member and the other members of the household.  See
+        :mod:`lino_xl.lib.households.populate`.
+
+        """
+        super(Member, self).save(*args, **kwargs)
         if not settings.SITE.loading_from_dump:
-            # Auto-create human links between this member and other
-            # household members.
             if self.person_id and self.role and self.household_id:
                 if dd.is_installed('humanlinks'):
-                    Link = rt.models.humanlinks.Link
-                    ConcreteMember = rt.models.households.Member
-                    if self.role in child_roles:
-                        for pm in ConcreteMember.objects.filter(
-                                household=self.household,
-                                role__in=parent_roles):
-                            Link.check_autocreate(pm.person, self.person)
-                    elif self.role in parent_roles:
-                        for cm in ConcreteMember.objects.filter(
-                                household=self.household,
-                                role__in=child_roles):
-                            Link.check_autocreate(self.person, cm.person)
+                    schedule_missing_links(self.household_id, self.person_id)
 
     def disabled_fields(self, ar):
         rv = super(Member, self).disabled_fields(ar)
@@ -487,8 +445,13 @@ class SiblingsByPerson(Members):
                 elems += [obj.format_family_member(ar, m)]
             return elems
             
+        members = list(sar.data_iterator)
+        if dd.is_installed('humanlinks'):
+            # load the links of all members at once
+            from lino_xl.lib.humanlinks.graph import get_kinship_graph
+            get_kinship_graph(ar, *[m.person_id for m in members])
         items = []
-        for m in sar.data_iterator:
+        for m in members:
             items.append(E.li(*format_item(m)))
         elems = []
         if len(items) > 0:
@@ -500,9 +463,10 @@ class SiblingsByPerson(Members):
     def find_links(self, ar, child, parent):
         if not dd.is_installed('humanlinks'):
             return []
+        from lino_xl.lib.humanlinks.graph import get_kinship_graph
+        g = get_kinship_graph(ar, child)
         types = {}  # mapping LinkType -> list of parents
-        for lnk in rt.modules.humanlinks.Link.objects.filter(child=child):
-                # child=child, parent=p):
+        for lnk in g.parent_links(child.pk):
             tt = lnk.type.as_child(lnk.child)
             l = types.setdefault(tt, [])
             l.append(lnk.parent)
@@ -0,0 +1,257 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Set-based implementations of :class:`PopulateMembers
+<lino_xl.lib.households.models.PopulateMembers>` (see also
+:manage:`populate_households`) and of the automatic creation of
+human links between household members.
+
+When a membership is saved, :meth:`Member.save
+<lino_xl.lib.households.models.Member.save>` calls
+:func:`schedule_missing_links`.  The human links between the parents
+and children of all households touched by a transaction are then
+created in bulk when the transaction is committed (or immediately when
+there is no transaction).
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+import threading
+import weakref
+
+from django.db import transaction
+
+from lino.api import dd, rt
+
+from .choicelists import MemberRoles, MemberDependencies
+from .choicelists import child_roles, parent_roles
+
+
+_pending = threading.local()
+
+
+def get_missing_links(pairs):
+    """Return a list of the :class:`Link
+    <lino_xl.lib.humanlinks.models.Link>` objects (not yet saved) to
+    create for the given `(parent, child)` tuples of person ids.
+
+    This applies the same rules as :meth:`check_autocreate
+    <lino_xl.lib.humanlinks.models.Link.check_autocreate>`, but uses
+    two queries for all pairs: a child gets no new link to a parent
+    to whom it is already linked as child, and when it already has
+    another parent of a different gender, the new link is of type
+    :attr:`foster_parent
+    <lino_xl.lib.humanlinks.choicelists.LinkTypes.foster_parent>`.
+
+    """
+    Link = rt.models.humanlinks.Link
+    LinkTypes = rt.models.humanlinks.LinkTypes
+    Person = dd.plugins.households.person_model
+    pairs = [(p, c) for p, c in pairs if p != c]
+    if not pairs:
+        return []
+    genders = dict(Person.objects.filter(
+        pk__in=set([p for p, c in pairs])).values_list('pk', 'gender'))
+    child_parents = dict()  # child -> list of (parent, gender)
+    for parent, child, gender in Link.objects.filter(
+            child_id__in=set([c for p, c in pairs]),
+            type__in=Link.parent_link_types).order_by('id').values_list(
+            'parent_id', 'child_id', 'parent__gender'):
+        child_parents.setdefault(child, []).append((parent, gender))
+    new_links = []
+    for parent, child in pairs:
+        existing = child_parents.setdefault(child, [])
+        if [p for p, g in existing if p == parent]:
+            continue
+        gender = genders.get(parent)
+        if [p for p, g in existing if g != gender]:
+            auto_type = LinkTypes.foster_parent
+        else:
+            auto_type = LinkTypes.parent
+        new_links.append(Link(
+            parent_id=parent, child_id=child, type=auto_type))
+        existing.append((parent, gender))
+    return new_links
+
+
+def create_missing_links(touched):
+    """Create the missing human links between the parent and child
+    members of a series of households.
+
+    `touched` is a dict which maps the primary key of every household
+    to the set of ids of the persons whose membership has changed.
+    Only the links between a parent and a child where at least one of
+    them is in this set are considered.  Return the number of links
+    created.
+
+    """
+    Member = rt.models.households.Member
+    Link = rt.models.humanlinks.Link
+    parents = dict()  # household -> person ids of parent members
+    children = dict()  # household -> person ids of child members
+    for hh, person, role in Member.objects.filter(
+            household_id__in=list(touched)).order_by('id').values_list(
+            'household_id', 'person_id', 'role'):
+        if person is None:
+            continue
+        if role in parent_roles:
+            parents.setdefault(hh, []).append(person)
+        elif role in child_roles:
+            children.setdefault(hh, []).append(person)
+    pairs = []
+    for hh in sorted(touched):
+        persons = touched[hh]
+        for child in children.get(hh, []):
+            for parent in parents.get(hh, []):
+                if parent in persons or child in persons:
+                    pairs.append((parent, child))
+    new_links = get_missing_links(pairs)
+    if new_links:
+        Link.objects.bulk_create(new_links)
+    return len(new_links)
+
+
+class PendingLinks(object):
+    """The memberships registered by :func:`schedule_missing_links`
+    during one transaction.  An instance of this is registered as
+    callback to be run when the transaction is committed.
+
+    """
+
+    def __init__(self):
+        self.touched = dict()
+
+    def __call__(self):
+        create_missing_links(self.touched)
+
+
+def schedule_missing_links(household_id, person_id):
+    """Register the given membership as changed and make sure that the
+    missing human links are created when the current transaction is
+    committed.
+
+    The memberships of a transaction are collected in a
+    :class:`PendingLinks` which is registered as callback only once.
+    This module keeps only a weak reference to it, so when the
+    transaction is rolled back and Django drops the callback, the
+    memberships are forgotten as well.
+
+    Outside of a transaction (or with Django before 1.9, which has no
+    :func:`on_commit <django.db.transaction.on_commit>`), the links
+    are created immediately.
+
+    """
+    connection = transaction.get_connection()
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is None or not connection.in_atomic_block:
+        create_missing_links({household_id: set([person_id])})
+        return
+    refs = getattr(_pending, 'refs', None)
+    if refs is None:
+        refs = _pending.refs = dict()
+    ref = refs.get(connection.alias)
+    pending = None if ref is None else ref()
+    if pending is None:
+        pending = PendingLinks()
+        on_commit(pending)
+        refs[connection.alias] = weakref.ref(pending)
+    pending.touched.setdefault(household_id, set()).add(person_id)
+
+
+class MembersPopulator(object):
+    """Adds the children of the parents of a series of households as
+    members of these households.
+
+    For every household, every person who is linked as child (see
+    :mod:`lino_xl.lib.humanlinks`) to a member having a parent role
+    and who is not older than :attr:`adult_age
+    <lino_xl.lib.households.Plugin.adult_age>` becomes a member with
+    role :attr:`child <MemberRoles.child>` unless they are already a
+    child member.  Like when saving a membership manually, this also
+    creates the missing parent links between the parent members and
+    the new children (see :func:`get_missing_links`).
+
+    Households are processed in chunks of `chunk_size`, using a few
+    queries and one transaction per chunk.
+
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.today = dd.today()
+
+    def run(self, households=None):
+        """Populate the given households (a list of primary keys) or all
+        households.  Return the number of memberships created.
+
+        """
+        if households is None:
+            Household = rt.models.households.Household
+            households = Household.objects.order_by('pk').values_list(
+                'pk', flat=True)
+        households = list(households)
+        n = 0
+        for i in range(0, len(households), self.chunk_size):
+            n += self.populate(households[i:i + self.chunk_size])
+        return n
+
+    def populate(self, hh_ids):
+        Member = rt.models.households.Member
+        Link = rt.models.humanlinks.Link
+
+        parents = dict()  # household -> person ids of parent members
+        children = dict()  # household -> person ids of child members
+        for hh, person, role in Member.objects.filter(
+                household_id__in=hh_ids).order_by('id').values_list(
+                'household_id', 'person_id', 'role'):
+            if person is None:
+                continue
+            if role in parent_roles:
+                parents.setdefault(hh, []).append(person)
+            elif role in child_roles:
+                children.setdefault(hh, set()).add(person)
+
+        parent_ids = set([p for lst in parents.values() for p in lst])
+        if not parent_ids:
+            return 0
+        links = dict()  # parent -> child persons
+        for lnk in Link.objects.filter(
+                parent_id__in=parent_ids,
+                child__isnull=False).order_by('id').select_related('child'):
+            links.setdefault(lnk.parent_id, []).append(lnk.child)
+
+        person_fields = rt.models.households.person_fields
+        new_members = []
+        adult_age = dd.plugins.households.adult_age
+        for hh in hh_ids:
+            known = children.get(hh, set())
+            added = set()
+            for parent in parents.get(hh, []):
+                for child in links.get(parent, []):
+                    if child.pk in known or child.pk in added:
+                        continue
+                    age = child.get_age(self.today)
+                    if age is not None and age > adult_age:
+                        continue
+                    added.add(child.pk)
+                    mbr = Member(
+                        household_id=hh, person=child,
+                        dependency=MemberDependencies.full,
+                        role=MemberRoles.child)
+                    for k in person_fields:
+                        setattr(mbr, k, getattr(child, k))
+                    new_members.append(mbr)
+        if not new_members:
+            return 0
+
+        new_links = get_missing_links([
+            (parent, mbr.person_id) for mbr in new_members
+            for parent in parents[mbr.household_id]])
+
+        with transaction.atomic():
+            Member.objects.bulk_create(new_members)
+            Link.objects.bulk_create(new_links)
+        return len(new_members)
@@ -12,7 +12,11 @@ This module is probably useful in combination with
    :toctree:
 
     choicelists
+    genealogy
+    graph
     models
+    management.commands.export_kinship
+    management.commands.import_kinship
 
 """
 
@@ -0,0 +1,391 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Export and import the kinship graph of a site (human links,
+household memberships and couples) as a stream of compact records.
+See :manage:`export_kinship` and :manage:`import_kinship`.
+
+The file contains one JSON array per line.  The first item of every
+array says what the line describes:
+
+- ``["#", "lino-kinship", 1]`` : the header (format name and version)
+- ``["P", id, namekey, ssin]`` : a person.  The `id` is only used to
+  refer to this person within the file.  The `namekey` is
+  ``"last_name|first_name|birth_date"``, the `ssin` is the national
+  id (or `null` if the person has none).
+- ``["H", id, name, prefix]`` : a household
+- ``["M", household, person, role, dependency, primary, start_date,
+  end_date]`` : a household membership
+- ``["C", father, mother, married, divorced]`` : a couple
+- ``["L", type, parent, child]`` : a human link
+
+Choice values (`role`, `dependency`, `type`) are the values of the
+respective choicelists.  Persons and households come before the
+records which refer to them.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+from builtins import str
+
+import json
+
+from django.db import transaction
+from django.db.models import Case, When, Value
+
+from lino.api import dd, rt
+
+FORMAT = 'lino-kinship'
+VERSION = 1
+
+AMBIGUOUS = object()
+
+
+def choice_value(v):
+    return getattr(v, 'value', v)
+
+
+def date_value(v):
+    return str(v) if v else None
+
+
+def make_namekey(last_name, first_name, birth_date):
+    return '|'.join([last_name or '', first_name or '',
+                     str(birth_date or '')])
+
+
+def has_national_id(model):
+    return 'national_id' in [f.name for f in model._meta.get_fields()]
+
+
+def dumps(rec):
+    return str(json.dumps(rec, separators=(',', ':'))) + '\n'
+
+
+class KinshipExporter(object):
+    """Writes the kinship graph of this site to a stream.
+
+    All tables are read using :meth:`iterator
+    <django.db.models.query.QuerySet.iterator>` and the lines are
+    written as they come, so the memory used does not depend on the
+    number of links.
+
+    """
+    chunk_size = 1000
+
+    def __init__(self):
+        self.person_model = dd.plugins.humanlinks.person_model
+        self.count = 0
+
+    def write(self, stream):
+        """Write the whole graph to the given stream.  Return the number
+        of records written."""
+        Link = rt.models.humanlinks.Link
+        self.stream = stream
+        self.emit(['#', FORMAT, VERSION])
+        links = Link.objects.filter(child__isnull=False).order_by('id')
+        members = couples = None
+        persons = set()
+        for a, b in links.values_list('parent_id', 'child_id').iterator():
+            persons.add(a)
+            persons.add(b)
+        if dd.is_installed('households'):
+            members = rt.models.households.Member.objects.filter(
+                person__isnull=False).order_by('id')
+            persons.update(
+                members.values_list('person_id', flat=True).iterator())
+        if dd.is_installed('families'):
+            couples = rt.models.families.Couple.objects.filter(
+                father__isnull=False, mother__isnull=False).order_by('id')
+            for a, b in couples.values_list('father_id', 'mother_id'):
+                persons.add(a)
+                persons.add(b)
+        self.write_persons(sorted(persons))
+        if members is not None:
+            self.write_households(members)
+        if couples is not None:
+            for rec in couples.values_list(
+                    'father_id', 'mother_id', 'married',
+                    'divorced').iterator():
+                self.emit(['C', rec[0], rec[1], date_value(rec[2]),
+                           date_value(rec[3])])
+        for rec in links.values_list(
+                'type', 'parent_id', 'child_id').iterator():
+            self.emit(['L', choice_value(rec[0]), rec[1], rec[2]])
+        return self.count
+
+    def emit(self, rec):
+        self.stream.write(dumps(rec))
+        self.count += 1
+
+    def write_persons(self, pks):
+        fields = ['pk', 'last_name', 'first_name', 'birth_date']
+        if has_national_id(self.person_model):
+            fields.append('national_id')
+        qs = self.person_model.objects.order_by('pk')
+        for i in range(0, len(pks), self.chunk_size):
+            for rec in qs.filter(
+                    pk__in=pks[i:i + self.chunk_size]).values_list(*fields):
+                ssin = rec[4] if len(rec) > 4 else None
+                self.emit(['P', rec[0], make_namekey(*rec[1:4]),
+                           ssin or None])
+
+    def write_households(self, members):
+        Household = rt.models.households.Household
+        qs = Household.objects.filter(member__isnull=False).distinct()
+        for pk, name, prefix in qs.order_by('pk').values_list(
+                'pk', 'name', 'prefix').iterator():
+            self.emit(['H', pk, name, prefix])
+        for rec in members.values_list(
+                'household_id', 'person_id', 'role', 'dependency',
+                'primary', 'start_date', 'end_date').iterator():
+            self.emit(['M', rec[0], rec[1], choice_value(rec[2]),
+                       choice_value(rec[3]), rec[4],
+                       date_value(rec[5]), date_value(rec[6])])
+
+
+class KinshipImporter(object):
+    """Reads a stream written by :class:`KinshipExporter` and merges it
+    into this site.
+
+    Persons are never created.  They are resolved using an index of
+    all persons of this site which is loaded into memory once: by
+    their national id when both sides have one, otherwise (or when
+    the national id is not found) by their name and birth date.
+    Records which refer to a person who cannot be resolved (or who is
+    ambiguous) are skipped.
+
+    Households are matched by their name and prefix, and created when
+    no such household exists.  Memberships, couples and links are
+    read in chunks of `chunk_size` and every chunk is written in a
+    single transaction: the records which are already in the database
+    are updated when their role, dependency or type differs, the
+    others are created in bulk.  Existing data is never deleted.
+    Since memberships are created in bulk, no human links are created
+    automatically for them (the links come from the file).
+
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.person_model = dd.plugins.humanlinks.person_model
+        self.persons = dict()  # id in the file -> pk or None
+        self.households = dict()  # id in the file -> pk or None
+        self.by_ssin = None
+        self.by_namekey = None
+        self.hh_index = None
+        self.buffers = dict(M=[], C=[], L=[])
+        self.created = dict()
+        self.updated = dict()
+        self.skipped = dict()
+
+    def count(self, stats, kind, n=1):
+        stats[kind] = stats.get(kind, 0) + n
+
+    def read(self, stream):
+        """Read all records of the given stream."""
+        for ln, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            kind = rec[0]
+            if ln == 1 or kind == '#':
+                if kind != '#' or rec[1] != FORMAT or rec[2] > VERSION:
+                    raise Exception(
+                        "Line {0}: not a {1} file (version {2})".format(
+                            ln, FORMAT, VERSION))
+            elif kind == 'P':
+                self.persons[rec[1]] = self.resolve_person(*rec[2:4])
+            elif kind == 'H':
+                self.households[rec[1]] = self.resolve_household(*rec[2:4])
+            elif kind in self.buffers:
+                buf = self.buffers[kind]
+                buf.append(rec)
+                if len(buf) >= self.chunk_size:
+                    self.flush(kind)
+            else:
+                raise Exception(
+                    "Line {0}: invalid record type {1}".format(ln, kind))
+        for kind in self.buffers:
+            self.flush(kind)
+        return self
+
+    def load_persons(self):
+        fields = ['pk', 'last_name', 'first_name', 'birth_date']
+        with_ssin = has_national_id(self.person_model)
+        if with_ssin:
+            fields.append('national_id')
+        self.by_ssin = dict()
+        self.by_namekey = dict()
+
+        def add(index, k, pk):
+            index[k] = AMBIGUOUS if k in index else pk
+
+        for rec in self.person_model.objects.values_list(
+                *fields).iterator():
+            add(self.by_namekey, make_namekey(*rec[1:4]), rec[0])
+            if with_ssin and rec[4]:
+                add(self.by_ssin, rec[4], rec[0])
+        if not with_ssin:
+            self.by_ssin = None
+
+    def resolve_person(self, namekey, ssin):
+        if self.by_namekey is None:
+            self.load_persons()
+        pk = None
+        if ssin and self.by_ssin is not None:
+            pk = self.by_ssin.get(ssin)
+        if pk is None:
+            pk = self.by_namekey.get(namekey)
+        if pk is None or pk is AMBIGUOUS:
+            self.count(self.skipped, 'P')
+            return None
+        return pk
+
+    def resolve_household(self, name, prefix):
+        if not dd.is_installed('households'):
+            return None
+        Household = rt.models.households.Household
+        if self.hh_index is None:
+            self.hh_index = dict()
+            for pk, k1, k2 in Household.objects.values_list(
+                    'pk', 'name', 'prefix').iterator():
+                k = (k1, k2)
+                self.hh_index[k] = AMBIGUOUS if k in self.hh_index else pk
+        pk = self.hh_index.get((name, prefix))
+        if pk is AMBIGUOUS:
+            self.count(self.skipped, 'H')
+            return None
+        if pk is None:
+            hh = Household(name=name, prefix=prefix)
+            hh.full_clean()
+            hh.save()
+            pk = self.hh_index[(name, prefix)] = hh.pk
+            self.count(self.created, 'H')
+        return pk
+
+    def flush(self, kind):
+        rows = self.buffers[kind]
+        if not rows:
+            return
+        self.buffers[kind] = []
+        with transaction.atomic():
+            getattr(self, 'flush_' + kind)(rows)
+
+    def update_values(self, model, fieldname, values):
+        """Set the given field of the given rows (a dict mapping the
+        primary key to the new value) using one UPDATE statement per
+        chunk."""
+        pks = sorted(values)
+        for i in range(0, len(pks), self.chunk_size):
+            chunk = pks[i:i + self.chunk_size]
+            model.objects.filter(pk__in=chunk).update(**{fieldname: Case(*[
+                When(pk=pk, then=Value(values[pk])) for pk in chunk])})
+
+    def flush_L(self, rows):
+        Link = rt.models.humanlinks.Link
+        LinkTypes = rt.models.humanlinks.LinkTypes
+        wanted = dict()  # (parent, child) -> type
+        for rec in rows:
+            parent = self.persons.get(rec[2])
+            child = self.persons.get(rec[3])
+            if parent is None or child is None \
+               or LinkTypes.get_by_value(rec[1]) is None:
+                self.count(self.skipped, 'L')
+                continue
+            wanted[(parent, child)] = rec[1]
+        existing = dict()
+        for pk, parent, child, type in Link.objects.filter(
+                parent_id__in=set([p for p, c in wanted])).values_list(
+                'id', 'parent_id', 'child_id', 'type'):
+            existing[(parent, child)] = (pk, choice_value(type))
+        new = []
+        changed = dict()
+        for k, type in wanted.items():
+            if k in existing:
+                pk, old = existing[k]
+                if old != type:
+                    changed[pk] = type
+            else:
+                new.append(Link(
+                    parent_id=k[0], child_id=k[1],
+                    type=LinkTypes.get_by_value(type)))
+        Link.objects.bulk_create(new)
+        self.update_values(Link, 'type', changed)
+        self.count(self.created, 'L', len(new))
+        self.count(self.updated, 'L', len(changed))
+
+    def flush_M(self, rows):
+        Member = rt.models.households.Member
+        MemberRoles = rt.models.households.MemberRoles
+        MemberDependencies = rt.models.households.MemberDependencies
+        wanted = dict()  # (household, person) -> record
+        for rec in rows:
+            hh = self.households.get(rec[1])
+            person = self.persons.get(rec[2])
+            if hh is None or person is None:
+                self.count(self.skipped, 'M')
+                continue
+            wanted[(hh, person)] = rec
+        existing = dict()
+        for pk, hh, person, role, dependency in Member.objects.filter(
+                household_id__in=set([h for h, p in wanted])).values_list(
+                'id', 'household_id', 'person_id', 'role', 'dependency'):
+            existing[(hh, person)] = (
+                pk, choice_value(role), choice_value(dependency))
+        new = []
+        roles = dict()
+        dependencies = dict()
+        for k, rec in wanted.items():
+            if k in existing:
+                pk, role, dependency = existing[k]
+                if rec[3] != role:
+                    roles[pk] = rec[3]
+                if rec[4] != dependency:
+                    dependencies[pk] = rec[4]
+            else:
+                new.append(Member(
+                    household_id=k[0], person_id=k[1],
+                    role=MemberRoles.get_by_value(rec[3]),
+                    dependency=MemberDependencies.get_by_value(rec[4]),
+                    primary=rec[5], start_date=rec[6], end_date=rec[7]))
+        if new:
+            # copy the data fields like Member.full_clean() does
+            names = ('first_name', 'last_name', 'gender', 'birth_date')
+            persons = dict([
+                (r[0], r[1:]) for r in self.person_model.objects.filter(
+                    pk__in=[m.person_id for m in new]).values_list(
+                    'pk', *names)])
+            for m in new:
+                for k, v in zip(names, persons[m.person_id]):
+                    setattr(m, k, v)
+        Member.objects.bulk_create(new)
+        self.update_values(Member, 'role', roles)
+        self.update_values(Member, 'dependency', dependencies)
+        self.count(self.created, 'M', len(new))
+        self.count(self.updated, 'M', len(set(roles) | set(dependencies)))
+
+    def flush_C(self, rows):
+        if not dd.is_installed('families'):
+            self.count(self.skipped, 'C', len(rows))
+            return
+        Couple = rt.models.families.Couple
+        wanted = dict()  # (father, mother) -> record
+        for rec in rows:
+            father = self.persons.get(rec[1])
+            mother = self.persons.get(rec[2])
+            if father is None or mother is None:
+                self.count(self.skipped, 'C')
+                continue
+            wanted[(father, mother)] = rec
+        existing = set(Couple.objects.filter(
+            father_id__in=set([f for f, m in wanted])).values_list(
+            'father_id', 'mother_id'))
+        new = [Couple(father_id=k[0], mother_id=k[1],
+                      married=rec[3], divorced=rec[4])
+               for k, rec in wanted.items() if k not in existing]
+        Couple.objects.bulk_create(new)
+        self.count(self.created, 'C', len(new))
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""An in-memory graph of the :class:`Link
+<lino_xl.lib.humanlinks.models.Link>` objects around a given set of
+persons.
+
+Usage example::
+
+    from lino_xl.lib.humanlinks.graph import get_kinship_graph
+    g = get_kinship_graph(ar, obj)
+    for text, other in g.relationships(obj.pk):
+        print(text, other)
+
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+
+from collections import deque
+
+from django.db.models import Q
+
+from lino.api import rt
+
+from .choicelists import LinkTypes
+
+
+class KinshipGraph(object):
+    """The links of a series of persons and of their relatives, loaded
+    using one query per level of kinship.
+
+    A person is *expanded* when all their links have been loaded.
+    :meth:`expand` loads the links of the given persons and of their
+    relatives up to the given `depth`.  The other methods only look
+    at the links which have been loaded so far.
+
+    """
+
+    depth = 2
+    """The default number of levels to load."""
+
+    def __init__(self, depth=None):
+        if depth is not None:
+            self.depth = depth
+        self.links = dict()
+        self.persons = dict()
+        self.by_person = dict()
+        self.expanded = set()
+
+    def expand(self, *pks, **kwargs):
+        """Load the links of the persons with the given primary keys and of
+        their relatives, using one query per level.
+
+        """
+        Link = rt.models.humanlinks.Link
+        depth = kwargs.get('depth', self.depth)
+        todo = set([pk for pk in pks
+                    if pk is not None and pk not in self.expanded])
+        while todo and depth > 0:
+            qs = Link.objects.filter(
+                Q(parent_id__in=todo) | Q(child_id__in=todo))
+            qs = qs.select_related('parent', 'child')
+            self.expanded |= todo
+            found = set()
+            for lnk in qs:
+                if lnk.pk in self.links:
+                    continue
+                self.links[lnk.pk] = lnk
+                for pk, p in ((lnk.parent_id, lnk.parent),
+                              (lnk.child_id, lnk.child)):
+                    if pk is None:
+                        continue
+                    self.persons[pk] = p
+                    self.by_person.setdefault(pk, []).append(lnk)
+                    found.add(pk)
+            todo = found - self.expanded
+            depth -= 1
+        return self
+
+    def get_links(self, pk):
+        """Return the links for which the given person is either parent or
+        child."""
+        return self.by_person.get(pk, [])
+
+    def relationships(self, pk):
+        """Return a list of `(text, other)` tuples describing how the given
+        person is related to other persons, e.g. `("Father", bob)`.
+
+        """
+        result = []
+        for lnk in self.get_links(pk):
+            if lnk.parent_id is None or lnk.child_id is None:
+                continue
+            if lnk.child_id == pk:
+                result.append((lnk.type.as_child(lnk.child), lnk.parent))
+            else:
+                result.append((lnk.type.as_parent(lnk.parent), lnk.child))
+        return result
+
+    def parent_links(self, pk, types=None):
+        """Return the links to the parents of the given person (of the
+        given link types)."""
+        return [lnk for lnk in self.get_links(pk)
+                if lnk.child_id == pk and lnk.parent_id is not None
+                and (types is None or lnk.type in types)]
+
+    def child_links(self, pk, types=None):
+        """Return the links to the children of the given person (of the
+        given link types)."""
+        return [lnk for lnk in self.get_links(pk)
+                if lnk.parent_id == pk and lnk.child_id is not None
+                and (types is None or lnk.type in types)]
+
+    def siblings(self, pk):
+        """Return a list of the siblings of the given person: those who
+        have a common parent and those who are explicitly linked as
+        siblings.
+
+        """
+        Link = rt.models.humanlinks.Link
+        result = set()
+        for lnk in self.parent_links(pk, Link.parent_link_types):
+            for clnk in self.child_links(
+                    lnk.parent_id, Link.parent_link_types):
+                result.add(clnk.child_id)
+        for lnk in self.get_links(pk):
+            if lnk.type == LinkTypes.sibling:
+                result.add(lnk.parent_id)
+                result.add(lnk.child_id)
+        result.discard(pk)
+        result.discard(None)
+        return [self.persons[i] for i in sorted(result)]
+
+    def path(self, a, b):
+        """Return the shortest list of links which connect the persons `a`
+        and `b` (given as primary keys), or `None` if they are not
+        connected by the loaded links.
+
+        """
+        if a == b:
+            return []
+        prev = {a: None}
+        queue = deque([a])
+        while queue:
+            pk = queue.popleft()
+            for lnk in self.get_links(pk):
+                other = lnk.child_id if lnk.parent_id == pk \
+                    else lnk.parent_id
+                if other is None or other in prev:
+                    continue
+                prev[other] = (pk, lnk)
+                if other == b:
+                    result = []
+                    while prev[other] is not None:
+                        other, lnk = prev[other]
+                        result.append(lnk)
+                    result.reverse()
+                    return result
+                queue.append(other)
+        return None
+
+
+def get_kinship_graph(ar, *persons):
+    """Return the :class:`KinshipGraph` of the given action request,
+    making sure that the given persons have been expanded.  The graph
+    is created when needed and then cached in the request.
+
+    """
+    g = getattr(ar, '_kinship_graph', None) if ar is not None else None
+    if g is None:
+        g = KinshipGraph()
+        if ar is not None:
+            ar._kinship_graph = g
+    g.expand(*[getattr(p, 'pk', p) for p in persons])
+    return g
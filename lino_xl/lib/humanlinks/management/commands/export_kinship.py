@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: export_kinship
+
+Write the human links, household memberships and couples of this site
+to a file which can be read by :manage:`import_kinship`.  See
+:mod:`lino_xl.lib.humanlinks.genealogy` for the file format.
+
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.humanlinks.genealogy import KinshipExporter
+
+
+class Command(BaseCommand):
+    help = "Export the kinship graph of this site."
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', nargs='?', default=None,
+                            help='The file to write to '
+                            '(default is stdout).')
+
+    def handle(self, *args, **options):
+        exporter = KinshipExporter()
+        fn = options['filename']
+        if fn:
+            with codecs.open(fn, 'w', 'utf-8') as f:
+                n = exporter.write(f)
+            dblogger.info("Wrote %d records to %s.", n, fn)
+        else:
+            exporter.write(self.stdout)
@@ -0,0 +1,46 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+""".. management_command:: import_kinship
+
+Merge a file written by :manage:`export_kinship` into this site.  See
+:class:`lino_xl.lib.humanlinks.genealogy.KinshipImporter`.
+
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+
+from django.core.management.base import BaseCommand
+
+from lino.utils import dblogger
+
+from lino_xl.lib.humanlinks.genealogy import KinshipImporter
+
+KINDS = (('H', "households"), ('M', "memberships"),
+         ('C', "couples"), ('L', "links"))
+
+
+class Command(BaseCommand):
+    help = "Import a kinship graph exported from another site."
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='The file to read.')
+        parser.add_argument('--chunk-size', action='store', type=int,
+                            dest='chunk_size', default=1000,
+                            help='Number of records per transaction.')
+
+    def handle(self, *args, **options):
+        importer = KinshipImporter(options['chunk_size'])
+        with codecs.open(options['filename'], 'r', 'utf-8') as f:
+            importer.read(f)
+        for kind, text in KINDS:
+            dblogger.info(
+                "%s: %d created, %d updated, %d skipped.", text,
+                importer.created.get(kind, 0),
+                importer.updated.get(kind, 0),
+                importer.skipped.get(kind, 0))
+        dblogger.info("%d persons could not be resolved.",
+                      importer.skipped.get('P', 0))
@@ -22,6 +22,7 @@ from lino_xl.lib.contacts.roles import ContactsUser, ContactsStaff
 from lino.api import dd, rt
 from lino.utils.xmlgen.html import E
 from .choicelists import LinkTypes
+from .graph import KinshipGraph, get_kinship_graph
 
 config = dd.plugins.humanlinks
 
@@ -91,10 +92,9 @@ class Link(dd.Model):
         another parent of same sex, then it becomes a foster child,
         otherwise a natural child.
 
-        This is called from
-        :class:`lino_welfare.modlib.households.models.Member` to
-        automatically create human links between two household
-        members.
+        Household members use the set-based version of this,
+        :func:`lino_xl.lib.households.populate.get_missing_links`, to
+        automatically create human links between them.
 
         """
         if parent is None or child is None:
@@ -102,22 +102,20 @@ class Link(dd.Model):
         if parent == child:
             return False
             # raise ValidationError("Parent and Child must differ")
-        qs = cls.objects.filter(
-            parent=parent, child=child, type__in=cls.parent_link_types)
-        if qs.count() == 0:
-            qs = cls.objects.filter(
-                child=child, type__in=cls.parent_link_types)
-            qs = qs.exclude(parent__gender=parent.gender)
-            if qs.count() == 0:
-                auto_type = LinkTypes.parent
-            else:
-                auto_type = LinkTypes.foster_parent
-            obj = cls(parent=parent, child=child, type=auto_type)
-            obj.full_clean()
-            obj.save()
-            # dd.logger.info("20141018 autocreated %s", obj)
-            return True
-        return False
+        g = KinshipGraph(depth=1).expand(child.pk)
+        parent_links = g.parent_links(child.pk, cls.parent_link_types)
+        if [lnk for lnk in parent_links if lnk.parent_id == parent.pk]:
+            return False
+        if [lnk for lnk in parent_links
+                if lnk.parent.gender != parent.gender]:
+            auto_type = LinkTypes.foster_parent
+        else:
+            auto_type = LinkTypes.parent
+        obj = cls(parent=parent, child=child, type=auto_type)
+        obj.full_clean()
+        obj.save()
+        # dd.logger.info("20141018 autocreated %s", obj)
+        return True
 
 
 class Links(dd.Table):
@@ -184,17 +182,7 @@ class LinksByHuman(Links):
         # if obj.pk is None:
         #     return ''
         #     raise Exception("20150218")
-        sar = self.request_from(ar, master_instance=obj)
-        links = []
-        for lnk in sar:
-            if lnk.parent is None or lnk.child is None:
-                pass
-            else:
-                if lnk.child_id == obj.id:
-                    i = (lnk.type.as_child(obj), lnk.parent)
-                else:
-                    i = (lnk.type.as_parent(obj), lnk.child)
-                links.append(i)
+        links = get_kinship_graph(ar, obj).relationships(obj.pk)
 
         try:
             links.sort(
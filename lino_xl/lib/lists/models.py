@@ -63,6 +63,14 @@ class List(mixins.BabelNamed, mixins.Referrable):
 
     print_labels = PrintLabelsAction()
 
+    def get_campaign_partners(self):
+        """Return the members of this list.  See
+        :class:`lino_xl.lib.outbox.models.Campaign`.
+
+        """
+        Partner = dd.resolve_model(dd.plugins.lists.partner_model)
+        return Partner.objects.filter(list_memberships__list=self).distinct()
+
 
 class Lists(dd.Table):
     required_roles = dd.required(OfficeUser)
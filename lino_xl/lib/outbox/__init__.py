@@ -10,6 +10,7 @@
    models
    mixins
    choicelists
+   utils
    fixtures.hello
 
 
@@ -27,13 +28,48 @@ class Plugin(ad.Plugin):
 
     MODULE_LABEL = _("Outbox")
 
+    delivery_batch_size = 50
+    """The maximum number of queued mails to send in one batch.  Every
+    worker of a batch uses a single SMTP connection.  See :func:`send_queued_mails
+    <lino_xl.lib.outbox.models.send_queued_mails>`.
+    """
+
+    delivery_workers = 1
+    """The number of threads to use for sending queued mails.  Every
+    thread uses its own SMTP connection."""
+
+    delivery_rate = None
+    """The maximum number of mails to send per second, or `None` for no
+    limit."""
+
+    campaign_chunk_size = 500
+    """The number of mails to create per database transaction when
+    starting a :class:`Campaign
+    <lino_xl.lib.outbox.models.Campaign>`."""
+
+    delivery_max_attempts = 5
+    """The number of times to try sending a mail before marking it as
+    failed."""
+
+    delivery_retry_delay = 60
+    """The number of seconds to wait before the first retry of a mail
+    which could not be sent.  The delay doubles with every further
+    attempt."""
+
+    delivery_claim_timeout = 600
+    """The number of seconds after which a mail which is still being
+    sent is considered abandoned (e.g. because the process sending it
+    was killed) and may be sent by another process."""
+
     def setup_main_menu(config, site, profile, m):
         mg = site.plugins.office
         m = m.add_menu(mg.app_label, mg.verbose_name)
         m.add_action('outbox.MyOutbox')
+        m.add_action('outbox.Campaigns')
 
     def setup_explorer_menu(config, site, profile, m):
         mg = site.plugins.office
         m = m.add_menu(mg.app_label, mg.verbose_name)
         m.add_action('outbox.Mails')
+        m.add_action('outbox.QueuedMails')
         m.add_action('outbox.Attachments')
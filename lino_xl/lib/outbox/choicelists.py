@@ -23,3 +23,19 @@ add('bcc', _("bcc"), 'bcc')
 #~ add('snail',_("Snail mail"),'snail')
 
 
+
+
+class DeliveryStates(dd.ChoiceList):
+
+    """A list of possible values for the `delivery_state` field of a
+    :class:`Mail <lino_xl.lib.outbox.models.Mail>`.
+
+    """
+    verbose_name = _("Delivery state")
+    verbose_name_plural = _("Delivery states")
+
+add = DeliveryStates.add_item
+add('10', _("Queued"), 'queued')
+add('15', _("Sending"), 'sending')
+add('20', _("Sent"), 'sent')
+add('30', _("Failed"), 'failed')
@@ -12,13 +12,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 import os
+import datetime
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
+from django.utils import translation
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 
+from jinja2.sandbox import SandboxedEnvironment
+
 
 from lino import mixins
 from lino.api import dd
@@ -30,8 +35,10 @@ from lino.modlib.gfks.mixins import Controllable
 from lino.modlib.users.mixins import UserAuthored
 from lino.modlib.office.roles import OfficeUser, OfficeStaff
 from lino.modlib.printing.mixins import Printable
+from lino_xl.lib.xl.utils import get_page_ids
 
-from .choicelists import RecipientTypes
+from .choicelists import RecipientTypes, DeliveryStates
+from .utils import deliver_mails, is_connection_error
 
 
 @dd.python_2_unicode_compatible
@@ -112,87 +119,25 @@ class SendMail(dd.Action):
     def get_action_permission(self, ar, obj, state):
         if obj is not None and obj.sent:
             return False
+        if obj is not None and obj.is_pending():
+            return False
         return super(SendMail, self).get_action_permission(ar, obj, state)
 
     def run_from_ui(self, ar, **kw):
         elem = ar.selected_rows[0]
-        #~ if elem.sent:
-            #~ return rr.ui.error(message='Mail has already been sent.')
-        #~ subject = elem.subject
-        #~ sender = "%s <%s>" % (rr.get_user().get_full_name(),rr.get_user().email)
-        sender = "%s <%s>" % (elem.user.get_full_name(), elem.user.email)
-        #~ recipients = list(elem.get_recipients_to())
-        to = []
-        cc = []
-        bcc = []
-        found = False
-        missing_addresses = []
-        for r in elem.recipient_set.all():
-            recipients = None
-            if r.type == RecipientTypes.to:
-                recipients = to
-            elif r.type == RecipientTypes.cc:
-                recipients = cc
-            elif r.type == RecipientTypes.bcc:
-                recipients = bcc
-            if recipients is not None:
-                if not r.address:
-                    missing_addresses.append(r)
-                if r.address.endswith('@example.com'):
-                    logger.info("20120712 ignored recipient %s",
-                                r.name_address())
-                else:
-                    recipients.append(r.name_address())
-                found = True
-            #~ else:
-                #~ logger.info("Ignoring recipient %s (type %s)",r,r.type)
-        if not found:
-            return ar.error(_("No recipients found."))
-        if len(missing_addresses):
-            msg = _("There are recipients without address: ")
-            msg += ', '.join([unicode(r) for r in missing_addresses])
-            return ar.error(msg, alert=True)
-        #~ as_attachment = elem.owner.attach_to_email(rr)
-        #~ body = elem.body
-        #~ if as_attachment:
-            #~ body = elem.body
-        #~ else:
-            #~ body = elem.owner.get_mailable_body(rr)
-        text_content = html2text(elem.body)
-        msg = EmailMultiAlternatives(subject=elem.subject,
-                                     from_email=sender,
-                                     body=text_content,
-                                     to=to, bcc=bcc, cc=cc)
-        msg.attach_alternative(elem.body, "text/html")
-        for att in elem.attachment_set.all():
-            #~ if as_attachment or att.owner != elem.owner:
-            fn = att.owner.get_target_name()
-            if fn is None:
-                raise Warning(_("Couldn't find target file of %s") % att.owner)
-            msg.attach_file(fn)
-
-        uploads = dd.resolve_app("uploads")
-        for up in uploads.UploadsByController.request(elem):
-        #~ for up in uploads.Upload.objects.filter(owner=elem):
-            fn = os.path.join(settings.MEDIA_ROOT, up.file.name)
-            msg.attach_file(fn)
-
-        num_sent = msg.send()
-
-        elem.sent = timezone.now()
+        # build the message just to report problems with recipients
+        # or attachments immediately
+        email = elem.build_message()
+        elem.enqueue()
+        elem.full_clean()
+        elem.save()
         kw.update(refresh=True)
-        #~ msg = "Email %s from %s has been sent to %s." % (
-            #~ elem.id,elem.sender,', '.join([
-                #~ r.address for r in elem.recipient_set.all()]))
-        msg = _("Email %(id)s from %(sender)s has been sent to %(num)d recipients.") % dict(
-            id=elem.id, sender=sender, num=num_sent)
+        msg = _("Email %(id)s from %(sender)s has been queued for "
+                "delivery to %(num)d recipients.") % dict(
+            id=elem.id, sender=email.from_email,
+            num=len(email.recipients()))
         kw.update(message=msg, alert=True)
-        #~ for n in """EMAIL_HOST SERVER_EMAIL EMAIL_USE_TLS EMAIL_BACKEND""".split():
-            #~ msg += "\n" + n + " = " + unicode(getattr(settings,n))
         logger.info(msg)
-        if elem.owner:
-            elem.owner.after_send_mail(elem, ar, kw)
-        elem.save()
         ar.success(**kw)
 
 
@@ -203,6 +148,8 @@ class Mail(UserAuthored, Printable,
     class Meta:
         verbose_name = _("Outgoing Mail")
         verbose_name_plural = _("Outgoing Mails")
+        # a campaign sends only one mail to every partner
+        unique_together = ('campaign', 'owner_type', 'owner_id')
 
     send_mail = SendMail()
 
@@ -226,6 +173,18 @@ class Mail(UserAuthored, Printable,
         #~ blank=True,null=True)
     sent = models.DateTimeField(null=True, editable=False)
 
+    campaign = dd.ForeignKey(
+        'outbox.Campaign', blank=True, null=True, editable=False)
+
+    delivery_state = DeliveryStates.field(blank=True, editable=False)
+    queued = models.DateTimeField(_("Queued"), null=True, editable=False)
+    next_attempt = models.DateTimeField(
+        _("Next attempt"), null=True, editable=False)
+    delivery_attempts = models.IntegerField(
+        _("Attempts"), default=0, editable=False)
+    delivery_error = models.TextField(
+        _("Delivery error"), blank=True, editable=False)
+
     def on_create(self, ar):
         self.date = settings.SITE.today()
         super(Mail, self).on_create(ar)
@@ -253,11 +212,197 @@ class Mail(UserAuthored, Printable,
         return ', '.join(recs)
     recipients = dd.VirtualField(dd.HtmlBox(_("Recipients")), get_recipients)
 
+    @dd.displayfield(_("Latency"))
+    def latency(self, ar):
+        """The time between queuing and sending this mail."""
+        if self.queued and self.sent:
+            return str(self.sent - self.queued)
+        return ''
+
+    def build_message(self, connection=None):
+        """Return an :class:`EmailMultiAlternatives` for this mail.
+
+        Raises a :class:`Warning` if something is missing.
+
+        """
+        sender = "%s <%s>" % (self.user.get_full_name(), self.user.email)
+        to = []
+        cc = []
+        bcc = []
+        found = False
+        missing_addresses = []
+        for r in self.recipient_set.all():
+            recipients = None
+            if r.type == RecipientTypes.to:
+                recipients = to
+            elif r.type == RecipientTypes.cc:
+                recipients = cc
+            elif r.type == RecipientTypes.bcc:
+                recipients = bcc
+            if recipients is not None:
+                if not r.address:
+                    missing_addresses.append(r)
+                if r.address.endswith('@example.com'):
+                    logger.info("20120712 ignored recipient %s",
+                                r.name_address())
+                else:
+                    recipients.append(r.name_address())
+                found = True
+            #~ else:
+                #~ logger.info("Ignoring recipient %s (type %s)",r,r.type)
+        if not found:
+            raise Warning(_("No recipients found."))
+        if len(missing_addresses):
+            msg = _("There are recipients without address: ")
+            msg += ', '.join([str(r) for r in missing_addresses])
+            raise Warning(msg)
+        text_content = html2text(self.body)
+        msg = EmailMultiAlternatives(subject=self.subject,
+                                     from_email=sender,
+                                     body=text_content,
+                                     to=to, bcc=bcc, cc=cc,
+                                     connection=connection)
+        msg.attach_alternative(self.body, "text/html")
+        for att in self.attachment_set.all():
+            fn = att.owner.get_target_name()
+            if fn is None:
+                raise Warning(
+                    _("Couldn't find target file of %s") % att.owner)
+            msg.attach_file(fn)
+
+        uploads = dd.resolve_app("uploads")
+        for up in uploads.UploadsByController.request(self):
+            fn = os.path.join(settings.MEDIA_ROOT, up.file.name)
+            msg.attach_file(fn)
+        return msg
+
+    def enqueue(self):
+        """Mark this mail as waiting to be sent by
+        :func:`send_queued_mails`.  Does not save it."""
+        self.delivery_state = DeliveryStates.queued
+        self.queued = timezone.now()
+        self.next_attempt = None
+        self.delivery_attempts = 0
+        self.delivery_error = ''
+
+    def is_pending(self):
+        """Whether this mail is waiting in the queue or being sent."""
+        return self.delivery_state in (
+            DeliveryStates.queued, DeliveryStates.sending)
+
+    def claim(self):
+        """Mark this mail as being sent by the current process.  Return
+        `False` if it has meanwhile been sent or is being sent by
+        another process.
+
+        The state is changed by a single conditional `UPDATE`
+        statement, so only one process can claim a given mail.  A
+        claim expires after :attr:`delivery_claim_timeout
+        <lino_xl.lib.outbox.Plugin.delivery_claim_timeout>` seconds.
+
+        """
+        now = timezone.now()
+        expires = now + datetime.timedelta(
+            seconds=dd.plugins.outbox.delivery_claim_timeout)
+        due = (models.Q(next_attempt__isnull=True) |
+               models.Q(next_attempt__lte=now))
+        qs = Mail.objects.filter(pk=self.pk).filter(
+            (models.Q(delivery_state=DeliveryStates.queued) & due) |
+            models.Q(delivery_state=DeliveryStates.sending,
+                     next_attempt__lte=now))
+        if qs.update(delivery_state=DeliveryStates.sending,
+                     next_attempt=expires) == 0:
+            return False
+        self.delivery_state = DeliveryStates.sending
+        self.next_attempt = expires
+        return True
+
+    def deliver(self, connection):
+        """Try to send this mail using the given (open) connection and
+        record the result.  When sending fails, schedule a retry or
+        mark this mail as failed after
+        :attr:`delivery_max_attempts
+        <lino_xl.lib.outbox.Plugin.delivery_max_attempts>`.
+
+        When the connection to the SMTP server has been lost, put this
+        mail back into the queue without counting an attempt and
+        re-raise the exception.
+
+        """
+        try:
+            msg = self.build_message(connection)
+            num_sent = msg.send()
+        except Exception as e:
+            if is_connection_error(e):
+                self.delivery_state = DeliveryStates.queued
+                self.next_attempt = None
+                self.save()
+                raise
+            self.delivery_attempts += 1
+            self.delivery_error = str(e)
+            if self.delivery_attempts >= dd.plugins.outbox.delivery_max_attempts:
+                self.delivery_state = DeliveryStates.failed
+                self.next_attempt = None
+                logger.warning("Failed to send %s : %s", self, e)
+            else:
+                self.delivery_state = DeliveryStates.queued
+                delay = dd.plugins.outbox.delivery_retry_delay * (
+                    2 ** (self.delivery_attempts - 1))
+                self.next_attempt = timezone.now() + datetime.timedelta(
+                    seconds=delay)
+                logger.info("Failed to send %s (will retry in %s seconds) "
+                            ": %s", self, delay, e)
+            self.save()
+            return False
+
+        self.delivery_attempts += 1
+        self.sent = timezone.now()
+        self.delivery_state = DeliveryStates.sent
+        self.next_attempt = None
+        self.delivery_error = ''
+        self.save()
+        logger.info("%s has been sent to %d recipients (latency %s).",
+                    self, num_sent, self.sent - self.queued)
+        if self.owner:
+            # the mail has been sent, so a failure here must not cause
+            # it to be sent again
+            try:
+                ar = settings.SITE.login(self.user.username)
+                self.owner.after_send_mail(self, ar, dict())
+            except Exception as e:
+                logger.exception(
+                    "after_send_mail() of %s failed : %s", self.owner, e)
+        return True
+
+    @classmethod
+    def send_queued(cls, connection=None, limit=None):
+        """Send at most `limit` of the mails which are waiting in the
+        queue.  Return the number of mails which have successfully been
+        sent.  See :func:`lino_xl.lib.outbox.utils.deliver_mails`.
+
+        """
+        if limit is None:
+            limit = dd.plugins.outbox.delivery_batch_size
+        # mails which are being sent have a `next_attempt` (when
+        # their claim expires)
+        qs = cls.objects.filter(delivery_state__in=(
+            DeliveryStates.queued, DeliveryStates.sending))
+        qs = qs.filter(
+            models.Q(next_attempt__isnull=True) |
+            models.Q(next_attempt__lte=timezone.now()))
+        mails = list(qs.order_by('queued', 'id')[:limit])
+        if len(mails) == 0:
+            return 0
+        return deliver_mails(
+            mails, connection, workers=dd.plugins.outbox.delivery_workers,
+            rate=dd.plugins.outbox.delivery_rate)
+
     def get_row_permission(self, ar, state, ba):
         """
-        Mails may not be edited after they have been sent.
+        Mails may not be edited after they have been sent or while they
+        are waiting in the queue.
         """
-        if self.sent and not ba.action.readonly:
+        if (self.sent or self.is_pending()) and not ba.action.readonly:
             #~ logger.info("20120920 Mail.get_row_permission()")
             return False
         return super(Mail, self).get_row_permission(ar, state, ba)
@@ -277,8 +422,10 @@ class Mails(dd.Table):
     detail_layout = dd.DetailLayout("""
     subject project date
     user sent #build_time id owner
+    delivery_state queued delivery_attempts next_attempt latency
     RecipientsByMail:50x5 AttachmentsByMail:20x5 uploads.UploadsByController:20x5
     body:90x10
+    delivery_error
     """)
     insert_layout = dd.InsertLayout("""
     project
@@ -290,6 +437,20 @@ if not settings.SITE.project_model:
     Mails.detail_layout.remove_element('project')
 
 
+class QueuedMails(Mails):
+    """Shows the mails which are waiting to be sent."""
+    label = _("Queued mails")
+    column_names = "queued next_attempt delivery_attempts user " \
+                   "recipients subject delivery_error *"
+    order_by = ["queued"]
+
+    @classmethod
+    def get_request_queryset(self, ar):
+        qs = super(QueuedMails, self).get_request_queryset(ar)
+        return qs.filter(delivery_state__in=(
+            DeliveryStates.queued, DeliveryStates.sending))
+
+
 class MyOutbox(Mails):
     required_roles = dd.required(OfficeUser)
 
@@ -349,6 +510,238 @@ class SentByPartner(Mails):
         return qs
 
 
+class StartCampaign(dd.Action):
+    """Create and queue the mails of a :class:`Campaign`.
+
+    This may be run again on a campaign which has been interrupted: it
+    creates only the mails which do not yet exist.
+
+    """
+    icon_name = 'email_go'
+    label = _('Send mails')
+    callable_from = (actions.ShowTable,
+                     actions.ShowDetail)
+
+    def run_from_ui(self, ar, **kw):
+        obj = ar.selected_rows[0]
+        num = obj.create_mails(ar)
+        msg = _("%(num)d mails of %(campaign)s have been queued.") % dict(
+            num=num, campaign=obj)
+        logger.info(msg)
+        kw.update(message=msg, refresh=True)
+        ar.success(**kw)
+
+
+@dd.python_2_unicode_compatible
+class Campaign(UserAuthored, Controllable):
+    """A mass mailing which sends a personalized :class:`Mail` to every
+    partner provided by the :attr:`owner`.
+
+    .. attribute:: owner
+
+        The database object which provides the recipients.  This must
+        have a method `get_campaign_partners` which returns a queryset
+        of partners, e.g. a :class:`List
+        <lino_xl.lib.lists.models.List>`.
+
+    .. attribute:: subject
+    .. attribute:: body
+
+        Jinja templates which are rendered once for every recipient.
+        The context contains only the recipient as `partner`, this
+        campaign as `campaign` and the current date as `today`.
+        Since every office user can edit these templates, they are
+        rendered in a :class:`SandboxedEnvironment
+        <jinja2.sandbox.SandboxedEnvironment>`.
+
+    """
+
+    class Meta:
+        verbose_name = _("Mailing campaign")
+        verbose_name_plural = _("Mailing campaigns")
+
+    date = models.DateField(_("Date"), default=dd.today)
+    subject = models.CharField(_("Subject"), max_length=200)
+    body = dd.RichTextField(_("Body"), blank=True, format='html')
+
+    start_campaign = StartCampaign()
+
+    def __str__(self):
+        return self.subject
+
+    def get_partners(self):
+        """Return a queryset of the partners who have an email address
+        and are to receive a mail of this campaign.  Return `None` if
+        the owner cannot provide recipients.
+
+        """
+        if self.owner is None:
+            return None
+        meth = getattr(self.owner, 'get_campaign_partners', None)
+        if meth is None:
+            return None
+        return meth().exclude(email='')
+
+    def create_mails(self, ar):
+        """Create one queued mail (with its recipient) for every partner
+        who does not yet have a mail of this campaign.  Return the
+        number of created mails.
+
+        The templates are compiled once and rendered for every
+        partner.  Mails are created in chunks of
+        :attr:`campaign_chunk_size
+        <lino_xl.lib.outbox.Plugin.campaign_chunk_size>`, each chunk
+        within its own transaction.  When the same campaign is being
+        started by somebody else at the same time, the unique
+        constraint on the mails makes one of them fail.
+
+        """
+        partners = self.get_partners()
+        if partners is None:
+            raise Warning(
+                _("%s cannot provide recipients for a campaign.")
+                % self.owner)
+        ct = ContentType.objects.get_for_model(partners.model)
+        done = set(Mail.objects.filter(
+            campaign=self, owner_type=ct).values_list('owner_id', flat=True))
+
+        env = SandboxedEnvironment()
+        env.filters.update(
+            settings.SITE.plugins.jinja.renderer.jinja_env.filters)
+        subject_tpl = env.from_string(self.subject)
+        body_tpl = env.from_string(self.body)
+        context = dict(campaign=self, today=dd.today())
+        size = dd.plugins.outbox.campaign_chunk_size
+        count = 0
+        chunk = []
+        for p in partners.order_by('pk').iterator():
+            if p.pk in done:
+                continue
+            with translation.override(
+                    p.language or translation.get_language()):
+                context.update(partner=p)
+                chunk.append((p, subject_tpl.render(**context),
+                              body_tpl.render(**context)))
+            if len(chunk) >= size:
+                count += self.create_mails_chunk(ct, chunk)
+                chunk = []
+        if chunk:
+            count += self.create_mails_chunk(ct, chunk)
+        return count
+
+    def create_mails_chunk(self, ct, chunk):
+        now = timezone.now()
+        with transaction.atomic():
+            try:
+                Mail.objects.bulk_create([
+                    Mail(user=self.user, date=dd.today(), campaign=self,
+                         owner_type=ct, owner_id=p.pk,
+                         subject=subject, body=body,
+                         delivery_state=DeliveryStates.queued, queued=now)
+                    for p, subject, body in chunk])
+            except IntegrityError:
+                raise Warning(
+                    _("The mails of %s are being created by another "
+                      "user.") % self)
+            ids = dict(Mail.objects.filter(
+                campaign=self, owner_type=ct,
+                owner_id__in=[p.pk for p, subject, body in chunk]
+            ).values_list('owner_id', 'id'))
+            Recipient.objects.bulk_create([
+                Recipient(mail_id=ids[p.pk], partner=p,
+                          type=RecipientTypes.to, address=p.email,
+                          name=p.get_full_name(salutation=False))
+                for p, subject, body in chunk])
+        return len(chunk)
+
+    @dd.displayfield(_("Progress"))
+    def progress(self, ar):
+        if ar is None:
+            return ''
+        d = dict(get_campaign_progress(ar, self))
+        d.update(total=get_campaign_total(ar, self))
+        return _("%(created)d of %(total)d mails created, "
+                 "%(sent)d sent, %(failed)d failed") % d
+
+
+def get_campaign_progress(ar, obj):
+    """Return a dict with the number of `created`, `sent` and `failed`
+    mails of the given campaign.
+
+    The first call for a given table request computes these numbers
+    for all campaigns of the current page in a single query.
+
+    """
+    cache = getattr(ar, '_campaign_progress', None)
+    if cache is None:
+        cache = ar._campaign_progress = dict()
+    if obj.pk not in cache:
+        ids = get_page_ids(ar, obj, Campaign)
+
+        def count(state):
+            return models.Count(models.Case(
+                models.When(delivery_state=state, then=models.Value(1)),
+                output_field=models.IntegerField()))
+
+        for pk in ids:
+            cache[pk] = dict(created=0, sent=0, failed=0)
+        qs = Mail.objects.filter(campaign_id__in=ids).values(
+            'campaign_id').annotate(
+            created=models.Count('id'),
+            sent=count(DeliveryStates.sent),
+            failed=count(DeliveryStates.failed)).order_by()
+        for d in qs:
+            cache[d.pop('campaign_id')] = d
+    return cache[obj.pk]
+
+
+def get_campaign_total(ar, obj):
+    """Return the number of partners of the given campaign.  Campaigns
+    of a same owner have the same partners, so the partners are
+    counted only once per owner and table request.
+
+    """
+    cache = getattr(ar, '_campaign_totals', None)
+    if cache is None:
+        cache = ar._campaign_totals = dict()
+    k = (obj.owner_type_id, obj.owner_id)
+    if k not in cache:
+        partners = obj.get_partners()
+        cache[k] = partners.count() if partners is not None else 0
+    return cache[k]
+
+
+class Campaigns(dd.Table):
+    required_roles = dd.required(OfficeUser)
+    model = 'outbox.Campaign'
+    column_names = "date subject owner user progress *"
+    order_by = ["-date", "-id"]
+    detail_layout = dd.DetailLayout("""
+    subject date user id
+    owner_type owner_id progress
+    body:90x10
+    MailsByCampaign
+    """)
+    insert_layout = dd.InsertLayout("""
+    owner_type owner_id
+    subject
+    body
+    """, window_size=(60, 20))
+
+
+class CampaignsByController(Campaigns):
+    master_key = 'owner'
+    column_names = "date subject user progress *"
+
+
+class MailsByCampaign(Mails):
+    required_roles = dd.required(OfficeUser)
+    master_key = 'campaign'
+    column_names = "owner delivery_state sent delivery_attempts " \
+                   "delivery_error *"
+    order_by = ["id"]
+
+
 @dd.python_2_unicode_compatible
 class Attachment(Controllable):
 
@@ -399,3 +792,16 @@ class AttachmentsByController(Attachments):
 
 
 dd.update_field(Mail, 'user', verbose_name=_("Sender"))
+
+
+@dd.schedule_often(every=10)
+def send_queued_mails():
+    """Send the mails which have been queued by :class:`SendMail`.
+
+    Mails are sent in batches of :attr:`delivery_batch_size
+    <lino_xl.lib.outbox.Plugin.delivery_batch_size>`, each worker of
+    a batch reusing a single SMTP connection.
+
+    """
+    while Mail.send_queued() == dd.plugins.outbox.delivery_batch_size:
+        pass
@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Tests the delivery states of outgoing mails (see
+:meth:`Mail.claim <lino_xl.lib.outbox.models.Mail.claim>`,
+:meth:`Mail.deliver <lino_xl.lib.outbox.models.Mail.deliver>` and
+:meth:`Mail.send_queued <lino_xl.lib.outbox.models.Mail.send_queued>`).
+
+Mails are sent using Django's in-memory email backend.  These tests
+run on any site which has :mod:`lino_xl.lib.outbox` installed.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import smtplib
+
+from django.conf import settings
+from django.core import mail as django_mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from lino.api import dd, rt
+from lino.utils.djangotest import TestCase
+
+from lino_xl.lib.outbox.choicelists import DeliveryStates, RecipientTypes
+
+LOCMEM = 'django.core.mail.backends.locmem.EmailBackend'
+
+
+class DisconnectingBackend(EmailBackend):
+    """Loses the connection to the server when sending."""
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+class RefusingBackend(EmailBackend):
+    """Refuses all recipients."""
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPRecipientsRefused(dict())
+
+
+@override_settings(EMAIL_BACKEND=LOCMEM)
+class DeliveryTests(TestCase):
+
+    def setUp(self):
+        super(DeliveryTests, self).setUp()
+        self.max_attempts = dd.plugins.outbox.delivery_max_attempts
+        self.workers = dd.plugins.outbox.delivery_workers
+        # worker threads wouldn't see the data of the test transaction
+        dd.plugins.outbox.delivery_workers = 1
+        self.user = settings.SITE.user_model(
+            username='robin', email='robin@example.org')
+        self.user.save()
+
+    def tearDown(self):
+        dd.plugins.outbox.delivery_max_attempts = self.max_attempts
+        dd.plugins.outbox.delivery_workers = self.workers
+        super(DeliveryTests, self).tearDown()
+
+    def create_mail(self, subject="Hello"):
+        Mail = rt.models.outbox.Mail
+        Recipient = rt.models.outbox.Recipient
+        mail = Mail(user=self.user, subject=subject, body="<p>Hello</p>",
+                    date=dd.today())
+        mail.enqueue()
+        mail.save()
+        Recipient(mail=mail, type=RecipientTypes.to, name="Alice",
+                  address='alice@example.org').save()
+        return mail
+
+    def send_queued(self):
+        return rt.models.outbox.Mail.send_queued()
+
+    def reload(self, mail):
+        return rt.models.outbox.Mail.objects.get(pk=mail.pk)
+
+    def test_sent(self):
+        mail = self.create_mail()
+        self.assertEqual(self.send_queued(), 1)
+        mail = self.reload(mail)
+        self.assertEqual(mail.delivery_state, DeliveryStates.sent)
+        self.assertEqual(mail.delivery_attempts, 1)
+        self.assertIsNotNone(mail.sent)
+        self.assertIsNone(mail.next_attempt)
+        self.assertEqual(len(django_mail.outbox), 1)
+        self.assertEqual(django_mail.outbox[0].to,
+                         ["Alice <alice@example.org>"])
+        # a sent mail is not sent again
+        self.assertEqual(self.send_queued(), 0)
+        self.assertEqual(len(django_mail.outbox), 1)
+
+    def test_claim(self):
+        mail = self.create_mail()
+        self.assertTrue(mail.claim())
+        self.assertEqual(self.reload(mail).delivery_state,
+                         DeliveryStates.sending)
+        # a mail being sent cannot be claimed a second time
+        other = self.reload(mail)
+        self.assertFalse(other.claim())
+        self.assertEqual(self.send_queued(), 0)
+        # but an expired claim can
+        rt.models.outbox.Mail.objects.filter(pk=mail.pk).update(
+            next_attempt=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.send_queued(), 1)
+        self.assertEqual(self.reload(mail).delivery_state,
+                         DeliveryStates.sent)
+
+    def test_connection_lost(self):
+        mail = self.create_mail()
+        self.assertTrue(mail.claim())
+        connection = DisconnectingBackend()
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            mail.deliver(connection)
+        # the mail is back in the queue and no attempt was counted
+        mail = self.reload(mail)
+        self.assertEqual(mail.delivery_state, DeliveryStates.queued)
+        self.assertEqual(mail.delivery_attempts, 0)
+        self.assertIsNone(mail.next_attempt)
+        self.assertEqual(self.send_queued(), 1)
+        self.assertEqual(self.reload(mail).delivery_state,
+                         DeliveryStates.sent)
+
+    def test_retry_and_fail(self):
+        dd.plugins.outbox.delivery_max_attempts = 2
+        mail = self.create_mail()
+        connection = RefusingBackend()
+
+        self.assertTrue(mail.claim())
+        self.assertFalse(mail.deliver(connection))
+        mail = self.reload(mail)
+        self.assertEqual(mail.delivery_state, DeliveryStates.queued)
+        self.assertEqual(mail.delivery_attempts, 1)
+        self.assertNotEqual(mail.delivery_error, '')
+        # the retry is scheduled after delivery_retry_delay seconds
+        self.assertGreater(mail.next_attempt, timezone.now())
+        self.assertFalse(mail.claim())
+        self.assertEqual(self.send_queued(), 0)
+
+        rt.models.outbox.Mail.objects.filter(pk=mail.pk).update(
+            next_attempt=timezone.now() - datetime.timedelta(seconds=1))
+        mail = self.reload(mail)
+        self.assertTrue(mail.claim())
+        self.assertFalse(mail.deliver(connection))
+        mail = self.reload(mail)
+        self.assertEqual(mail.delivery_state, DeliveryStates.failed)
+        self.assertEqual(mail.delivery_attempts, 2)
+        self.assertIsNone(mail.next_attempt)
+        self.assertIsNone(mail.sent)
+        self.assertEqual(len(django_mail.outbox), 0)
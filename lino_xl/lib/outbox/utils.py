@@ -0,0 +1,143 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Utilities for sending the mails of :mod:`lino_xl.lib.outbox`.
+
+"""
+
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import socket
+import smtplib
+import threading
+
+from six.moves.queue import Queue, Empty
+
+from django.core.mail import get_connection
+from django import db
+
+
+class RateLimiter(object):
+    """Makes sure that :meth:`wait` returns at most `rate` times per
+    second, even when called from several threads.  A `rate` of
+    `None` means no limit.
+
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            t = max(now, self.next_time)
+            self.next_time = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+
+def is_connection_error(e):
+    """Return `True` if the given exception means that the connection to
+    the SMTP server has been lost (and not that the server refused a
+    given mail).
+
+    """
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    # under Python 3 every SMTPException is also a socket.error
+    return isinstance(e, socket.error) and not isinstance(
+        e, smtplib.SMTPException)
+
+
+def deliver_mails(mails, connection=None, workers=1, rate=None):
+    """Call :meth:`claim <lino_xl.lib.outbox.models.Mail.claim>` and
+    :meth:`deliver <lino_xl.lib.outbox.models.Mail.deliver>` on each
+    of the given mails and return the number of mails which have been
+    sent successfully.  Mails which have meanwhile been claimed by
+    another process are skipped.
+
+    When `workers` is more than 1, the mails are sent by as many
+    threads, each of them using its own SMTP connection.  The given
+    `connection` is used only when sending sequentially.  `rate` is
+    the maximum number of mails per second for all workers together.
+
+    When the connection gets lost while sending a mail, the worker
+    opens a new connection and sends that mail again.  If this fails
+    as well, the worker stops and leaves its remaining mails in the
+    queue for the next batch.
+
+    """
+    limiter = RateLimiter(rate)
+    queue = Queue()
+    for mail in mails:
+        queue.put(mail)
+    results = []
+
+    def work(connection):
+        try:
+            opened = connection.open()
+        except Exception as e:
+            logger.warning("Cannot open mail connection : %s", e)
+            return
+        fresh = True  # nothing has been sent since opening
+        try:
+            while True:
+                try:
+                    mail = queue.get_nowait()
+                except Empty:
+                    break
+                if not mail.claim():
+                    continue
+                limiter.wait()
+                try:
+                    results.append(mail.deliver(connection))
+                except Exception as e:
+                    if fresh or not is_connection_error(e):
+                        logger.warning(
+                            "Stop sending mails after %s : %s", mail, e)
+                        break
+                    logger.info("Reconnecting after %s : %s", mail, e)
+                    connection.close()
+                    opened = True
+                    try:
+                        connection.open()
+                    except Exception as e:
+                        logger.warning(
+                            "Cannot reopen mail connection : %s", e)
+                        break
+                    fresh = True
+                    queue.put(mail)
+                    continue
+                fresh = False
+        finally:
+            if opened:
+                connection.close()
+
+    if workers is None or workers <= 1:
+        work(connection or get_connection())
+        return results.count(True)
+
+    def thread_main():
+        try:
+            work(get_connection())
+        finally:
+            # every thread has its own database connection
+            db.connection.close()
+
+    threads = [threading.Thread(target=thread_main)
+               for i in range(min(workers, queue.qsize()))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results.count(True)
@@ -22,6 +22,15 @@ class Plugin(ad.Plugin):
 
     verbose_name = _("Properties")
 
+    choices_cache_timeout = 60
+    """The number of seconds after which the in-memory copy of the
+    property types and choices is reloaded.  Changes made in this
+    process are visible at once, but changes made by other processes
+    (e.g. other web server workers) only after this delay.  `None`
+    means to never reload it.
+
+    """
+
     def setup_explorer_menu(self, site, profile, m):
         m = m.add_menu(self.app_label, self.verbose_name)
         m.add_action('properties.Properties')
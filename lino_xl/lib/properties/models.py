@@ -20,8 +20,14 @@ A :class:`Property` defines the configuration of a property.
 """
 
 from builtins import str
+from builtins import object
+
+import threading
+import time
+from collections import OrderedDict
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 
@@ -128,13 +134,12 @@ class PropType(mixins.BabelNamed):
         if self.choicelist:
             cl = get_choicelist(self.choicelist)
             return cl.get_text_for_value(value)
+        choices = choices_cache.get_choices(self.pk)
         l = []
         for v in value.split(MULTIPLE_VALUES_SEP):
-            try:
-                pc = PropChoice.objects.get(value=v, type=self)
+            pc = choices.get(v)
+            if pc is not None:
                 v = dd.babelattr(pc, 'text')
-            except PropChoice.DoesNotExist:
-                pass
             l.append(v)
         return ','.join(l)
 
@@ -145,7 +150,7 @@ class PropType(mixins.BabelNamed):
         if self.choicelist:
             return get_choicelist(self.choicelist).get_choices()
         return [(pc.value, pc.text) for pc in
-                PropChoice.objects.filter(type=self).order_by('value')]
+                choices_cache.get_choices(self.pk).values()]
 
 
 @dd.python_2_unicode_compatible
@@ -251,7 +256,13 @@ class PropertyOccurence(dd.Model):
     def get_value_display(self, value):
         if self.property_id is None:
             return value
-        return self.property.type.get_text_for_value(value)
+        return self.get_prop_type().get_text_for_value(value)
+
+    def get_prop_type(self):
+        """Return the :class:`PropType` of the property of this
+        occurence, using the :data:`choices_cache`."""
+        return choices_cache.get_property_type(self.property_id) \
+            or self.property.type
 
     def full_clean(self):
         if self.property_id is not None:
@@ -263,7 +274,7 @@ class PropertyOccurence(dd.Model):
             return u"Undefined %s" % self.group
         # We must call str() because get_text_for_value might return a
         # lazyly translatable string:
-        return str(self.property.type.get_text_for_value(self.value))
+        return str(self.get_prop_type().get_text_for_value(self.value))
         # try:
         #     return str(self.property.type.get_text_for_value(self.value))
         # except UnicodeError:
@@ -279,6 +290,82 @@ class PropertyOccurence(dd.Model):
             #~ self.property.type.get_text_for_value(self.value))
 
 
+class PropChoicesCache(object):
+    """An in-memory copy of all property types, their choices and the
+    type of every property.
+
+    Everything is loaded using one query per model when first needed,
+    and forgotten whenever a :class:`PropType`, :class:`PropChoice`
+    or :class:`Property` is saved or deleted in this process.  Changes
+    made by other processes are seen after
+    :attr:`choices_cache_timeout
+    <lino_xl.lib.properties.Plugin.choices_cache_timeout>` seconds.
+
+    The loaded data is replaced as a whole, so a thread reading it
+    never sees a partly loaded or partly cleared copy.  Data which was
+    loaded while another thread cleared the cache is not kept.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.version = 0
+
+    def clear(self):
+        with self.lock:
+            self.data = None
+            self.version += 1
+
+    def load(self):
+        """Return a tuple `(types, choices, properties)`, loading them if
+        necessary."""
+        data = self.data
+        timeout = dd.plugins.properties.choices_cache_timeout
+        if data is not None:
+            if timeout is None or time.time() - data[0] < timeout:
+                return data[1:]
+        with self.lock:
+            version = self.version
+        loaded = time.time()
+        types = dict([(t.pk, t) for t in PropType.objects.all()])
+        choices = dict()
+        for pc in PropChoice.objects.order_by('type', 'value'):
+            choices.setdefault(pc.type_id, OrderedDict())[pc.value] = pc
+        properties = dict(Property.objects.values_list('pk', 'type_id'))
+        data = (loaded, types, choices, properties)
+        with self.lock:
+            if self.version == version:
+                self.data = data
+        return data[1:]
+
+    def get_choices(self, type_id):
+        """Return an ordered dict mapping the values of the choices of the
+        given property type to their :class:`PropChoice`."""
+        types, choices, properties = self.load()
+        return choices.get(type_id, {})
+
+    def get_property_type(self, property_id):
+        """Return the :class:`PropType` of the given property, or `None`
+        if there is no such property."""
+        types, choices, properties = self.load()
+        return types.get(properties.get(property_id))
+
+
+choices_cache = PropChoicesCache()
+"""The :class:`PropChoicesCache` of this process."""
+
+
+@dd.receiver(post_save, sender=PropType)
+@dd.receiver(post_delete, sender=PropType)
+@dd.receiver(post_save, sender=PropChoice)
+@dd.receiver(post_delete, sender=PropChoice)
+@dd.receiver(post_save, sender=Property)
+@dd.receiver(post_delete, sender=Property)
+def forget_prop_choices(sender, **kwargs):
+    choices_cache.clear()
+
+
 class PropGroups(dd.Table):
     required_roles = dd.required(dd.SiteStaff)
     model = PropGroup
@@ -25,6 +25,8 @@ data used here comes from uncertain sources.  One such source
 """
 
 
+from django.db import transaction
+
 from lino.api import dd
 from lino.core.utils import resolve_model
 from lino.utils import dblogger as logger
@@ -3367,6 +3369,11 @@ def objects():
 
     # ~ return # 20120531
     logger.info("Loading city INS codes")
+    places = dict()
+    for pk, zip_code, name in Place.objects.filter(country=BE).values_list(
+            'pk', 'zip_code', 'name'):
+        places.setdefault((zip_code, name), []).append(pk)
+    by_inscode = dict()
     for ln in CITIES.splitlines():
         if not ln.strip():
             continue
@@ -3374,20 +3381,24 @@ def objects():
         zip_code, name, inscode, x, y, z = a
         if not zip_code:
             continue
-        try:
-            city = Place.objects.get(country=BE, zip_code=zip_code, name=name)
-            city.inscode = inscode
-            logger.debug("inscode %s --> city %s", inscode, city)
-            yield city
-        except Place.MultipleObjectsReturned:
+        pks = places.get((zip_code, name), [])
+        if len(pks) == 1:
+            logger.debug("inscode %s --> city %s", inscode, pks[0])
+            by_inscode.setdefault(inscode, []).append(pks[0])
+        elif len(pks) > 1:
             logger.debug(
                 "Failed to set inscode %s because "
                 "there are multiple cities %s %s",
                 inscode, zip_code, name)
-        except Place.DoesNotExist:
+        else:
             logger.debug(
                 "Failed to set inscode %s because there's no city %s %s",
                 inscode, zip_code, name)
+    # One UPDATE per INS code (usually several places share the same
+    # INS code) instead of a query and a save per place.
+    with transaction.atomic():
+        for inscode, pks in by_inscode.items():
+            Place.objects.filter(pk__in=pks).update(inscode=inscode)
 
         #~ for city in Place.objects.filter(country=BE,zip_code=zip_code):
             #~ if city.inscode and city.inscode != inscode:
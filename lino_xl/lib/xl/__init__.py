@@ -11,5 +11,6 @@ but a :xfile:`locale` directory with translation messages for Django.
 
     roles
     mixins
+    utils
 
 """
@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2017 Luc Saffre
+# License: BSD (see file COPYING for details)
+
+"""Utilities used by several Lino XL plugins.
+
+"""
+
+from __future__ import unicode_literals
+from builtins import str
+
+from django.db import transaction
+from django.utils import translation
+
+from lino.api import dd, rt
+
+
+def get_page_ids(ar, obj, model=None):
+    """Return a set with the primary key of the given database object
+    and of the other rows of the current page of the given table
+    request which are instances of `model` (by default the model of
+    `obj`).
+
+    This is used by virtual fields which compute their values for a
+    whole page at once.  The rows of the page are used only when the
+    request has been executed already.  Otherwise (e.g. for a detail
+    view) we don't want to run the query of the request just for
+    this.
+
+    """
+    if model is None:
+        model = obj.__class__
+    ids = set([obj.pk])
+    must_execute = getattr(ar, 'must_execute', None)
+    if must_execute is not None and not must_execute():
+        ids |= set([r.pk for r in ar.sliced_data_iterator
+                    if isinstance(r, model)])
+    return ids
+
+
+def make_problem(checker, owner_type, owner_id, user, messages):
+    """Return an unsaved plausibility problem of the given checker for
+    the given owner, or `None` if `messages` is empty.
+
+    `messages` is a list of `(fixable, message)` tuples as yielded by
+    :meth:`get_plausibility_problems
+    <lino.modlib.plausibility.choicelists.Checker.get_plausibility_problems>`.
+    The messages are joined and translated to the language of the
+    responsible `user` like :meth:`update_problems
+    <lino.modlib.plausibility.choicelists.Checker.update_problems>`
+    does, and truncated to the length of the message field.
+
+    """
+    if not messages:
+        return None
+    Problem = rt.models.plausibility.Problem
+    todo = []
+    for fixable, msg in messages:
+        if fixable:
+            msg = u"(\u2605) " + str(msg)
+        todo.append(msg)
+    if user is None:
+        lang = dd.get_default_language()
+    else:
+        lang = user.language
+    with translation.override(lang):
+        msg = '\n'.join([str(s) for s in todo])
+    max_length = Problem._meta.get_field('message').max_length
+    return Problem(
+        owner_type=owner_type, owner_id=owner_id, checker=checker,
+        user=user, message=msg[:max_length])
+
+
+def replace_problems(checker, owner_type, problems, chunk_size=None):
+    """Replace all plausibility problems of the given checker for
+    owners of the given content type by the given list of unsaved
+    problems (as returned by :func:`make_problem`).
+
+    This runs in a single transaction and writes the problems in bulk.
+
+    """
+    Problem = rt.models.plausibility.Problem
+    with transaction.atomic():
+        Problem.objects.filter(
+            owner_type=owner_type, checker=checker).delete()
+        Problem.objects.bulk_create(problems, chunk_size)
@@ -81,8 +81,12 @@ lino_xl
 lino_xl.lib
 lino_xl.lib.addresses
 lino_xl.lib.addresses.fixtures
+lino_xl.lib.addresses.management
+lino_xl.lib.addresses.management.commands
 lino_xl.lib.appypod
 lino_xl.lib.beid
+lino_xl.lib.beid.management
+lino_xl.lib.beid.management.commands
 lino_xl.lib.blogs
 lino_xl.lib.boards
 lino_xl.lib.teams
@@ -93,6 +97,8 @@ lino_xl.lib.cal.management.commands
 lino_xl.lib.cal.workflows
 lino_xl.lib.coachings
 lino_xl.lib.coachings.fixtures
+lino_xl.lib.coachings.management
+lino_xl.lib.coachings.management.commands
 lino_xl.lib.concepts
 lino_xl.lib.contacts
 lino_xl.lib.contacts.fixtures
@@ -101,10 +107,16 @@ lino_xl.lib.contacts.management.commands
 lino_xl.lib.countries
 lino_xl.lib.countries.fixtures
 lino_xl.lib.courses
+lino_xl.lib.courses.management
+lino_xl.lib.courses.management.commands
 lino_xl.lib.cv
 lino_xl.lib.cv.fixtures
+lino_xl.lib.cv.management
+lino_xl.lib.cv.management.commands
 lino_xl.lib.dupable_partners
 lino_xl.lib.dupable_partners.fixtures
+lino_xl.lib.dupable_partners.management
+lino_xl.lib.dupable_partners.management.commands
 lino_xl.lib.eid_jslib
 lino_xl.lib.eid_jslib.beid
 lino_xl.lib.events
@@ -116,14 +128,19 @@ lino_xl.lib.extensible
 lino_xl.lib.families
 lino_xl.lib.households
 lino_xl.lib.households.fixtures
+lino_xl.lib.households.management
+lino_xl.lib.households.management.commands
 lino_xl.lib.humanlinks
 lino_xl.lib.humanlinks.fixtures
+lino_xl.lib.humanlinks.management
+lino_xl.lib.humanlinks.management.commands
 lino_xl.lib.lists
 lino_xl.lib.lists.fixtures
 lino_xl.lib.notes
 lino_xl.lib.notes.fixtures
 lino_xl.lib.outbox
 lino_xl.lib.outbox.fixtures
+lino_xl.lib.outbox.tests
 lino_xl.lib.pages
 lino_xl.lib.pages.fixtures
 lino_xl.lib.pisa